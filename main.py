@@ -1,7 +1,8 @@
 """
 main.py — Punto de entrada dual:
   - Render (uvicorn main:app)  → sirve la FastAPI
-  - CLI    (python main.py)    → comandos ingest/status/query
+  - CLI    (python main.py)    → comandos ingest/status/query/drain-outbox/update-metadata/reconcile/
+                                  migrate-namespaces/reproject/snapshot/migrate/build-lexical
 
 Render ejecuta: uvicorn main:app --host 0.0.0.0 --port $PORT
 CLI ejecuta:    python main.py ingest --project ...
@@ -38,12 +39,18 @@ def ingest(
     all: bool = typer.Option(False, "--all", help="Procesar todos los proyectos"),
     resume: bool = typer.Option(True, help="Omitir archivos ya indexados"),
     retry_failed: bool = typer.Option(False, "--retry-failed", help="Reintentar archivos fallidos"),
+    batch_mode: bool = typer.Option(False, "--batch-mode", help="Embeddings vía OpenAI Batch API (reindexaciones masivas)"),
+    fake_batch: bool = typer.Option(False, "--fake-batch", help="Con --batch-mode: usa una Batch API local (offline)"),
 ):
     """Ingesta PDFs de un proyecto (o todos) al índice Pinecone."""
     from pia_rag.etl.enriched_pipeline import EnrichedETLPipeline
 
     pipeline = EnrichedETLPipeline()
 
+    if batch_mode:
+        _ingest_batch(pipeline, project, all, resume, retry_failed, fake_batch)
+        return
+
     if all:
         # Process all project folders
         docs_dir = settings.documents_dir
@@ -81,6 +88,39 @@ def ingest(
         raise typer.Exit(1)
 
 
+def _ingest_batch(pipeline, project: Optional[str], all: bool, resume: bool, retry_failed: bool, fake: bool):
+    """Ingesta vía Batch API; re-ejecutar el mismo comando reanuda desde el checkpoint."""
+    from pia_rag.etl.batch_backfill import BatchBackfill, LocalBatchAPI
+
+    docs_dir = settings.documents_dir
+    if all:
+        project_dirs = sorted(d for d in docs_dir.iterdir() if d.is_dir() and not d.name.startswith("."))
+        job_name = "all"
+    elif project:
+        project_path = Path(project)
+        if not project_path.exists():
+            project_path = docs_dir / project
+        if not project_path.exists():
+            console.print(f"[red]No se encontró: {project_path}[/red]")
+            raise typer.Exit(1)
+        project_dirs = [project_path]
+        job_name = project_path.name
+    else:
+        console.print("[yellow]Especifica --project o --all[/yellow]")
+        raise typer.Exit(1)
+
+    job_dir = settings.data_dir / "batch" / job_name
+    api = LocalBatchAPI(job_dir / "fake_api") if fake else None
+    stats = BatchBackfill(job_name, pipeline, api=api).run(
+        project_dirs, resume=resume, retry_failed=retry_failed,
+    )
+    console.print(
+        f"[bold]Batch {stats['batch_id'] or '—'}[/bold]  {stats['phase']}  "
+        f"{stats['requests_upserted']}/{stats['requests']} requests  "
+        f"{stats['pdfs_indexed']}/{stats['pdfs']} PDFs  {stats['chunks']} chunks"
+    )
+
+
 def _print_stats(stats: dict):
     """Imprime estadísticas de ingesta."""
     status_color = "green" if stats["status"] == "complete" else "yellow"
@@ -93,6 +133,214 @@ def _print_stats(stats: dict):
     )
 
 
+# ── Outbox ──────────────────────────────────────────────────────────────────
+
+@cli.command("drain-outbox")
+def drain_outbox(
+    project: Optional[str] = typer.Option(None, help="ID del proyecto (por defecto, todos)"),
+):
+    """Reintenta los upserts a Pinecone que quedaron en el outbox."""
+    from pia_rag.etl.extraction_logger import ExtractionLogger
+    from pia_rag.storage.pinecone_client import PineconeClient
+    from pia_rag.storage.upsert_outbox import UpsertOutbox
+
+    pending = len(UpsertOutbox().entries(project))
+    if not pending:
+        console.print("[green]Outbox vacío[/green]")
+        return
+
+    console.print(f"Reintentando {pending} batches...")
+    confirmed = PineconeClient().drain_outbox(project)
+    loggers: dict[str, ExtractionLogger] = {}
+    for project_id, filename in sorted(confirmed):
+        if project_id not in loggers:
+            loggers[project_id] = ExtractionLogger(project_id)
+        loggers[project_id].confirm_upserts(filename)
+        console.print(f"[green]✓[/green] {project_id} / {filename}")
+
+    remaining = len(UpsertOutbox().entries(project))
+    style = "green" if remaining == 0 else "yellow"
+    console.print(f"[{style}]{len(confirmed)} archivos confirmados, {remaining} batches pendientes[/{style}]")
+
+
+# ── Metadata ────────────────────────────────────────────────────────────────
+
+@cli.command("update-metadata")
+def update_metadata(
+    project: str = typer.Option(..., help="Ruta o nombre de la carpeta del proyecto"),
+):
+    """Actualiza la metadata en Pinecone tras cambios en project.json / gdrive_map.json (sin re-embeber)."""
+    from pia_rag.etl.enriched_pipeline import EnrichedETLPipeline
+
+    project_path = Path(project)
+    if not project_path.exists():
+        project_path = settings.documents_dir / project
+    if not project_path.exists():
+        console.print(f"[red]No se encontró: {project_path}[/red]")
+        raise typer.Exit(1)
+
+    stats = EnrichedETLPipeline().update_metadata(project_path)
+    if not stats["docs"]:
+        console.print(f"[yellow]{stats['project_id']}: sin manifiestos — reprocesa con ingest --no-resume[/yellow]")
+        return
+    style = "green" if stats["failed"] == 0 else "yellow"
+    console.print(
+        f"[{style}]{stats['project_id']}[/{style}]  {stats['docs']} docs  "
+        f"{stats['updated']} actualizados  {stats['reembedded']} re-embebidos  "
+        f"{stats['unchanged']} sin cambios  {stats['failed']} fallidos"
+    )
+
+
+# ── Reconcile ───────────────────────────────────────────────────────────────
+
+@cli.command()
+def reconcile(
+    project: Optional[str] = typer.Option(None, help="Ruta o nombre de la carpeta del proyecto"),
+    all: bool = typer.Option(False, "--all", help="Todos los proyectos"),
+    doc: Optional[str] = typer.Option(None, help="Solo un documento (filename o doc_id)"),
+    apply: bool = typer.Option(False, "--apply", help="Borrar los huérfanos (por defecto solo reporta)"),
+    unknown: bool = typer.Option(False, "--unknown", help="Con --all: recorrer el índice completo buscando documentos desconocidos"),
+):
+    """Detecta (y con --apply elimina) vectores huérfanos en Pinecone."""
+    from pia_rag.etl.index_reconciler import IndexReconciler
+
+    docs_dir = settings.documents_dir
+    if all:
+        project_dirs = sorted(d for d in docs_dir.iterdir() if d.is_dir() and not d.name.startswith("."))
+    elif project:
+        project_path = Path(project)
+        if not project_path.exists():
+            project_path = docs_dir / project
+        if not project_path.exists():
+            console.print(f"[red]No se encontró: {project_path}[/red]")
+            raise typer.Exit(1)
+        project_dirs = [project_path]
+    else:
+        console.print("[yellow]Especifica --project o --all[/yellow]")
+        raise typer.Exit(1)
+
+    reconciler = IndexReconciler()
+    table = Table(title="Reconciliación" + ("" if apply else " (dry-run)"))
+    table.add_column("Proyecto", style="cyan")
+    table.add_column("Documento")
+    table.add_column("Estado", style="bold")
+    table.add_column("Índice", justify="right")
+    table.add_column("Esperados", justify="right")
+    table.add_column("Huérfanos", justify="right")
+
+    known_doc_ids: set[str] = set()
+    total_orphans = total_deleted = 0
+    for project_dir in project_dirs:
+        report = reconciler.run(project_dir, doc=doc, dry_run=not apply)
+        known_doc_ids.update(d.doc_id for d in report.docs)
+        total_orphans += report.orphan_count
+        total_deleted += report.deleted
+        for d in report.docs:
+            if d.status == "ok":
+                continue
+            style = {"removed": "red", "orphans": "yellow"}.get(d.status, "dim")
+            table.add_row(
+                report.project_id, d.filename, f"[{style}]{d.status}[/{style}]",
+                str(d.indexed), str(d.expected), str(len(d.orphans)),
+            )
+
+    if all and unknown:
+        orphans, foreign = reconciler.scan_unknown(known_doc_ids)
+        for (namespace, doc_id), ids in sorted(orphans.items()):
+            table.add_row(namespace or "?", doc_id, "[red]unknown[/red]", str(len(ids)), "0", str(len(ids)))
+            total_orphans += len(ids)
+            if apply:
+                # The namespace of a project is its project_id
+                total_deleted += reconciler.delete(ids, project_id=namespace or None, label=doc_id)
+        if foreign:
+            console.print(f"[dim]{foreign} IDs con formato ajeno al pipeline (no se tocan)[/dim]")
+
+    console.print(table)
+    if apply:
+        console.print(f"[green]{total_deleted}/{total_orphans} vectors huérfanos eliminados[/green]")
+    else:
+        console.print(f"[yellow]{total_orphans} vectors huérfanos — ejecuta con --apply para eliminarlos[/yellow]")
+
+
+# ── Namespaces ──────────────────────────────────────────────────────────────
+
+@cli.command("migrate-namespaces")
+def migrate_namespaces(
+    project: Optional[str] = typer.Option(None, help="Solo este project_id (por defecto, todos)"),
+    delete_source: bool = typer.Option(False, "--delete-source", help="Borrar del namespace plano tras copiar"),
+):
+    """Copia los vectores del namespace plano a un namespace por proyecto (sin re-embeber)."""
+    from pia_rag.storage.pinecone_client import PineconeClient
+
+    pc = PineconeClient()
+    stats = pc.migrate_namespaces(project_id=project, delete_source=delete_source)
+    console.print(
+        f"[green]{stats['copied']} vectors copiados[/green]  "
+        f"{stats['skipped']} omitidos  {stats['deleted']} borrados del origen"
+    )
+    for ns, count in sorted(pc.get_index_stats()["namespaces"].items()):
+        console.print(f"  {ns or '(default)'}: {count}")
+    if not settings.pinecone_project_namespaces:
+        console.print("[yellow]Activa PINECONE_PROJECT_NAMESPACES=true para que ingest y search usen los namespaces[/yellow]")
+
+
+@cli.command()
+def reproject(
+    dims: int = typer.Option(512, help="Dimensión destino (≤ la del índice actual)"),
+    target_backend: str = typer.Option("pinecone", help="Backend destino: pinecone | faiss | local"),
+    target_index: Optional[str] = typer.Option(None, help="Índice Pinecone destino (default: {índice}-{dims})"),
+    target_host: Optional[str] = typer.Option(None, help="Host del índice destino (opcional)"),
+    target_dir: Optional[Path] = typer.Option(None, help="Directorio/archivo destino (faiss/local)"),
+    queries: Path = typer.Option(Path("data/eval/queries.txt"), help="Set fijo de preguntas (.txt o .json)"),
+    top_k: int = typer.Option(10, help="k para recall@k"),
+    report_only: bool = typer.Option(False, "--report-only", help="No copiar, solo comparar"),
+):
+    """Migra el índice a embeddings de menor dimensión (sin re-embeber) y reporta recall/latencia."""
+    from pia_rag.storage.dimension_migration import DimensionMigration, load_queries, save_report
+    from pia_rag.storage.vector_store import create_vector_store, ensure_pinecone_index
+
+    target_index = target_index or f"{settings.pinecone_index_name}-{dims}"
+    if target_backend == "pinecone" and not report_only:
+        ensure_pinecone_index(target_index, dims)
+    elif target_dir is None:
+        # Never write over the source's local files
+        target_dir = settings.data_dir / (f"faiss_{dims}" if target_backend == "faiss" else f"local_pinecone_{dims}.json")
+
+    source = create_vector_store()
+    target = create_vector_store(target_backend, index_name=target_index, host=target_host, directory=target_dir)
+    migration = DimensionMigration(source, target, dims)
+
+    if not report_only:
+        stats = migration.migrate()
+        console.print(f"[green]{stats['vectors']} vectors reproyectados a {dims}d[/green] ({stats['namespaces']} namespaces)")
+
+    if not queries.exists():
+        console.print(f"[yellow]Sin set de preguntas en {queries}: se omite el reporte[/yellow]")
+        return
+    report = migration.compare(load_queries(queries), top_k=top_k)
+    path = save_report(report)
+
+    table = Table(title=f"{report['source_dimension']}d → {dims}d ({report['queries']} preguntas)")
+    table.add_column("Métrica", style="cyan")
+    table.add_column("Origen", justify="right")
+    table.add_column("Destino", justify="right")
+    table.add_row(f"recall@{top_k} (media / mín)", "1.0", f"{report['recall_mean']} / {report['recall_min']}")
+    for pct in ("p50", "p95"):
+        table.add_row(
+            f"latencia {pct} (ms)",
+            str(report["source_latency_ms"][pct]),
+            str(report["target_latency_ms"][pct]),
+        )
+    console.print(table)
+    console.print(f"Reporte: {path}")
+    console.print(
+        f"[yellow]Para usarlo: OPENAI_EMBEDDING_DIMENSIONS={dims} y "
+        + ("PINECONE_INDEX_NAME/PINECONE_HOST del índice nuevo" if target_backend == "pinecone"
+           else f"VECTOR_STORE_BACKEND={target_backend}")
+        + "[/yellow]"
+    )
+
+
 # ── Status ──────────────────────────────────────────────────────────────────
 
 @cli.command()
@@ -128,7 +376,8 @@ def status(
                 files = state.get("files", {})
                 ok = sum(1 for f in files.values() if f.get("status") == "indexed")
                 failed = sum(1 for f in files.values() if f.get("status") == "failed")
-                total = ok + failed
+                pending = sum(1 for f in files.values() if f.get("status") == "pending_upsert")
+                total = ok + failed + pending
                 status_str = state.get("status", "pending")
                 style = "green" if status_str == "complete" else ("yellow" if status_str == "partial" else "red")
                 table.add_row(
@@ -207,5 +456,128 @@ def query(
         console.print(f"  {r['text'][:200]}...")
 
 
+@cli.command()
+def migrate(
+    faiss_index: Path = typer.Option(Path("Index_global/faiss.index"), "--faiss", help="Índice FAISS de origen"),
+    metadata: Path = typer.Option(Path("Index_global/metadata.pkl"), help="Metadata en orden FAISS (.pkl o .jsonl)"),
+    backend: str = typer.Option("pinecone", help="Destino: pinecone | faiss | local"),
+    index: Optional[str] = typer.Option(None, help="Índice Pinecone destino (default: PINECONE_INDEX_NAME)"),
+    host: Optional[str] = typer.Option(None, help="Host del índice destino"),
+    namespace: str = typer.Option("", help="Namespace destino"),
+    id_prefix: str = typer.Option("", help="Prefijo de IDs (default: la posición FAISS, como antes)"),
+    workers: Optional[int] = typer.Option(None, help="Upserts en paralelo (default: PINECONE_UPSERT_WORKERS)"),
+    restart: bool = typer.Option(False, "--restart", help="Ignorar el checkpoint y empezar de cero"),
+):
+    """Sube un índice FAISS + metadata a Pinecone en streaming (por ventanas, reanudable; .jsonl recomendado para metadata grande)."""
+    from pia_rag.storage.faiss_migration import migrate_faiss
+    from pia_rag.storage.vector_store import create_vector_store
+
+    for path in (faiss_index, metadata):
+        if not path.exists():
+            console.print(f"[red]No existe: {path}[/red]")
+            raise typer.Exit(1)
+    if backend == "pinecone" and not settings.pinecone_api_key:
+        console.print("[red]Falta PINECONE_API_KEY (variable de entorno o .env)[/red]")
+        raise typer.Exit(1)
+
+    store = create_vector_store(backend, index_name=index, host=host)
+    target = f"{backend}-{index or settings.pinecone_index_name}-{namespace or 'default'}"
+    result = migrate_faiss(
+        faiss_index, metadata, store, target,
+        namespace=namespace, id_prefix=id_prefix, workers=workers, restart=restart,
+    )
+    if hasattr(store, "save"):
+        store.save()
+    console.print(f"[green]Migración completa: {result['uploaded']} vectors subidos ({result['total']} en el índice)[/green]")
+
+
+@cli.command("build-lexical")
+def build_lexical():
+    """Construye el índice BM25 local desde el chunk store (backfill, sin llamadas externas)."""
+    from pia_rag.storage.chunk_store import ChunkStore
+    from pia_rag.storage.lexical_index import LexicalIndex
+
+    if not settings.chunk_store_enabled:
+        console.print("[red]El índice léxico se construye desde el chunk store (CHUNK_STORE_ENABLED=true)[/red]")
+        raise typer.Exit(1)
+    lexical = LexicalIndex()
+    indexed = 0
+    for records in ChunkStore().iter_records():
+        lexical.put_records(records)
+        indexed += len(records)
+        console.print(f"  {indexed} chunks indexados...", end="\r")
+    console.print(f"[green]Índice léxico: {lexical.count()} chunks[/green] ({settings.lexical_index_path})")
+
+
+# ── Snapshots ───────────────────────────────────────────────────────────────
+
+snapshot_cli = typer.Typer(help="Export/import del índice en Parquet/Arrow (vectores float16)")
+cli.add_typer(snapshot_cli, name="snapshot")
+
+
+@snapshot_cli.command("export")
+def snapshot_export(
+    name: Optional[str] = typer.Option(None, help="Nombre del snapshot (default: fecha-hora)"),
+    project: Optional[str] = typer.Option(None, help="Solo este project_id"),
+    fmt: str = typer.Option("parquet", "--format", help="parquet | arrow"),
+):
+    """Exporta vectores + metadata + texto del chunk store a data/snapshots/{nombre}/."""
+    from datetime import datetime
+
+    from pia_rag.storage.chunk_store import ChunkStore
+    from pia_rag.storage.snapshot import export_snapshot
+    from pia_rag.storage.vector_store import create_vector_store
+
+    name = name or datetime.now().strftime("%Y%m%d-%H%M%S")
+    chunk_store = ChunkStore() if settings.chunk_store_enabled else None
+    manifest = export_snapshot(create_vector_store(), name, project_id=project, fmt=fmt, chunk_store=chunk_store)
+
+    table = Table(title=f"Snapshot {name} ({manifest['dimension']}d, float16)")
+    table.add_column("Proyecto", style="cyan")
+    table.add_column("Archivo")
+    table.add_column("Vectors", justify="right")
+    for pid, info in manifest["files"].items():
+        table.add_row(pid, info["file"], str(info["rows"]))
+    console.print(table)
+    console.print(f"[green]{manifest['total']} vectors → {settings.snapshots_dir / name}[/green]")
+
+
+@snapshot_cli.command("import")
+def snapshot_import(
+    name: str = typer.Argument(..., help="Nombre del snapshot en data/snapshots/"),
+    backend: Optional[str] = typer.Option(None, help="Destino: pinecone | faiss | local (default: el configurado)"),
+    index: Optional[str] = typer.Option(None, help="Índice Pinecone destino (se crea si no existe)"),
+    host: Optional[str] = typer.Option(None, help="Host del índice destino"),
+    target_dir: Optional[Path] = typer.Option(None, help="Directorio/archivo destino (faiss/local)"),
+    project: Optional[str] = typer.Option(None, help="Solo este project_id"),
+    workers: Optional[int] = typer.Option(None, help="Upserts en paralelo (default: PINECONE_UPSERT_WORKERS)"),
+):
+    """Carga un snapshot al índice (upserts paralelos, retoma desde el último checkpoint)."""
+    from pia_rag.storage.chunk_store import ChunkStore
+    from pia_rag.storage.snapshot import import_snapshot
+    from pia_rag.storage.vector_store import create_vector_store, ensure_pinecone_index
+
+    backend = (backend or settings.vector_store_backend).lower()
+    manifest_path = settings.snapshots_dir / name / "manifest.json"
+    if not manifest_path.exists():
+        console.print(f"[red]No existe el snapshot: {settings.snapshots_dir / name}[/red]")
+        raise typer.Exit(1)
+    if backend == "pinecone" and index:
+        ensure_pinecone_index(index, json.loads(manifest_path.read_text(encoding="utf-8"))["dimension"])
+
+    store = create_vector_store(backend, index_name=index, host=host, directory=target_dir)
+    target = f"{backend}-{index or settings.pinecone_index_name}" if backend == "pinecone" else f"{backend}-{target_dir or 'default'}"
+    chunk_store = ChunkStore() if settings.chunk_store_enabled else None
+    result = import_snapshot(store, name, target, project_id=project, chunk_store=chunk_store, workers=workers)
+    console.print(
+        f"[green]{result['imported']} vectors importados[/green] "
+        f"({result['files']} archivos, {result['skipped_groups']} row groups ya importados)"
+    )
+    if chunk_store is not None and settings.lexical_search_enabled:
+        console.print("[yellow]Ejecuta `python main.py build-lexical` para indexar el texto restaurado[/yellow]")
+    if hasattr(store, "save"):
+        store.save()
+
+
 if __name__ == "__main__":
     cli()
@@ -3,21 +3,32 @@ api/main.py — FastAPI desplegado en Render (api_rag_mvp).
 
 Endpoints:
   POST /search         — búsqueda con filtros opcionales (ChatGPT lo usa)
+  POST /search/multi   — la misma búsqueda en varios proyectos (un embedding, en paralelo)
+  POST /search/batch   — varias búsquedas con sus filtros en una llamada
+  POST /ask            — búsqueda + respuesta generada
+  POST /ask/stream     — igual que /ask por Server-Sent Events (fuentes, luego tokens)
+  POST /compare        — comparación entre proyectos (map-reduce en paralelo, por SSE)
   POST /ingest/project — ingestar un proyecto
   GET  /projects       — lista proyectos con estado
   GET  /projects/{id}  — estado detallado de un proyecto
   GET  /health         — health check
+  GET  /metrics        — coalescencia, micro-batching de embeddings y cache de respuestas
 """
 
 from __future__ import annotations
 
 import json
+import threading
+import time
 from pathlib import Path
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from loguru import logger
 from pydantic import BaseModel, Field
+from starlette.concurrency import iterate_in_threadpool
 
 from pia_rag.config import settings
 
@@ -46,9 +57,11 @@ class SearchRequest(BaseModel):
     chapter_title: Optional[str] = Field(None, description="Filter by chapter name")
     doc_type: Optional[str] = Field(None, description="Filter by document type: EIA | DIA | RCA | ICSARA | ADENDA")
     top_k: int = Field(8, ge=1, le=20, description="Number of results (default 8, max 20)")
+    diversify: Optional[bool] = Field(None, description="Drop near-duplicate chunks (same or adjacent pages / MMR); default from server config")
 
 
 class SearchResult(BaseModel):
+    chunk_id: str = ""
     text: str
     score: float
     project_id: str = ""
@@ -71,12 +84,68 @@ class SearchResponse(BaseModel):
     filters_applied: dict
 
 
+class MultiSearchRequest(BaseModel):
+    query: str = Field(..., description="Natural language search query")
+    project_ids: list[str] = Field(..., min_length=1, max_length=20, description="Project folder IDs to search")
+    chunk_level: Optional[str] = Field(None, description="Granularity: chapter | section | subsection | paragraph")
+    chapter_title: Optional[str] = Field(None, description="Filter by chapter name")
+    doc_type: Optional[str] = Field(None, description="Filter by document type: EIA | DIA | RCA | ICSARA | ADENDA")
+    top_k: int = Field(8, ge=1, le=20, description="Results per project (default 8, max 20)")
+    diversify: Optional[bool] = Field(None, description="Drop near-duplicate chunks (same or adjacent pages / MMR); default from server config")
+
+
+class ProjectResults(BaseModel):
+    project_id: str
+    results: list[SearchResult]
+    total_found: int
+
+
+class MultiSearchResponse(BaseModel):
+    projects: list[ProjectResults]
+    filters_applied: dict
+
+
+class BatchSearchRequest(BaseModel):
+    queries: list[SearchRequest] = Field(..., min_length=1, max_length=20, description="Searches to run, each with its own filters")
+
+
+class BatchSearchItem(BaseModel):
+    query: str
+    results: list[SearchResult] = []
+    total_found: int = 0
+    filters_applied: dict = {}
+    took_ms: float = 0.0
+    error: Optional[str] = None
+
+
+class BatchSearchResponse(BaseModel):
+    items: list[BatchSearchItem]
+    embed_ms: float
+    took_ms: float
+
+
+class CompareRequest(BaseModel):
+    query: str = Field(..., description="Comparative question")
+    project_ids: list[str] = Field(..., min_length=2, max_length=12, description="Project folder IDs to compare")
+    chunk_level: Optional[str] = Field(None, description="Granularity: chapter | section | subsection | paragraph")
+    chapter_title: Optional[str] = Field(None, description="Filter by chapter name")
+    doc_type: Optional[str] = Field(None, description="Filter by document type: EIA | DIA | RCA | ICSARA | ADENDA")
+    top_k: int = Field(8, ge=1, le=20, description="Results per project (default 8, max 20)")
+    diversify: Optional[bool] = Field(None, description="Drop near-duplicate chunks (same or adjacent pages / MMR); default from server config")
+
+
 class IngestRequest(BaseModel):
     project_id: str = Field(..., description="Nombre de la carpeta del proyecto")
     resume: bool = Field(True, description="Omitir archivos ya indexados")
     retry_failed: bool = Field(False, description="Reintentar archivos fallidos")
 
 
+def _filters(req: BaseModel) -> dict:
+    """Filtros no vacíos de un request (para filters_applied)."""
+    fields = ("project_id", "chunk_level", "chapter_title", "doc_type")
+    return {f: getattr(req, f) for f in fields if getattr(req, f, None)}
+
+
 # ─── Lazy init ──────────────────────────────────────────────────────────────
 
 _pinecone_client = None
@@ -101,6 +170,21 @@ def _get_rag():
 
 # ─── Endpoints ──────────────────────────────────────────────────────────────
 
+@app.on_event("startup")
+def _check_chunk_store():
+    """Con chunk_store_enabled el texto solo está en el SQLite local: avisar si aquí no existe."""
+    if not settings.chunk_store_enabled:
+        return
+    from pia_rag.storage.chunk_store import ChunkStore
+
+    path = settings.chunk_store_path
+    if not path.exists() or ChunkStore(path).count() == 0:
+        logger.error(
+            f"chunk_store_enabled=True pero {path} no existe o está vacío: los vectores "
+            "ingestados sin texto en Pinecone se devolverán con text vacío"
+        )
+
+
 @app.get("/health")
 def health():
     """Health check."""
@@ -116,6 +200,17 @@ def health():
         return {"status": "degraded", "error": str(e)}
 
 
+@app.get("/metrics")
+def metrics():
+    """Contadores en proceso: single-flight, micro-batching de embeddings y cache de /ask."""
+    data: dict = {}
+    if _pinecone_client is not None:
+        data["search"] = _pinecone_client.stats()
+    if _rag_engine is not None:
+        data["ask"] = _rag_engine.stats()
+    return data
+
+
 @app.post("/search", response_model=SearchResponse)
 def search(req: SearchRequest):
     """
@@ -131,27 +226,84 @@ def search(req: SearchRequest):
             chunk_level=req.chunk_level,
             chapter_title=req.chapter_title,
             doc_type=req.doc_type,
+            diversify=req.diversify,
         )
 
-        filters = {}
-        if req.project_id:
-            filters["project_id"] = req.project_id
-        if req.chunk_level:
-            filters["chunk_level"] = req.chunk_level
-        if req.chapter_title:
-            filters["chapter_title"] = req.chapter_title
-        if req.doc_type:
-            filters["doc_type"] = req.doc_type
-
         return SearchResponse(
             results=[SearchResult(**r) for r in results],
             total_found=len(results),
-            filters_applied=filters,
+            filters_applied=_filters(req),
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/search/multi", response_model=MultiSearchResponse)
+def search_multi(req: MultiSearchRequest):
+    """
+    La misma consulta en varios proyectos, agrupada por proyecto.
+    Reemplaza N llamadas a /search para preguntas comparativas.
+    """
+    try:
+        pc = _get_pinecone()
+        grouped = pc.search_multi(
+            query=req.query,
+            project_ids=req.project_ids,
+            top_k=req.top_k,
+            chunk_level=req.chunk_level,
+            chapter_title=req.chapter_title,
+            doc_type=req.doc_type,
+            diversify=req.diversify,
+        )
+
+        return MultiSearchResponse(
+            projects=[
+                ProjectResults(
+                    project_id=project_id,
+                    results=[SearchResult(**r) for r in results],
+                    total_found=len(results),
+                )
+                for project_id, results in grouped.items()
+            ],
+            filters_applied=_filters(req),
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/search/batch", response_model=BatchSearchResponse)
+def search_batch(req: BatchSearchRequest):
+    """
+    Varias búsquedas (p.ej. flora, fauna, ruido y tráfico de un proyecto) en
+    un solo round-trip: un request de embeddings para todas y las consultas en
+    paralelo. Los items vuelven en el orden recibido, cada uno con su tiempo;
+    si una búsqueda falla, su item trae `error` y las demás siguen.
+    """
+    start = time.perf_counter()
+    try:
+        pc = _get_pinecone()
+        batch = pc.search_batch([q.model_dump() for q in req.queries])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    items = []
+    for q, item in zip(req.queries, batch["items"]):
+        results = item.get("results", [])
+        items.append(BatchSearchItem(
+            query=q.query,
+            results=[SearchResult(**r) for r in results],
+            total_found=len(results),
+            filters_applied=_filters(q),
+            took_ms=item["took_ms"],
+            error=item.get("error"),
+        ))
+    return BatchSearchResponse(
+        items=items,
+        embed_ms=batch["embed_ms"],
+        took_ms=round((time.perf_counter() - start) * 1000, 1),
+    )
+
+
 @app.post("/ask")
 def ask(req: SearchRequest):
     """
@@ -168,16 +320,91 @@ def ask(req: SearchRequest):
             doc_type=req.doc_type,
             top_k=req.top_k,
             generate=True,
+            diversify=req.diversify,
         )
         return {
             "answer": result.get("answer", ""),
             "sources_count": result.get("total_found", 0),
             "results": result.get("results", []),
+            "context": result.get("context"),
+            "usage": result.get("usage"),
+            "cached": result.get("cached", False),
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/ask/stream")
+async def ask_stream(req: SearchRequest, request: Request):
+    """
+    /ask por Server-Sent Events: `event: sources` apenas termina la búsqueda,
+    luego `event: token` por fragmento de respuesta y `event: done` con el uso
+    de tokens. Si el cliente se desconecta se corta la generación en OpenAI.
+    """
+    engine = _get_rag()
+    cancel = threading.Event()
+    events = engine.stream(
+        question=req.query,
+        project_id=req.project_id,
+        chunk_level=req.chunk_level,
+        chapter_title=req.chapter_title,
+        doc_type=req.doc_type,
+        top_k=req.top_k,
+        diversify=req.diversify,
+        cancel=cancel,
+    )
+    return _sse_response(events, cancel, request)
+
+
+@app.post("/compare")
+async def compare(req: CompareRequest, request: Request):
+    """
+    Pregunta comparativa entre proyectos, por Server-Sent Events:
+    `event: sources` (resultados por proyecto), `event: partial` por cada
+    resumen de proyecto a medida que termina, `event: token` de la síntesis
+    final y `event: done` con el uso total de tokens.
+    """
+    engine = _get_rag()
+    cancel = threading.Event()
+    events = engine.compare(
+        question=req.query,
+        project_ids=req.project_ids,
+        chunk_level=req.chunk_level,
+        chapter_title=req.chapter_title,
+        doc_type=req.doc_type,
+        top_k=req.top_k,
+        diversify=req.diversify,
+        cancel=cancel,
+    )
+    return _sse_response(events, cancel, request)
+
+
+def _sse_response(events, cancel: threading.Event, request: Request) -> StreamingResponse:
+    """Eventos (nombre, dict) del motor → SSE. Si el cliente se desconecta, activa `cancel`."""
+
+    async def _sse():
+        try:
+            async for event, data in iterate_in_threadpool(events):
+                if await request.is_disconnected():
+                    logger.info(f"{request.url.path}: cliente desconectado, se cancela la generación")
+                    break
+                yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)}, ensure_ascii=False)}\n\n"
+        finally:
+            cancel.set()
+            try:
+                events.close()
+            except ValueError:
+                pass    # still running in the worker thread; it sees `cancel` on the next token
+
+    return StreamingResponse(
+        _sse(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/projects")
 def list_projects():
     """Lista todos los proyectos con su estado."""
@@ -257,5 +484,5 @@ def root():
         "version": "2.0",
         "status": "Online",
         "index": settings.pinecone_index_name,
-        "endpoints": ["/search", "/ask", "/projects", "/health"],
+        "endpoints": ["/search", "/search/multi", "/search/batch", "/ask", "/ask/stream", "/compare", "/projects", "/health", "/metrics"],
     }
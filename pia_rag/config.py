@@ -4,6 +4,8 @@ Usa pydantic-settings para cargar desde .env o variables de entorno.
 """
 
 from pathlib import Path
+from typing import Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -17,20 +19,42 @@ class Settings(BaseSettings):
     # ── OpenAI ──────────────────────────────────────────────
     openai_api_key: str = ""
     openai_embedding_model: str = "text-embedding-3-small"
+    openai_embedding_dimensions: Optional[int] = None   # None = nativo del modelo (1536); p.ej. 512
     openai_chat_model: str = "gpt-4o"
 
     # ── Pinecone (índice productivo — NO cambiar) ──────────
     pinecone_api_key: str = ""
     pinecone_index_name: str = "api-rag-mvp"
     pinecone_host: str = "https://api-rag-mvp-96gaajy.svc.aped-4627-b74a.pinecone.io"
+    pinecone_cloud: str = "aws"                 # para índices nuevos (reproject)
+    pinecone_region: str = "us-east-1"
 
     # ── Chunking (in characters — ~5 chars/word in Spanish) ─
     chunk_size: int = 1200
     chunk_overlap: int = 200
 
+    # ── Boilerplate (encabezados/pies repetidos por página) ─
+    boilerplate_edge_lines: int = 3         # líneas revisadas arriba/abajo de cada página
+    boilerplate_min_page_ratio: float = 0.6  # fracción de páginas donde debe repetirse
+    boilerplate_min_pages: int = 4           # PDFs más cortos no se limpian
+
+    # ── Páginas casi duplicadas entre PDFs (SimHash) ───────
+    page_dedup_enabled: bool = True
+    page_dedup_max_hamming: int = 3          # bits distintos (de 64) para considerar duplicado
+    page_dedup_min_chars: int = 300          # páginas más cortas (portadas) no se comparan
+
     # ── RAG ─────────────────────────────────────────────────
     top_k: int = 8
     min_score: float = 0.30
+    context_token_budget: int = 6000        # tokens de contexto máx. hacia el modelo de chat (/ask)
+    context_min_span_tokens: int = 150      # un tramo se recorta solo si quedan al menos estos tokens
+    answer_cache_enabled: bool = True       # cache de respuestas de /ask (en memoria)
+    answer_cache_ttl_s: float = 86_400.0
+    answer_cache_version_check_s: float = 30.0   # cada cuánto se relee la versión de un proyecto en Pinecone
+    answer_cache_max_entries: int = 1000
+    compare_project_token_budget: int = 3000   # contexto por proyecto en /compare (fase map)
+    compare_summary_max_tokens: int = 500      # largo máx. de cada resumen por proyecto
+    compare_workers: int = 6                   # resúmenes por proyecto generados en paralelo
 
     # ── API (Render) ────────────────────────────────────────
     api_host: str = "0.0.0.0"
@@ -38,12 +62,77 @@ class Settings(BaseSettings):
     render_service_id: str = "srv-d5rr9a63jp1c73e1fibg"
 
     # ── Embedding batch ─────────────────────────────────────
-    embedding_batch_size: int = 50
-    embedding_max_retries: int = 3
-    embedding_retry_delay: float = 5.0
+    embedding_batch_size: int = 2048            # máx. inputs por request (límite OpenAI)
+    embedding_batch_max_tokens: int = 100_000   # tokens por request (OpenAI acepta hasta 300k)
+    embedding_max_retries: int = 6
+    embedding_retry_delay: float = 1.0          # base del backoff exponencial (con jitter)
+    embedding_backoff_max: float = 60.0
+
+    # ── Embedding concurrency / rate limit (OpenAI tier) ───
+    embedding_max_concurrency: int = 8          # requests en vuelo (se ajusta solo ante 429)
+    embedding_rpm_limit: int = 3000             # requests/min; se re-sincroniza con x-ratelimit-*
+    embedding_tpm_limit: int = 1_000_000        # tokens/min
+
+    # ── OpenAI Batch API (ingest --batch-mode) ─────────────
+    batch_poll_interval: float = 60.0
 
     # ── Pinecone upsert ─────────────────────────────────────
     pinecone_upsert_batch: int = 100
+    pinecone_upsert_workers: int = 4            # batches en paralelo
+    pinecone_upsert_retries: int = 3            # antes de mandar el batch al outbox
+    pinecone_update_workers: int = 8            # updates de metadata en paralelo
+    pinecone_delete_batch: int = 1000           # IDs por request de delete
+    reconcile_rpm: int = 120                    # requests/min de list/delete del reconciliador
+
+    # ── Vector store ────────────────────────────────────────
+    vector_store_backend: str = "pinecone"      # "pinecone" | "faiss" | "local" (stand-in para tests)
+    faiss_index_type: str = "hnsw"              # "hnsw" | "ivf" | "flat"
+    faiss_hnsw_m: int = 32
+    faiss_hnsw_ef_construction: int = 80
+    faiss_hnsw_ef_search: int = 64
+    faiss_ivf_nlist: int = 1024                 # tope; se ajusta a ~4·sqrt(n) al entrenar
+    faiss_ivf_nprobe: int = 16
+    faiss_ivf_min_train: int = 10_000           # IVF usa Flat hasta tener estos vectores
+    faiss_rebuild_ratio: float = 0.25           # tombstones/total que disparan un rebuild
+    faiss_autosave_s: float = 30.0              # frecuencia máx. de escritura a disco
+
+    # ── Pinecone namespaces ─────────────────────────────────
+    pinecone_project_namespaces: bool = False   # un namespace por proyecto (migrate-namespaces antes)
+    pinecone_query_workers: int = 8             # queries en paralelo al buscar en todos los namespaces
+    pinecone_namespace_cache_s: float = 300.0   # cache de la lista de namespaces
+    pinecone_state_namespace: str = "__pia_state__"   # marcadores last_updated por proyecto (no se busca ahí)
+
+    # ── Chunk store local (texto fuera de Pinecone) ─────
+    # Opt-in: con True el texto NO se sube a Pinecone, solo a data/chunk_store.sqlite;
+    # el host que sirve /search (Render) necesita ese archivo o los resultados vuelven sin texto
+    chunk_store_enabled: bool = False
+
+    # ── Búsqueda híbrida (BM25 local + vectores) ───────────
+    # Opt-in junto con chunk_store_enabled: los hits léxicos se hidratan desde el chunk store,
+    # sin él se ignora (con un warning al arrancar). main.py build-lexical para backfill
+    lexical_search_enabled: bool = False
+    hybrid_candidates: int = 20                 # candidatos por lista antes de fusionar (≥ top_k)
+    rrf_k: int = 60                             # constante de reciprocal-rank fusion
+
+    # ── Diversificación del top-k (MMR) ────────────────────
+    search_diversify: bool = False              # colapso por página + MMR (requiere numpy)
+    mmr_lambda: float = 0.7                     # 1 = solo relevancia, 0 = solo diversidad
+    mmr_fetch_factor: int = 4                   # candidatos = top_k × factor (con include_values)
+
+    # ── Coalescencia de consultas idénticas en vuelo ───────
+    single_flight_enabled: bool = True          # /search y /ask iguales y simultáneos comparten una llamada
+
+    # ── Micro-batching de embeddings de consultas ──────────
+    query_embed_window_ms: float = 0.0          # ventana para juntar consultas (0 = apagado; p.ej. 5-10)
+    query_embed_batch_max: int = 32             # consultas por request como máximo
+    query_embed_workers: int = 4                # requests de consultas en vuelo
+
+    # ── Snapshots (export/import del índice) ──────────────
+    snapshot_row_group: int = 2048              # filas por row group = unidad de checkpoint al importar
+
+    # ── Migración FAISS → Pinecone (main.py migrate) ──────
+    migrate_window: int = 10_000                # vectores por reconstruct_n = unidad de checkpoint
+    migrate_max_text_chars: int = 35_000        # texto en metadata (límite de 40 KB de Pinecone)
 
     # ── OCR ─────────────────────────────────────────────────
     ocr_lang: str = "spa"
@@ -74,6 +163,31 @@ class Settings(BaseSettings):
     def processed_dir(self) -> Path:
         return self.data_dir / "processed"
 
+    @property
+    def chunk_store_path(self) -> Path:
+        """SQLite con texto y campos de display por chunk_id."""
+        return self.data_dir / "chunk_store.sqlite"
+
+    @property
+    def lexical_index_path(self) -> Path:
+        """Índice BM25 (SQLite FTS5) sobre el texto de los chunks."""
+        return self.data_dir / "lexical_index.sqlite"
+
+    @property
+    def faiss_dir(self) -> Path:
+        """Índices FAISS + sidecars de metadata (vector_store_backend="faiss")."""
+        return self.data_dir / "faiss"
+
+    @property
+    def snapshots_dir(self) -> Path:
+        """Snapshots del índice: data/snapshots/{nombre}/"""
+        return self.data_dir / "snapshots"
+
+    @property
+    def outbox_dir(self) -> Path:
+        """Batches de upsert fallidos, pendientes de reintento."""
+        return self.data_dir / "outbox"
+
     @property
     def logs_dir(self) -> Path:
         return self.data_dir / "logs"
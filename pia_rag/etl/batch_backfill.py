@@ -0,0 +1,515 @@
+"""
+etl/batch_backfill.py — Re-embedding masivo vía OpenAI Batch API.
+
+Para reindexar todo (cambio de modelo, los 12 proyectos) los requests síncronos a
+`embeddings.create` son la opción más lenta y cara. Flujo:
+
+  1. prepare  — parse → chunk de cada PDF; chunks a chunks/{custom_id}.jsonl y
+                requests empaquetados por tokens a requests.jsonl
+  2. submit   — sube requests.jsonl y crea el batch (/v1/embeddings, 24h)
+  3. poll     — espera a que el batch termine. Si falla o se cancela, el
+                checkpoint vuelve a "prepared" y la siguiente ejecución lo
+                reenvía; uno expirado con resultados parciales sigue al upsert
+  4. upsert   — descarga output.jsonl y lo recorre línea a línea: cada request
+                se upsertea a Pinecone y queda marcado en checkpoint.json.
+                Un PDF se marca "indexed" cuando todos sus requests están arriba
+                ("pending_upsert" si algún batch quedó en el outbox). Los
+                requests del error file marcan sus PDFs "failed"; los que no
+                tienen resultado se embeben en modo síncrono.
+
+Todo vive en data/batch/{job}/ y checkpoint.json permite reanudar en cualquier
+fase. `LocalBatchAPI` imita los endpoints files/batches de OpenAI para probar el
+flujo completo sin red.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import math
+import shutil
+import time
+from dataclasses import asdict
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+from loguru import logger
+
+from pia_rag.config import settings
+from pia_rag.etl.enriched_chunker import EnrichedChunk, _doc_prefix
+from pia_rag.etl.enriched_pipeline import (
+    EnrichedETLPipeline,
+    _extraction_result,
+    _find_pdfs,
+    _load_project_meta,
+)
+from pia_rag.etl.extraction_logger import ExtractionLogger, FileExtractionResult, PageOCRResult
+from pia_rag.etl.page_dedup import PageSignatureIndex
+from pia_rag.storage.chunk_manifest import DocumentManifest
+from pia_rag.storage.embedding_batcher import (
+    clean_for_embedding,
+    count_tokens,
+    embedding_params,
+    pack_by_tokens,
+)
+
+
+# ─── Fake Batch API (offline) ───────────────────────────────────────────────
+
+class _FakeContent:
+    def __init__(self, path: Path):
+        self._path = path
+
+    def write_to_file(self, file: str | Path):
+        Path(file).write_bytes(self._path.read_bytes())
+
+
+class LocalBatchAPI:
+    """
+    Sustituto local de `client.files` / `client.batches` de OpenAI.
+
+    Los embeddings son deterministas (derivados del hash del texto) y el batch
+    pasa por validating → in_progress → completed en llamadas sucesivas a
+    `retrieve`, igual que el real.
+    """
+
+    def __init__(self, root: Path, dimensions: int = 1536):
+        self._root = root
+        self._dimensions = dimensions
+        self._batches: dict[str, dict] = {}
+        self.files = SimpleNamespace(create=self._file_create, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._batch_create, retrieve=self._batch_retrieve)
+
+    def _file_create(self, file, purpose: str):
+        data = file.read() if hasattr(file, "read") else Path(file).read_bytes()
+        file_id = "file-" + hashlib.md5(data).hexdigest()[:16]
+        self._root.mkdir(parents=True, exist_ok=True)
+        (self._root / file_id).write_bytes(data)
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def _file_content(self, file_id: str):
+        return _FakeContent(self._root / file_id)
+
+    def _batch_create(self, input_file_id: str, endpoint: str, completion_window: str, **_):
+        batch_id = f"batch-{input_file_id[5:]}"
+        self._batches[batch_id] = {"input": input_file_id, "polls": 0}
+        return self._batch_retrieve(batch_id)
+
+    def _batch_retrieve(self, batch_id: str):
+        state = self._batches.get(batch_id)
+        if state is None:
+            # Proceso nuevo (reanudación): el output ya puede existir en disco
+            state = self._batches[batch_id] = {"input": f"file-{batch_id[6:]}", "polls": 2}
+        state["polls"] += 1
+        status = ("validating", "in_progress", "completed")[min(state["polls"] - 1, 2)]
+        output_id = None
+        if status == "completed":
+            output_id = f"file-out-{batch_id[6:]}"
+            if not (self._root / output_id).exists():
+                self._run(self._root / state["input"], self._root / output_id)
+        return SimpleNamespace(
+            id=batch_id, status=status, output_file_id=output_id, error_file_id=None,
+            request_counts=SimpleNamespace(total=0, completed=0, failed=0),
+        )
+
+    def _embed(self, text: str, dimensions: Optional[int] = None) -> list[float]:
+        seed = hashlib.sha256(text.encode()).digest()
+        dims = dimensions or self._dimensions
+        values = [(seed[i % 32] - 127.5) / 127.5 + (i % 7) * 1e-3 for i in range(dims)]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    def _run(self, input_path: Path, output_path: Path):
+        with open(input_path, encoding="utf-8") as src, open(output_path, "w", encoding="utf-8") as dst:
+            for line in src:
+                req = json.loads(line)
+                data = [
+                    {"object": "embedding", "index": i, "embedding": self._embed(text, req["body"].get("dimensions"))}
+                    for i, text in enumerate(req["body"]["input"])
+                ]
+                dst.write(json.dumps({
+                    "id": f"resp-{req['custom_id']}",
+                    "custom_id": req["custom_id"],
+                    "response": {"status_code": 200, "body": {"object": "list", "data": data}},
+                    "error": None,
+                }) + "\n")
+
+
+# ─── Backfill ───────────────────────────────────────────────────────────────
+
+class BatchBackfill:
+    """
+    Ingesta vía Batch API con checkpoints reanudables.
+
+    Uso:
+        backfill = BatchBackfill("all", pipeline)
+        backfill.run([Path(".../hyc"), Path(".../urbanya")])
+    """
+
+    def __init__(
+        self,
+        job_name: str,
+        pipeline: EnrichedETLPipeline,
+        api=None,
+    ):
+        self._dir = settings.data_dir / "batch" / job_name
+        self._chunks_dir = self._dir / "chunks"
+        self._checkpoint_file = self._dir / "checkpoint.json"
+        if self._checkpoint_file.exists() and json.loads(
+            self._checkpoint_file.read_text(encoding="utf-8")
+        ).get("phase") == "done":
+            # Previous job finished — start a new one from scratch
+            shutil.rmtree(self._dir)
+        self._chunks_dir.mkdir(parents=True, exist_ok=True)
+        self._pipeline = pipeline
+        if api is None:
+            from openai import OpenAI
+            api = OpenAI(api_key=settings.openai_api_key)
+        self._api = api
+        self._loggers: dict[str, ExtractionLogger] = {}
+        self.checkpoint = self._load_checkpoint()
+
+    # ── Checkpoint ──────────────────────────────────────────────────────
+
+    def _load_checkpoint(self) -> dict:
+        if self._checkpoint_file.exists():
+            return json.loads(self._checkpoint_file.read_text(encoding="utf-8"))
+        return {
+            "phase": "new",
+            "model": settings.openai_embedding_model,
+            "dimensions": settings.openai_embedding_dimensions,
+            "batch_id": None,
+            "output_file_id": None,
+            "error_file_id": None,
+            "requests": {},   # custom_id → [file keys]
+            "files": {},      # "project_id/filename" → {requests, result, dedup}
+            "upserted": [],
+        }
+
+    def _save_checkpoint(self):
+        tmp = self._checkpoint_file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.checkpoint, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self._checkpoint_file)
+
+    def _logger(self, project_id: str) -> ExtractionLogger:
+        if project_id not in self._loggers:
+            self._loggers[project_id] = ExtractionLogger(project_id)
+        return self._loggers[project_id]
+
+    # ── Run ─────────────────────────────────────────────────────────────
+
+    def run(
+        self,
+        project_dirs: list[Path],
+        resume: bool = True,
+        retry_failed: bool = False,
+    ) -> dict:
+        """Ejecuta (o reanuda) el backfill completo. Retorna estadísticas."""
+        cp = self.checkpoint
+        if cp["phase"] == "new":
+            self.prepare(project_dirs, resume=resume, retry_failed=retry_failed)
+        if cp["phase"] == "prepared":
+            if not cp["requests"]:
+                logger.info("Batch: nada que embeber")
+                cp["phase"] = "done"
+                self._save_checkpoint()
+            else:
+                self.submit()
+        if cp["phase"] == "submitted":
+            self.wait()
+        if cp["phase"] == "completed":
+            self.upsert_results()
+
+        files = cp["files"].values()
+        return {
+            "phase": cp["phase"],
+            "batch_id": cp["batch_id"],
+            "requests": len(cp["requests"]),
+            "requests_upserted": len(cp["upserted"]),
+            "pdfs": len(cp["files"]),
+            "pdfs_indexed": sum(1 for f in files if f.get("indexed")),
+            "chunks": sum(f["result"]["chunks"] for f in files),
+        }
+
+    # ── 1. Prepare ──────────────────────────────────────────────────────
+
+    def prepare(self, project_dirs: list[Path], resume: bool = True, retry_failed: bool = False):
+        """Parse + chunk de todos los PDFs y escritura de requests.jsonl."""
+        cp = self.checkpoint
+        records: list[tuple[str, EnrichedChunk]] = []  # (file key, chunk)
+
+        for project_dir in project_dirs:
+            project_meta = _load_project_meta(project_dir)
+            project_id = project_meta["project_id"]
+            ext_logger = self._logger(project_id)
+            page_index = PageSignatureIndex(project_id) if settings.page_dedup_enabled else None
+            pdfs = _find_pdfs(project_dir)
+            ext_logger.start_project(total_files=len(pdfs))
+
+            for pdf_path in pdfs:
+                filename = pdf_path.name
+                if resume and ext_logger.is_already_indexed(filename):
+                    continue
+                if not retry_failed and ext_logger.is_failed(filename):
+                    continue
+
+                start = time.time()
+                try:
+                    pdf_meta = self._pipeline._pdf_meta(project_dir, project_meta, filename)
+                    dedup = page_index.begin(filename) if page_index else None
+                    chunks, structure = self._pipeline._process_single_pdf(
+                        pdf_path, pdf_meta, ext_logger, dedup=dedup,
+                    )
+                    pages_deduped = dedup.pages_duplicate if dedup else 0
+                    if not structure or not (chunks or pages_deduped):
+                        ext_logger.file_error(filename, "No se generaron chunks (PDF vacío o sin texto)")
+                        continue
+                except Exception as e:
+                    logger.error(f"Error procesando {filename}: {e}")
+                    ext_logger.file_error(filename, str(e))
+                    continue
+
+                if page_index and dedup:
+                    # Later PDFs of this job must see these pages; persisted on completion
+                    page_index.commit(dedup, save=False)
+
+                key = f"{project_id}/{filename}"
+                result = _extraction_result(
+                    filename, project_id, structure, chunks,
+                    pages_deduped=pages_deduped, duration_s=time.time() - start,
+                )
+                cp["files"][key] = {
+                    "project_id": project_id,
+                    "filename": filename,
+                    "doc_id": structure.doc_id,
+                    "requests": [],
+                    "result": asdict(result),
+                    "dedup": {
+                        "signatures": {str(p): f"{s:016x}" for p, s in dedup.signatures.items()},
+                        "aliases": {str(p): list(a) for p, a in dedup.aliases.items()},
+                    } if dedup else None,
+                    "indexed": False,
+                }
+                records.extend((key, c) for c in chunks)
+
+        # Pack all chunks (across PDFs and projects) into Batch API requests
+        texts = [clean_for_embedding(c.embed_text) for _, c in records]
+        ranges = pack_by_tokens([count_tokens(t) for t in texts])
+
+        with open(self._dir / "requests.jsonl", "w", encoding="utf-8") as req_file:
+            for n, (a, b) in enumerate(ranges):
+                custom_id = f"req-{n:06d}"
+                req_file.write(json.dumps({
+                    "custom_id": custom_id,
+                    "method": "POST",
+                    "url": "/v1/embeddings",
+                    "body": {**embedding_params(), "input": texts[a:b]},
+                }, ensure_ascii=False) + "\n")
+
+                with open(self._chunks_dir / f"{custom_id}.jsonl", "w", encoding="utf-8") as f:
+                    for _, chunk in records[a:b]:
+                        f.write(json.dumps(asdict(chunk), ensure_ascii=False) + "\n")
+
+                keys = sorted({key for key, _ in records[a:b]})
+                cp["requests"][custom_id] = keys
+                for key in keys:
+                    cp["files"][key]["requests"].append(custom_id)
+
+        cp["phase"] = "prepared"
+        self._save_checkpoint()
+        logger.info(f"Batch preparado: {len(cp['files'])} PDFs, {len(records)} chunks, {len(ranges)} requests")
+
+        # PDFs with 0 chunks (all pages duplicated) need no embedding
+        for key, info in cp["files"].items():
+            if not info["requests"]:
+                self._mark_indexed(key)
+        self._save_checkpoint()
+
+    # ── 2. Submit / 3. Poll ─────────────────────────────────────────────
+
+    def submit(self):
+        cp = self.checkpoint
+        with open(self._dir / "requests.jsonl", "rb") as f:
+            input_file = self._api.files.create(file=f, purpose="batch")
+        batch = self._api.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/embeddings",
+            completion_window="24h",
+        )
+        cp["batch_id"] = batch.id
+        cp["phase"] = "submitted"
+        self._save_checkpoint()
+        logger.info(f"Batch enviado: {batch.id} ({len(cp['requests'])} requests)")
+
+    def wait(self):
+        cp = self.checkpoint
+        while True:
+            batch = self._api.batches.retrieve(cp["batch_id"])
+            if batch.status == "completed":
+                cp["output_file_id"] = batch.output_file_id
+                cp["error_file_id"] = getattr(batch, "error_file_id", None)
+                cp["phase"] = "completed"
+                self._save_checkpoint()
+                return
+            if batch.status == "expired" and getattr(batch, "output_file_id", None):
+                # Partial results are kept; what is missing is embedded synchronously in upsert
+                logger.warning(f"Batch {batch.id} expiró con resultados parciales — se usan")
+                cp["output_file_id"] = batch.output_file_id
+                cp["error_file_id"] = getattr(batch, "error_file_id", None)
+                cp["phase"] = "completed"
+                self._save_checkpoint()
+                return
+            if batch.status in ("failed", "expired", "cancelled"):
+                # Back to "prepared": requests.jsonl is still valid, the next run resubmits it
+                cp["batch_id"] = None
+                cp["phase"] = "prepared"
+                self._save_checkpoint()
+                raise RuntimeError(
+                    f"Batch {batch.id} terminó con estado {batch.status}; "
+                    f"se reenviará en la próxima ejecución"
+                )
+            logger.info(f"Batch {batch.id}: {batch.status} — siguiente consulta en {settings.batch_poll_interval:.0f}s")
+            time.sleep(settings.batch_poll_interval)
+
+    # ── 4. Upsert ───────────────────────────────────────────────────────
+
+    def _load_chunks(self, custom_id: str) -> list[EnrichedChunk]:
+        with open(self._chunks_dir / f"{custom_id}.jsonl", encoding="utf-8") as f:
+            return [EnrichedChunk(**json.loads(line)) for line in f]
+
+    def upsert_results(self):
+        """Recorre output.jsonl y upsertea cada request. Reanudable por custom_id."""
+        cp = self.checkpoint
+        output_path = self._dir / "output.jsonl"
+        if cp["output_file_id"] and not output_path.exists():
+            self._api.files.content(cp["output_file_id"]).write_to_file(output_path)
+
+        pinecone = self._pipeline._get_pinecone()
+        done = set(cp["upserted"])
+        failed = self._batch_errors()
+
+        if output_path.exists():
+            with open(output_path, encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    custom_id = entry["custom_id"]
+                    if custom_id in done:
+                        continue
+                    response = entry.get("response") or {}
+                    if entry.get("error") or response.get("status_code") != 200:
+                        failed.setdefault(custom_id, _entry_error(entry))
+                        continue
+                    data = sorted(response["body"]["data"], key=lambda d: d["index"])
+                    chunks = self._load_chunks(custom_id)
+                    n = pinecone.upsert_chunks(chunks, embeddings=[d["embedding"] for d in data])
+                    self._request_done(custom_id, done, spooled=n < len(chunks))
+
+        # Requests the batch rejected → their PDFs are marked failed (--retry-failed re-processes them)
+        for custom_id, error in failed.items():
+            if custom_id not in done:
+                self._request_failed(custom_id, error)
+
+        # Requests with no result at all (e.g. expired batch) → synchronous embeddings
+        missing = [cid for cid in cp["requests"] if cid not in done and cid not in failed]
+        if missing:
+            logger.warning(f"{len(missing)} requests sin resultado en el batch — embebiendo en modo síncrono")
+        for custom_id in missing:
+            chunks = self._load_chunks(custom_id)
+            n = pinecone.upsert_chunks(chunks)
+            self._request_done(custom_id, done, spooled=n < len(chunks))
+
+        cp["phase"] = "done"
+        self._save_checkpoint()
+        for ext_logger in self._loggers.values():
+            ext_logger.finish_project()
+
+    def _batch_errors(self) -> dict[str, str]:
+        """custom_id → error, según el error file del batch (se descarga una vez)."""
+        cp = self.checkpoint
+        errors_path = self._dir / "errors.jsonl"
+        if cp.get("error_file_id") and not errors_path.exists():
+            self._api.files.content(cp["error_file_id"]).write_to_file(errors_path)
+        if not errors_path.exists():
+            return {}
+        with open(errors_path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        return {entry["custom_id"]: _entry_error(entry) for entry in entries if entry.get("custom_id")}
+
+    def _request_failed(self, custom_id: str, error: str):
+        """Marca "failed" los PDFs de un request que el batch no pudo embeber."""
+        cp = self.checkpoint
+        reported = cp.setdefault("failed_requests", [])
+        if custom_id in reported:
+            return
+        logger.warning(f"Batch request {custom_id} falló: {error}")
+        for key in cp["requests"][custom_id]:
+            info = cp["files"][key]
+            if not info.get("failed"):
+                info["failed"] = True
+                self._logger(info["project_id"]).file_error(
+                    info["filename"], f"Batch API ({custom_id}): {error}",
+                )
+        reported.append(custom_id)
+        self._save_checkpoint()
+
+    def _request_done(self, custom_id: str, done: set[str], spooled: bool = False):
+        cp = self.checkpoint
+        done.add(custom_id)
+        cp["upserted"].append(custom_id)
+        for key in cp["requests"][custom_id]:
+            if spooled:
+                cp["files"][key]["spooled"] = True
+            if not cp["files"][key].get("failed") and all(r in done for r in cp["files"][key]["requests"]):
+                self._mark_indexed(key)
+        self._save_checkpoint()
+
+    def _replace_manifest(self, info: dict):
+        """Elimina del índice los chunk IDs que el PDF ya no tiene y guarda su manifiesto."""
+        chunks = [
+            c for custom_id in info["requests"]
+            for c in self._load_chunks(custom_id)
+            if c.project_id == info["project_id"] and c.filename == info["filename"]
+        ]
+        new_ids = {c.chunk_id for c in chunks}
+        manifest = DocumentManifest(info["project_id"], info["doc_id"])
+        pinecone = self._pipeline._get_pinecone()
+        try:
+            # list_ids is scoped to the project (same filename in two projects = same doc_id)
+            old_ids = manifest.chunk_ids if manifest.exists else pinecone.list_ids(
+                prefix=_doc_prefix(info["doc_id"]), project_id=info["project_id"],
+            )
+            stale = sorted(i for i in old_ids if i not in new_ids)
+            if stale:
+                pinecone.delete_ids(stale, project_id=info["project_id"])
+        except Exception as e:
+            logger.warning(f"{info['filename']}: IDs obsoletos sin eliminar ({e}) — quedan para el reconciliador")
+        manifest.replace(chunks, info["filename"])
+
+    def _mark_indexed(self, key: str):
+        info = self.checkpoint["files"][key]
+        if info.get("indexed"):
+            return
+        result = dict(info["result"])
+        result["page_results"] = [PageOCRResult(**pr) for pr in result["page_results"]]
+        self._replace_manifest(info)
+        self._logger(info["project_id"]).file_ok(
+            info["filename"], FileExtractionResult(**result), upsert_pending=info.get("spooled", False),
+        )
+
+        if info.get("dedup") and settings.page_dedup_enabled:
+            page_index = PageSignatureIndex(info["project_id"])
+            dedup = page_index.begin(info["filename"])
+            dedup.signatures = {int(p): int(s, 16) for p, s in info["dedup"]["signatures"].items()}
+            dedup.aliases = {int(p): (a[0], a[1]) for p, a in info["dedup"]["aliases"].items()}
+            page_index.commit(dedup)
+
+        info["indexed"] = True
+
+
+def _entry_error(entry: dict) -> str:
+    """Mensaje de error de una línea del output/error file de la Batch API."""
+    error = entry.get("error") or ((entry.get("response") or {}).get("body") or {}).get("error") or {}
+    if isinstance(error, dict):
+        return error.get("message") or error.get("code") or "error desconocido"
+    return str(error)
@@ -542,6 +542,11 @@ def _build_tree(
 
 # ─── Main parser ────────────────────────────────────────────────────────────
 
+def _doc_id(filename: str) -> str:
+    """ID estable de un documento: hash del nombre del archivo."""
+    return hashlib.md5(filename.encode()).hexdigest()[:16]
+
+
 class DocumentStructureParser:
     """
     Parser que extrae texto de un PDF y construye un árbol jerárquico.
@@ -559,7 +564,7 @@ class DocumentStructureParser:
         if not pdf_path.exists():
             raise FileNotFoundError(f"PDF no encontrado: {pdf_path}")
 
-        doc_id = hashlib.md5(pdf_path.name.encode()).hexdigest()[:16]
+        doc_id = _doc_id(pdf_path.name)
         filename = pdf_path.name
 
         try:
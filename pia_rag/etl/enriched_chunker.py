@@ -13,15 +13,28 @@ Esto combina:
 
 from __future__ import annotations
 
+import hashlib
+import math
 import re
 import unicodedata
-from dataclasses import dataclass, field
+from collections import Counter
+from dataclasses import dataclass, field, replace
 from typing import Optional
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from pia_rag.config import settings
 from pia_rag.etl.document_parser import DocumentStructure, StructureNode
+from pia_rag.etl.page_dedup import DocumentDedup
+
+
+# Campos filtrables que quedan en Pinecone cuando el texto vive en el ChunkStore
+_FILTER_FIELDS = (
+    "project_id", "doc_id", "doc_type", "chunk_level", "chapter_title",
+    "source", "instrument_type", "region", "commune", "evaluation_status",
+    "page_start", "page_end", "has_tables", "has_figures",
+    "coordinates_lat", "coordinates_lon", "surface_ha", "investment_musd",
+)
 
 
 # ─── Data classes ───────────────────────────────────────────────────────────
@@ -86,6 +99,14 @@ class EnrichedChunk:
     has_tables: bool = False
     has_figures: bool = False
 
+    def to_filter_metadata(self) -> dict:
+        """
+        Metadata mínima para Pinecone: solo los campos que se usan en filtros.
+        Texto y campos de display quedan en el ChunkStore local.
+        """
+        meta = self.to_pinecone_metadata()
+        return {k: meta[k] for k in _FILTER_FIELDS if k in meta}
+
     def to_pinecone_metadata(self) -> dict:
         """Convierte a dict para Pinecone metadata (text truncado a 3800 chars)."""
         meta = {
@@ -147,6 +168,73 @@ def _clean_text(text: str) -> str:
     return text.strip()
 
 
+def _normalize_edge_line(line: str) -> str:
+    """Normaliza una línea de borde: "Página 3 de 120" y "Página 47 de 120" → "página # de #"."""
+    line = line.strip().lower()
+    line = re.sub(r"\d+", "#", line)
+    return re.sub(r"\s+", " ", line)
+
+
+def _edge_lines(lines: list[str], n: int) -> list[tuple[str, int]]:
+    """
+    Retorna las n primeras ("top") y n últimas ("bottom") líneas no vacías como
+    (posición, índice). Páginas con ≤ 2n líneas no tienen bordes confiables.
+    """
+    non_empty = [i for i, ln in enumerate(lines) if ln.strip()]
+    if len(non_empty) <= 2 * n:
+        return []
+    return [("top", i) for i in non_empty[:n]] + [("bottom", i) for i in non_empty[-n:]]
+
+
+def _detect_boilerplate(page_texts: list[str]) -> set[tuple[str, str]]:
+    """
+    Detecta encabezados/pies de página repetidos en un documento.
+
+    Una línea es boilerplate si, normalizada, aparece en el mismo borde (superior
+    o inferior) de al menos `boilerplate_min_page_ratio` de las páginas con texto.
+    Retorna el conjunto de (posición, línea normalizada) a eliminar.
+    """
+    pages = [t for t in page_texts if t and t.strip()]
+    if len(pages) < settings.boilerplate_min_pages:
+        return set()
+
+    n = settings.boilerplate_edge_lines
+    counter: Counter = Counter()
+    for text in pages:
+        lines = text.split("\n")
+        counter.update({(pos, _normalize_edge_line(lines[i])) for pos, i in _edge_lines(lines, n)})
+
+    threshold = max(2, math.ceil(settings.boilerplate_min_page_ratio * len(pages)))
+    return {key for key, count in counter.items() if count >= threshold}
+
+
+def _strip_boilerplate(text: str, boilerplate: set[tuple[str, str]]) -> str:
+    """
+    Elimina de los bordes de la página las líneas detectadas como boilerplate.
+
+    Solo quita tramos contiguos pegados al borde: la primera línea que no es
+    boilerplate detiene la limpieza de ese borde.
+    """
+    if not boilerplate:
+        return text
+
+    lines = text.split("\n")
+    edges = _edge_lines(lines, settings.boilerplate_edge_lines)
+    top = [i for pos, i in edges if pos == "top"]
+    bottom = [i for pos, i in reversed(edges) if pos == "bottom"]
+
+    drop: set[int] = set()
+    for pos, indices in (("top", top), ("bottom", bottom)):
+        for i in indices:
+            if (pos, _normalize_edge_line(lines[i])) not in boilerplate:
+                break
+            drop.add(i)
+
+    if not drop:
+        return text
+    return "\n".join(ln for i, ln in enumerate(lines) if i not in drop)
+
+
 def _estimate_tokens(text: str) -> int:
     """Estimación rápida de tokens (~0.75 words/token para español)."""
     words = len(text.split())
@@ -171,6 +259,78 @@ def _safe_id(text: str) -> str:
     return re.sub(r"[^a-zA-Z0-9_]", "_", text_norm)
 
 
+def _chunk_id(doc_id: str, page_num: int, text: str, occurrence: int = 0) -> str:
+    """
+    ID estable: documento + página + hash del contenido. Editar una página no
+    cambia los IDs del resto del documento (con un índice correlativo todos se
+    desplazaban). `occurrence` distingue textos idénticos en la misma página.
+    """
+    digest = hashlib.sha1(f"{page_num}\x00{occurrence}\x00{text}".encode("utf-8")).hexdigest()[:12]
+    return f"{_doc_prefix(doc_id)}p{page_num:04d}_{digest}"
+
+
+def _doc_prefix(doc_id: str) -> str:
+    """Prefijo común de todos los chunk IDs de un documento (para index.list)."""
+    return f"{_safe_id(doc_id)}__"
+
+
+def _project_fields(project_meta: dict) -> dict:
+    """Campos de EnrichedChunk que vienen de project.json (y la URL de gdrive_map)."""
+    return {
+        "source": project_meta.get("source", "seia"),
+        "date": project_meta.get("ingreso_date", ""),
+        "url": project_meta.get("url", ""),
+        "project_id": project_meta.get("project_id", ""),
+        "project_name": project_meta.get("project_name", ""),
+        "project_type": project_meta.get("project_type", ""),
+        "titular": project_meta.get("titular", ""),
+        "region": project_meta.get("region", ""),
+        "commune": project_meta.get("commune", ""),
+        "instrument_type": project_meta.get("instrument_type", ""),
+        "evaluation_status": project_meta.get("evaluation_status", ""),
+        "rca_number": project_meta.get("rca_number", ""),
+        "expedition_id": project_meta.get("expedition_id", ""),
+        "coordinates_lat": project_meta.get("coordinates_lat"),
+        "coordinates_lon": project_meta.get("coordinates_lon"),
+        "surface_ha": project_meta.get("surface_ha"),
+        "investment_musd": project_meta.get("investment_musd"),
+    }
+
+
+def _context_prefix(
+    project_meta: dict,
+    doc_type: str,
+    chapter_title: str,
+    section_title: str,
+    subsection_title: str,
+) -> str:
+    """Prefijo de contexto que va dentro del embedding: "[EIA] [Proyecto: X] [Cap > Sec]"."""
+    instrument = project_meta.get("instrument_type", doc_type)
+    project_name = project_meta.get("project_name", project_meta.get("project_id", ""))
+    ctx_parts = [f"[{instrument}]", f"[Proyecto: {project_name}]"]
+
+    if chapter_title:
+        ctx_parts.append(f"[{chapter_title}")
+        if section_title:
+            ctx_parts.append(f"> {section_title}")
+            if subsection_title:
+                ctx_parts.append(f"> {subsection_title}")
+        ctx_parts[-1] += "]"
+    return " ".join(ctx_parts)
+
+
+def _embed_text(context_prefix: str, project_meta: dict, filename: str, page_num: int, text: str) -> str:
+    """Texto a embeber: prefijo + tatuaje de identidad + texto del chunk."""
+    project_name = project_meta.get("project_name", project_meta.get("project_id", ""))
+    # Tatuaje: inject identity into the text for embedding
+    tatuaje = (
+        f"[PROYECTO: {project_name} | "
+        f"DOC: {filename} | "
+        f"PÁG: {page_num}]\n"
+    )
+    return f"{context_prefix}\n{tatuaje}{text}"
+
+
 def _infer_doc_type(filename: str, folder_path: str = "") -> str:
     """
     Infiere el tipo de documento desde la estructura de carpetas (prioridad)
@@ -361,19 +521,22 @@ class EnrichedHierarchicalChunker:
         structure: DocumentStructure,
         project_meta: dict,
         folder_path: str = "",
+        dedup: Optional[DocumentDedup] = None,
     ) -> list[EnrichedChunk]:
         """
         Genera chunks enriquecidos para un documento parseado.
 
         Estrategia:
           1. Construye mapa página → jerarquía desde el árbol de estructura
-          2. Para cada página con texto, divide en chunks con RecursiveCharacterTextSplitter
-          3. Cada chunk recibe metadata jerárquica según la página a la que pertenece
+          2. Detecta encabezados/pies repetidos y los quita de cada página
+          3. Para cada página con texto, divide en chunks con RecursiveCharacterTextSplitter
+          4. Cada chunk recibe metadata jerárquica según la página a la que pertenece
 
         Args:
             structure: Resultado de DocumentStructureParser.parse()
             project_meta: Diccionario con metadata del proyecto (de project.json)
             folder_path: Ruta de la carpeta del PDF (para inferir doc_type)
+            dedup: Sesión de deduplicación; omite páginas casi idénticas a otras ya indexadas
 
         Returns:
             Lista de EnrichedChunk listos para embedding + upsert
@@ -384,8 +547,12 @@ class EnrichedHierarchicalChunker:
         doc_type = _infer_doc_type(structure.filename, folder_path)
         page_hierarchy = _build_page_hierarchy_map(structure, folder_path)
 
+        # Encabezados/pies repetidos (consultora, proyecto, "Página X de Y")
+        boilerplate = _detect_boilerplate([pr.text for pr in structure.page_results])
+
         chunks: list[EnrichedChunk] = []
         chunk_idx = 0
+        seen: Counter = Counter()  # (page, text) → occurrences, keeps IDs unique
 
         for page_result in structure.page_results:
             page_num = page_result.page_num
@@ -395,11 +562,15 @@ class EnrichedHierarchicalChunker:
             if not page_text or len(page_text.strip()) < 20:
                 continue
 
-            # Clean the page text
-            cleaned = _clean_text(page_text)
+            # Strip running headers/footers, then clean the page text
+            cleaned = _clean_text(_strip_boilerplate(page_text, boilerplate))
             if len(cleaned) < 20:
                 continue
 
+            # Same page already indexed from another PDF (annex inside an Adenda/ICE)
+            if dedup is not None and dedup.is_duplicate(page_num, cleaned):
+                continue
+
             # Get hierarchy info for this page
             hier = page_hierarchy.get(page_num, _HierarchyInfo())
 
@@ -424,6 +595,9 @@ class EnrichedHierarchicalChunker:
                 else:
                     level = "chapter"
 
+                occurrence = seen[(page_num, part)]
+                seen[(page_num, part)] += 1
+
                 ch = self._make_chunk(
                     text=part,
                     level=level,
@@ -433,6 +607,7 @@ class EnrichedHierarchicalChunker:
                     project_meta=project_meta,
                     doc_type=doc_type,
                     chunk_idx=chunk_idx,
+                    occurrence=occurrence,
                 )
                 chunks.append(ch)
                 chunk_idx += 1
@@ -449,6 +624,7 @@ class EnrichedHierarchicalChunker:
         project_meta: dict,
         doc_type: str,
         chunk_idx: int,
+        occurrence: int = 0,
     ) -> EnrichedChunk:
         """Construye un EnrichedChunk con toda su metadata."""
 
@@ -462,33 +638,14 @@ class EnrichedHierarchicalChunker:
             parts.append(hier.subsection_num)
         hierarchy_path = " > ".join(parts) if parts else ""
 
-        # Context prefix (embedded in the embedding for better semantic search)
-        instrument = project_meta.get("instrument_type", doc_type)
-        project_name = project_meta.get("project_name", project_meta.get("project_id", ""))
-        ctx_parts = [f"[{instrument}]", f"[Proyecto: {project_name}]"]
-
-        if hier.chapter_title:
-            ctx_parts.append(f"[{hier.chapter_title}")
-            if hier.section_title:
-                ctx_parts.append(f"> {hier.section_title}")
-                if hier.subsection_title:
-                    ctx_parts.append(f"> {hier.subsection_title}")
-            ctx_parts[-1] += "]"
-        context_prefix = " ".join(ctx_parts)
-
-        # Tatuaje: inject identity into the text for embedding
-        tatuaje = (
-            f"[PROYECTO: {project_name} | "
-            f"DOC: {structure.filename} | "
-            f"PÁG: {page_num}]\n"
+        context_prefix = _context_prefix(
+            project_meta, doc_type, hier.chapter_title, hier.section_title, hier.subsection_title,
         )
-        embed_text = f"{context_prefix}\n{tatuaje}{text}"
+        embed_text = _embed_text(context_prefix, project_meta, structure.filename, page_num, text)
 
         position = page_num / structure.total_pages if structure.total_pages > 0 else 0.0
 
-        # Chunk ID: unique per document + chunk index
-        safe_doc = _safe_id(structure.doc_id)
-        chunk_id = f"{safe_doc}__{level}{chunk_idx:05d}"
+        chunk_id = _chunk_id(structure.doc_id, page_num, text, occurrence)
 
         # Title for display
         title = hier.chapter_title or structure.filename
@@ -514,28 +671,28 @@ class EnrichedHierarchicalChunker:
             section_title=hier.section_title,
             subsection_num=hier.subsection_num,
             subsection_title=hier.subsection_title,
-            source=project_meta.get("source", "seia"),
             doc_type=doc_type,
             title=title,
             filename=structure.filename,
-            date=project_meta.get("ingreso_date", ""),
-            url=project_meta.get("url", ""),
-            project_id=project_meta.get("project_id", ""),
-            project_name=project_meta.get("project_name", ""),
-            project_type=project_meta.get("project_type", ""),
-            titular=project_meta.get("titular", ""),
-            region=project_meta.get("region", ""),
-            commune=project_meta.get("commune", ""),
-            instrument_type=project_meta.get("instrument_type", ""),
-            evaluation_status=project_meta.get("evaluation_status", ""),
-            rca_number=project_meta.get("rca_number", ""),
-            expedition_id=project_meta.get("expedition_id", ""),
-            coordinates_lat=project_meta.get("coordinates_lat"),
-            coordinates_lon=project_meta.get("coordinates_lon"),
-            surface_ha=project_meta.get("surface_ha"),
-            investment_musd=project_meta.get("investment_musd"),
+            **_project_fields(project_meta),
             word_count=len(text.split()),
             token_count=_estimate_tokens(text),
             has_tables=_has_table_markers(text),
             has_figures=_has_figure_markers(text),
         )
+
+    def refresh_metadata(self, chunk: EnrichedChunk, project_meta: dict) -> EnrichedChunk:
+        """
+        Recalcula los campos de proyecto (project.json, URL de Drive) de un chunk
+        ya generado, sin volver a parsear el PDF. El embed_text solo cambia si
+        cambió algo que va dentro del embedding (nombre del proyecto, instrumento).
+        """
+        context_prefix = _context_prefix(
+            project_meta, chunk.doc_type, chunk.chapter_title, chunk.section_title, chunk.subsection_title,
+        )
+        return replace(
+            chunk,
+            context_prefix=context_prefix,
+            embed_text=_embed_text(context_prefix, project_meta, chunk.filename, chunk.page_start, chunk.text),
+            **_project_fields(project_meta),
+        )
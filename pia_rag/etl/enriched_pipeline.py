@@ -4,7 +4,8 @@ etl/enriched_pipeline.py — Orquestador del pipeline ETL completo.
 Flujo por proyecto:
   1. Lee project.json
   2. Itera sobre cada PDF en la carpeta
-  3. Para cada PDF: parse → chunk → embed → upsert
+  3. Para cada PDF: parse → chunk; los embeddings se piden en requests
+     compartidos entre PDFs (presupuesto de tokens) → upsert
   4. Logging en 3 destinos (humano, JSONL, state.json)
 """
 
@@ -12,19 +13,23 @@ from __future__ import annotations
 
 import json
 import time
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
 
 from loguru import logger
 
 from pia_rag.config import settings
-from pia_rag.etl.document_parser import DocumentStructureParser
-from pia_rag.etl.enriched_chunker import EnrichedChunk, EnrichedHierarchicalChunker
+from pia_rag.etl.document_parser import DocumentStructure, DocumentStructureParser
+from pia_rag.etl.enriched_chunker import EnrichedChunk, EnrichedHierarchicalChunker, _doc_prefix
 from pia_rag.etl.extraction_logger import (
     ExtractionLogger,
     FileExtractionResult,
     PageOCRResult,
 )
+from pia_rag.etl.page_dedup import DocumentDedup, PageSignatureIndex
+from pia_rag.storage.chunk_manifest import ChunkDiff, DocumentManifest, iter_manifests
+from pia_rag.storage.embedding_batcher import CrossDocumentBatcher, EmbeddedGroup
 from pia_rag.storage.pinecone_client import PineconeClient
 
 
@@ -93,6 +98,64 @@ def _load_gdrive_map() -> dict[str, dict[str, str]]:
     return {}
 
 
+def _extraction_result(
+    filename: str,
+    project_id: str,
+    structure: DocumentStructure,
+    chunks: list[EnrichedChunk],
+    pages_deduped: int = 0,
+    duration_s: float = 0.0,
+) -> FileExtractionResult:
+    """Arma el FileExtractionResult de un PDF indexado."""
+    avg_tokens = (
+        sum(c.token_count for c in chunks) / len(chunks)
+        if chunks else 0.0
+    )
+    return FileExtractionResult(
+        filename=filename,
+        project_id=project_id,
+        status="indexed",
+        total_pages=structure.total_pages,
+        pages_pymupdf=structure.pages_pymupdf,
+        pages_ocr=structure.pages_ocr,
+        pages_failed=structure.pages_failed,
+        pages_deduped=pages_deduped,
+        chapters=structure.n_chapters,
+        sections=structure.n_sections,
+        subsections=structure.n_subsections,
+        chunks=len(chunks),
+        tokens_avg=round(avg_tokens, 1),
+        chars_total=structure.chars_total,
+        ocr_triggered=structure.ocr_triggered,
+        duration_s=round(duration_s, 1),
+        page_results=[
+            PageOCRResult(
+                page=pr.page_num,
+                method=pr.method,
+                chars_extracted=pr.chars,
+                lines_extracted=len(pr.text.split("\n")) if pr.text else 0,
+                avg_confidence=pr.ocr_confidence,
+                duration_ms=pr.duration_ms,
+                warnings=pr.warnings,
+                error=pr.error,
+            )
+            for pr in structure.page_results
+        ],
+    )
+
+
+@dataclass
+class _PendingFile:
+    """PDF ya chunkeado que espera sus embeddings en el batcher."""
+    project_id: str
+    structure: DocumentStructure
+    duration_s: float
+    dedup: Optional[DocumentDedup]
+    chunks: list[EnrichedChunk]
+    manifest: DocumentManifest
+    diff: ChunkDiff
+
+
 class EnrichedETLPipeline:
     """
     Pipeline ETL completo: PDF → parse → chunk → embed → Pinecone.
@@ -153,11 +216,31 @@ class EnrichedETLPipeline:
         # Init Pinecone
         pinecone = self._get_pinecone()
 
+        # Retry vectors left in the outbox by a previous run before anything else
+        for _, filename in pinecone.drain_outbox(project_id):
+            ext_logger.confirm_upserts(filename)
+        in_outbox = {filename for _, filename in pinecone.outbox_pending(project_id)}
+
+        # Near-duplicate page signatures (annexes repeated inside Adendas/ICE)
+        page_index = PageSignatureIndex(project_id) if settings.page_dedup_enabled else None
+
+        # Chunks from several PDFs share embedding requests (token-budgeted)
+        batcher = CrossDocumentBatcher(pinecone.embed_requests)
+
         # Process each PDF
         total_chunks = 0
         total_ok = 0
         total_failed = 0
 
+        def _index_ready(groups: list[EmbeddedGroup]):
+            nonlocal total_chunks, total_ok, total_failed
+            for group in groups:
+                if self._index_file(group, pinecone, ext_logger, page_index):
+                    total_chunks += len(group.payload.chunks)
+                    total_ok += 1
+                else:
+                    total_failed += 1
+
         for pdf_path in pdfs:
             filename = pdf_path.name
 
@@ -170,70 +253,52 @@ class EnrichedETLPipeline:
                 ext_logger.file_skipped(filename)
                 continue
 
+            # Embeddings already paid for — waits in the outbox (drain-outbox), unless
+            # --no-resume / --retry-failed asks for it or its outbox entry is gone
+            if ext_logger.is_pending_upsert(filename):
+                if filename not in in_outbox:
+                    logger.warning(f"  {filename}: pending_upsert sin batches en el outbox — se reprocesa")
+                elif resume and not retry_failed:
+                    ext_logger.file_skipped(filename)
+                    continue
+
             # Process single PDF — inject Google Drive URL into project_meta
             start = time.time()
             try:
-                # Look up Google Drive URL for this PDF
-                pdf_meta = dict(project_meta)  # copy
-                gdrive_project = self._gdrive_map.get(project_dir.name, {})
-                gdrive_url = gdrive_project.get(filename, "")
-                pdf_meta["url"] = gdrive_url
-
-                chunks, structure = self._process_single_pdf(pdf_path, pdf_meta, ext_logger)
-                duration = time.time() - start
-
-                if chunks and structure:
-                    # Upsert to Pinecone
-                    n_indexed = pinecone.upsert_chunks(chunks)
-
-                    avg_tokens = (
-                        sum(c.token_count for c in chunks) / len(chunks)
-                        if chunks else 0.0
+                pdf_meta = self._pdf_meta(project_dir, project_meta, filename)
+                dedup = page_index.begin(filename) if page_index else None
+                chunks, structure = self._process_single_pdf(
+                    pdf_path, pdf_meta, ext_logger, dedup=dedup,
+                )
+                pages_deduped = dedup.pages_duplicate if dedup else 0
+
+                # A PDF whose pages are all duplicates is indexed with 0 chunks
+                if structure and (chunks or pages_deduped):
+                    # Only new or changed chunks are embedded
+                    manifest = DocumentManifest(project_id, structure.doc_id)
+                    diff = self._diff_against_index(manifest, chunks, pinecone, ext_logger, filename)
+                    logger.info(f"  {filename}: {diff.summary()}")
+                    pending = _PendingFile(
+                        project_id, structure, time.time() - start, dedup, chunks, manifest, diff,
                     )
-
-                    result = FileExtractionResult(
-                        filename=filename,
-                        project_id=project_id,
-                        status="indexed",
-                        total_pages=structure.total_pages,
-                        pages_pymupdf=structure.pages_pymupdf,
-                        pages_ocr=structure.pages_ocr,
-                        pages_failed=structure.pages_failed,
-                        chapters=structure.n_chapters,
-                        sections=structure.n_sections,
-                        subsections=structure.n_subsections,
-                        chunks=len(chunks),
-                        tokens_avg=round(avg_tokens, 1),
-                        chars_total=structure.chars_total,
-                        ocr_triggered=structure.ocr_triggered,
-                        duration_s=round(duration, 1),
-                        page_results=[
-                            PageOCRResult(
-                                page=pr.page_num,
-                                method=pr.method,
-                                chars_extracted=pr.chars,
-                                lines_extracted=len(pr.text.split("\n")) if pr.text else 0,
-                                avg_confidence=pr.ocr_confidence,
-                                duration_ms=pr.duration_ms,
-                                warnings=pr.warnings,
-                                error=pr.error,
-                            )
-                            for pr in structure.page_results
-                        ],
-                    )
-                    ext_logger.file_ok(filename, result)
-                    total_chunks += len(chunks)
-                    total_ok += 1
+                    # Signatures visible to the next PDFs now; persisted once this one is indexed
+                    if page_index and dedup:
+                        page_index.commit(dedup, save=False)
+                    _index_ready(batcher.add(filename, diff.to_embed, payload=pending))
                 else:
                     ext_logger.file_error(filename, "No se generaron chunks (PDF vacío o sin texto)")
                     total_failed += 1
 
             except Exception as e:
-                duration = time.time() - start
                 logger.error(f"Error procesando {filename}: {e}")
                 ext_logger.file_error(filename, str(e))
+                if page_index:
+                    page_index.rollback(filename)
                 total_failed += 1
 
+        _index_ready(batcher.flush())
+        logger.info(f"{project_id}: {batcher.requests_sent} requests de embeddings")
+
         ext_logger.finish_project()
 
         return {
@@ -245,29 +310,167 @@ class EnrichedETLPipeline:
             "chunks": total_chunks,
         }
 
+    def update_metadata(self, project_dir: Path) -> dict:
+        """
+        Recalcula la metadata de todos los chunks ya indexados de un proyecto
+        (project.json o gdrive_map.json cambiaron) desde sus manifiestos.
+        Solo se re-embeben los chunks cuyo embed_text cambió; el resto es un
+        `update` de metadata en Pinecone.
+        """
+        project_dir = Path(project_dir)
+        project_meta = _load_project_meta(project_dir)
+        project_id = project_meta["project_id"]
+        pinecone = self._get_pinecone()
+
+        manifests = iter_manifests(project_id)
+        logger.info(f"Actualizando metadata de {project_id}: {len(manifests)} documentos")
+
+        stats = {"project_id": project_id, "docs": len(manifests), "updated": 0,
+                 "reembedded": 0, "unchanged": 0, "failed": 0}
+        for manifest in manifests:
+            pdf_meta = self._pdf_meta(project_dir, project_meta, manifest.filename)
+            chunks = [self._chunker.refresh_metadata(c, pdf_meta) for c in manifest.records()]
+            diff = manifest.diff(chunks)
+            if not (diff.to_embed or diff.to_update):
+                stats["unchanged"] += diff.unchanged
+                continue
+
+            logger.info(f"  {manifest.filename}: {diff.summary()}")
+            n_embedded = 0
+            try:
+                if diff.to_embed:
+                    # Vectors that end up in the outbox are delivered by drain-outbox
+                    n_embedded = pinecone.upsert_chunks(diff.to_embed)
+            except Exception as e:
+                logger.error(f"  {manifest.filename}: re-embedding falló: {e}")
+                # Keep the previous records so the next run retries them
+                pending = {c.chunk_id for c in diff.to_embed}
+                previous = {c.chunk_id: c for c in manifest.records()}
+                chunks = [previous[c.chunk_id] if c.chunk_id in pending else c for c in chunks]
+            failed = set(pinecone.update_metadata(diff.to_update))
+            manifest.replace(chunks, manifest.filename, stale_ids=failed)
+
+            stats["reembedded"] += n_embedded
+            stats["updated"] += len(diff.to_update) - len(failed)
+            stats["unchanged"] += diff.unchanged
+            stats["failed"] += len(failed) + (len(diff.to_embed) - n_embedded)
+
+        logger.info(
+            f"{project_id}: {stats['updated']} actualizados, {stats['reembedded']} re-embebidos, "
+            f"{stats['unchanged']} sin cambios, {stats['failed']} fallidos"
+        )
+        return stats
+
+    def _pdf_meta(self, project_dir: Path, project_meta: dict, filename: str) -> dict:
+        """Copia de project_meta con la URL de Google Drive del PDF."""
+        pdf_meta = dict(project_meta)
+        gdrive_project = self._gdrive_map.get(project_dir.name, {})
+        pdf_meta["url"] = gdrive_project.get(filename, "")
+        return pdf_meta
+
+    def _diff_against_index(
+        self,
+        manifest: DocumentManifest,
+        chunks: list[EnrichedChunk],
+        pinecone: PineconeClient,
+        ext_logger: ExtractionLogger,
+        filename: str,
+    ) -> ChunkDiff:
+        """
+        Diff de los chunks contra el manifiesto. Si el PDF se indexó antes de
+        existir manifiestos (IDs correlativos), los IDs viejos se buscan en el
+        índice por prefijo para eliminarlos.
+        """
+        diff = manifest.diff(chunks)
+        if manifest.exists or filename not in ext_logger.get_state().get("files", {}):
+            return diff
+
+        try:
+            new_ids = {c.chunk_id for c in chunks}
+            # Only this project's IDs: another project may have a PDF with the same filename (same doc_id)
+            legacy = pinecone.list_ids(prefix=_doc_prefix(manifest.doc_id), project_id=manifest.project_id)
+            diff.to_delete = sorted(i for i in legacy if i not in new_ids)
+        except Exception as e:
+            logger.warning(f"  {filename}: no se pudieron listar IDs antiguos ({e}) — quedan para el reconciliador")
+        return diff
+
+    def _index_file(
+        self,
+        group: EmbeddedGroup,
+        pinecone: PineconeClient,
+        ext_logger: ExtractionLogger,
+        page_index: Optional[PageSignatureIndex],
+    ) -> bool:
+        """Upsert de un PDF ya embebido y registro en los logs. Retorna True si quedó indexado."""
+        filename = group.key
+        pending: _PendingFile = group.payload
+        structure = pending.structure
+        chunks = pending.chunks
+        diff = pending.diff
+
+        if group.error:
+            ext_logger.file_error(filename, f"Embedding falló: {group.error}")
+            if page_index:
+                page_index.rollback(filename)
+            return False
+
+        try:
+            start = time.time()
+            n_indexed = pinecone.upsert_chunks(group.chunks, embeddings=group.embeddings)
+            failed_updates = pinecone.update_metadata(diff.to_update)
+            if diff.to_delete:
+                n_deleted = pinecone.delete_ids(diff.to_delete, project_id=pending.project_id)
+                logger.info(f"  {filename}: {n_deleted}/{len(diff.to_delete)} vectors obsoletos eliminados")
+            pending.manifest.replace(chunks, filename, stale_ids=set(failed_updates))
+
+            result = _extraction_result(
+                filename,
+                pending.project_id,
+                structure,
+                chunks,
+                pages_deduped=pending.dedup.pages_duplicate if pending.dedup else 0,
+                duration_s=pending.duration_s + time.time() - start,
+            )
+            ext_logger.file_ok(filename, result, upsert_pending=n_indexed < len(group.chunks))
+            if page_index and pending.dedup:
+                page_index.confirm(filename)
+            return True
+
+        except Exception as e:
+            logger.error(f"Error indexando {filename}: {e}")
+            ext_logger.file_error(filename, str(e))
+            if page_index:
+                page_index.rollback(filename)
+            return False
+
     def _process_single_pdf(
         self,
         pdf_path: Path,
         project_meta: dict,
         ext_logger: ExtractionLogger,
+        dedup: Optional[DocumentDedup] = None,
     ) -> tuple[list[EnrichedChunk], "DocumentStructure | None"]:
         """Procesa un PDF individual: parse → chunk. No hace upsert.
         Returns (chunks, structure) to avoid double-parsing."""
         logger.info(f"  Procesando: {pdf_path.name}")
 
         # Parse
-        from pia_rag.etl.document_parser import DocumentStructure
         structure = self._parser.parse(pdf_path)
         if not structure.full_text.strip():
             return [], structure
 
         # Chunk — pass folder_path so doc_type can be inferred from directory structure
         folder_path = str(pdf_path.parent)
-        chunks = self._chunker.chunk(structure, project_meta, folder_path=folder_path)
+        chunks = self._chunker.chunk(structure, project_meta, folder_path=folder_path, dedup=dedup)
         logger.info(
             f"  {pdf_path.name}: {structure.n_chapters} cap, "
             f"{structure.n_sections} sec → {len(chunks)} chunks"
         )
+        if dedup and dedup.pages_checked:
+            logger.info(
+                f"  {pdf_path.name}: {dedup.pages_duplicate}/{dedup.pages_checked} páginas "
+                f"duplicadas ({dedup.pages_duplicate / dedup.pages_checked:.0%}) — no se re-embeben"
+            )
         return chunks, structure
 
     def process_pdf_direct(
@@ -44,11 +44,12 @@ class FileExtractionResult:
     """Resultado completo de extracción de un archivo PDF."""
     filename: str
     project_id: str
-    status: str  # "indexed" | "failed" | "skipped"
+    status: str  # "indexed" | "pending_upsert" | "failed" | "skipped"
     total_pages: int = 0
     pages_pymupdf: int = 0
     pages_ocr: int = 0
     pages_failed: int = 0
+    pages_deduped: int = 0
     chapters: int = 0
     sections: int = 0
     subsections: int = 0
@@ -161,14 +162,21 @@ class ExtractionLogger:
         ]
         self._write_log("\n".join(lines))
 
-    def file_ok(self, filename: str, result: FileExtractionResult):
-        """Registra un archivo procesado exitosamente."""
+    def file_ok(self, filename: str, result: FileExtractionResult, upsert_pending: bool = False):
+        """
+        Registra un archivo procesado exitosamente.
+        Con upsert_pending=True parte de sus vectores quedó en el outbox: el archivo
+        queda "pending_upsert" hasta que confirm_upserts() lo marque "indexed".
+        """
+        if upsert_pending:
+            result.status = "pending_upsert"
         self._results.append(result)
         ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         # Log humano
+        label = "PENDING " if upsert_pending else "SUCCESS "
         line = (
-            f"{ts} | SUCCESS  | {filename} → "
+            f"{ts} | {label} | {filename} → "
             f"{result.chapters} cap, {result.sections} sec, {result.subsections} sub | "
             f"{result.chunks} chunks | avg {result.tokens_avg:.0f} tok"
         )
@@ -183,18 +191,23 @@ class ExtractionLogger:
         if result.ocr_triggered:
             ocr_pages = result.pages_ocr
             detail += f" [OCR: {ocr_pages} págs]"
+        if result.pages_deduped:
+            detail += f" [DUPLICADAS: {result.pages_deduped} págs]"
+        if upsert_pending:
+            detail += " [vectors pendientes en outbox]"
 
         self._write_log(f"{line}\n{detail}\n")
 
         # State
         self._state["files"][filename] = {
-            "status": "indexed",
+            "status": result.status,
             "chunks": result.chunks,
             "indexed_at": datetime.now(timezone.utc).isoformat(),
             "total_pages": result.total_pages,
             "pages_pymupdf": result.pages_pymupdf,
             "pages_ocr": result.pages_ocr,
             "pages_failed": result.pages_failed,
+            "pages_deduped": result.pages_deduped,
             "ocr_triggered": result.ocr_triggered,
             "extraction_rate": result.extraction_rate,
         }
@@ -211,6 +224,7 @@ class ExtractionLogger:
             "subsections": result.subsections,
             "chunks": result.chunks,
             "tokens_avg": result.tokens_avg,
+            "pages_deduped": result.pages_deduped,
         })
 
         # OCR detail log
@@ -246,6 +260,29 @@ class ExtractionLogger:
             "ocr_attempted": ocr_attempted,
         })
 
+    def confirm_upserts(self, filename: str):
+        """Marca como "indexed" un archivo cuyos vectores del outbox ya se confirmaron."""
+        file_state = self._state["files"].get(filename)
+        if not file_state or file_state.get("status") != "pending_upsert":
+            return
+        file_state["status"] = "indexed"
+        file_state["indexed_at"] = datetime.now(timezone.utc).isoformat()
+        if not any(f.get("status") != "indexed" for f in self._state["files"].values()):
+            self._state["status"] = "complete"
+        self._save_state()
+
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._write_log(f"{ts} | SUCCESS  | {filename} → vectors del outbox confirmados\n")
+
+    def forget_file(self, filename: str):
+        """Quita del estado un archivo que ya no existe en la carpeta del proyecto."""
+        if self._state["files"].pop(filename, None) is None:
+            return
+        self._save_state()
+
+        ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._write_log(f"{ts} | INFO     | {filename} eliminado del índice (ya no existe)\n")
+
     def file_skipped(self, filename: str):
         """Registra un archivo omitido (ya indexado)."""
         ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -257,8 +294,12 @@ class ExtractionLogger:
         ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         total_ok = sum(1 for r in self._results if r.status == "indexed")
+        total_pending = sum(1 for r in self._results if r.status == "pending_upsert")
         total_failed = len(self._errors)
         total_chunks = sum(r.chunks for r in self._results)
+        total_pages = sum(r.total_pages for r in self._results)
+        total_deduped = sum(r.pages_deduped for r in self._results)
+        dedup_ratio = total_deduped / total_pages if total_pages else 0.0
 
         # Update global state
         self._state["total_chunks"] = sum(
@@ -266,9 +307,9 @@ class ExtractionLogger:
         )
         self._state["total_indexed"] = self._state["total_chunks"]
 
-        if total_failed == 0 and total_ok > 0:
+        if total_failed == 0 and total_pending == 0 and total_ok > 0:
             self._state["status"] = "complete"
-        elif total_ok > 0:
+        elif total_ok > 0 or total_pending > 0:
             self._state["status"] = "partial"
         else:
             self._state["status"] = "failed"
@@ -278,8 +319,10 @@ class ExtractionLogger:
         lines = [
             f"{ts} | INFO     | {'=' * 60}",
             f"{ts} | WARNING  | SUMMARY {self.project_id} → "
-            f"{total_ok}/{total_ok + total_failed} OK | "
+            f"{total_ok}/{total_ok + total_pending + total_failed} OK | "
+            f"{total_pending} pendientes en outbox | "
             f"{total_chunks} chunks | {total_failed} error{'es' if total_failed != 1 else ''} | "
+            f"{total_deduped} págs duplicadas ({dedup_ratio:.1%}) | "
             f"{duration_s:.0f}s",
         ]
         for err in self._errors:
@@ -311,11 +354,14 @@ class ExtractionLogger:
             "ts": datetime.now(timezone.utc).isoformat(),
             "project_id": self.project_id,
             "event": "project_complete",
-            "pdfs_total": total_ok + total_failed,
+            "pdfs_total": total_ok + total_pending + total_failed,
             "pdfs_ok": total_ok,
+            "pdfs_pending_upsert": total_pending,
             "pdfs_failed": total_failed,
             "chunks": total_chunks,
             "vectors_indexed": total_chunks,
+            "pages_deduped": total_deduped,
+            "dedup_ratio": round(dedup_ratio, 4),
             "pinecone_index": settings.pinecone_index_name,
             "duration_s": round(duration_s, 1),
         })
@@ -327,6 +373,11 @@ class ExtractionLogger:
         file_state = self._state.get("files", {}).get(filename, {})
         return file_state.get("status") == "indexed"
 
+    def is_pending_upsert(self, filename: str) -> bool:
+        """Verifica si un archivo tiene vectores esperando en el outbox."""
+        file_state = self._state.get("files", {}).get(filename, {})
+        return file_state.get("status") == "pending_upsert"
+
     def is_failed(self, filename: str) -> bool:
         """Verifica si un archivo falló previamente."""
         file_state = self._state.get("files", {}).get(filename, {})
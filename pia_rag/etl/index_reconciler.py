@@ -0,0 +1,235 @@
+"""
+etl/index_reconciler.py — Reconciliación del índice y borrado de vectores huérfanos.
+
+Nada borraba vectores: PDFs renombrados o eliminados y documentos re-chunkeados
+en menos chunks dejaban registros viejos en el índice que seguían apareciendo
+en /search. El reconciliador, por proyecto (o por documento):
+
+  1. Junta los documentos conocidos: PDFs en la carpeta, manifiestos y state.json
+  2. Lista los IDs del índice por prefijo de documento ({doc_id}__), solo los
+     de este proyecto (el doc_id no incluye el proyecto: en el namespace
+     compartido se verifica la metadata project_id de cada ID)
+  3. Compara contra el manifiesto:
+       - PDF que ya no existe            → todos sus vectores son huérfanos
+       - PDF sin copia local (placeholder de iCloud o ≤ 500 bytes)
+                                         → "not_local": no se toca
+       - PDF con manifiesto              → huérfanos = IDs que no están en el manifiesto
+       - PDF sin manifiesto (legacy)     → no se toca (reprocesar primero)
+  4. Borra los huérfanos en lotes (salvo dry-run) y guarda el reporte en
+     data/processed/{project_id}/reconcile_report.json
+
+Las llamadas a list/delete pasan por un limitador (settings.reconcile_rpm).
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+from pia_rag.config import settings
+from pia_rag.etl.document_parser import _doc_id
+from pia_rag.etl.enriched_chunker import _doc_prefix
+from pia_rag.etl.enriched_pipeline import _find_pdfs, _load_project_meta
+from pia_rag.etl.extraction_logger import ExtractionLogger
+from pia_rag.storage.chunk_manifest import DocumentManifest, iter_manifests
+from pia_rag.storage.pinecone_client import PineconeClient
+from pia_rag.storage.rate_limiter import TokenBucket
+
+# IDs generados por el pipeline: {doc_id (16 hex)}__...
+_PIPELINE_ID_RE = re.compile(r"^([0-9a-f]{16})__")
+
+
+@dataclass
+class DocReconcile:
+    """Resultado de la reconciliación de un documento."""
+    doc_id: str
+    filename: str
+    status: str              # "ok" | "orphans" | "removed" | "no_manifest" | "not_local"
+    indexed: int = 0         # IDs encontrados en el índice
+    expected: int = 0        # IDs en el manifiesto
+    orphans: list[str] = field(default_factory=list)
+
+
+@dataclass
+class ReconcileReport:
+    project_id: str
+    dry_run: bool
+    docs: list[DocReconcile] = field(default_factory=list)
+    deleted: int = 0
+    created_at: str = field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
+
+    @property
+    def orphan_count(self) -> int:
+        return sum(len(d.orphans) for d in self.docs)
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["orphan_count"] = self.orphan_count
+        return data
+
+
+class IndexReconciler:
+    """
+    Compara el índice contra manifiestos/state y elimina vectores huérfanos.
+
+    Uso:
+        reconciler = IndexReconciler()
+        report = reconciler.run(Path("data/projects/proyecto_x"), dry_run=True)
+    """
+
+    def __init__(self, pinecone: Optional[PineconeClient] = None, rpm: Optional[int] = None):
+        self._pinecone = pinecone or PineconeClient()
+        self._bucket = TokenBucket(rpm or settings.reconcile_rpm)
+
+    def _throttle(self):
+        wait = self._bucket.wait_time(1)
+        if wait > 0:
+            time.sleep(wait)
+        self._bucket.consume(1)
+
+    def _list_ids(self, prefix: str, project_id: Optional[str] = None, namespace: Optional[str] = None) -> list[str]:
+        ids: list[str] = []
+        pages = self._pinecone.iter_id_pages(prefix, project_id=project_id, namespace=namespace)
+        while True:
+            self._throttle()
+            page = next(pages, None)
+            if page is None:
+                return ids
+            ids.extend(page)
+
+    # ── Scan ────────────────────────────────────────────────────────────
+
+    def scan_project(self, project_dir: Path, doc: Optional[str] = None) -> ReconcileReport:
+        """
+        Reporte de huérfanos de un proyecto (no borra nada).
+        `doc`: limita a un documento (filename o doc_id).
+        """
+        project_dir = Path(project_dir)
+        project_id = _load_project_meta(project_dir)["project_id"]
+        report = ReconcileReport(project_id=project_id, dry_run=True)
+
+        present = {p.name for p in _find_pdfs(project_dir)} if project_dir.exists() else set()
+        # _find_pdfs drops placeholders; those still exist and must never count as removed
+        on_disk = _pdf_names_on_disk(project_dir) if project_dir.exists() else set()
+        state_files = ExtractionLogger(project_id).get_state().get("files", {})
+
+        # doc_id → filename for every document the project knows about
+        known: dict[str, str] = {_doc_id(fn): fn for fn in set(state_files) | present}
+        manifests = {m.doc_id: m for m in iter_manifests(project_id)}
+        known.update({doc_id: m.filename for doc_id, m in manifests.items()})
+
+        if doc:
+            known = {d: fn for d, fn in known.items() if doc in (d, fn)}
+            if not known:
+                logger.warning(f"{project_id}: documento no encontrado: {doc}")
+
+        for n, (doc_id, filename) in enumerate(sorted(known.items(), key=lambda kv: kv[1]), 1):
+            indexed = self._list_ids(_doc_prefix(doc_id), project_id=project_id)
+            manifest = manifests.get(doc_id)
+
+            if filename not in on_disk:
+                entry = DocReconcile(doc_id, filename, "removed", len(indexed), 0, sorted(indexed))
+            elif filename not in present:
+                expected = len(manifest.chunk_ids) if manifest else 0
+                entry = DocReconcile(doc_id, filename, "not_local", len(indexed), expected)
+            elif manifest is None:
+                entry = DocReconcile(doc_id, filename, "no_manifest", len(indexed), 0)
+            else:
+                expected = manifest.chunk_ids
+                orphans = sorted(i for i in indexed if i not in expected)
+                entry = DocReconcile(
+                    doc_id, filename, "orphans" if orphans else "ok", len(indexed), len(expected), orphans,
+                )
+
+            report.docs.append(entry)
+            logger.info(
+                f"[{n}/{len(known)}] {filename}: {entry.indexed} en índice, "
+                f"{entry.expected} esperados, {len(entry.orphans)} huérfanos ({entry.status})"
+            )
+
+        return report
+
+    def scan_unknown(self, known_doc_ids: set[str]) -> tuple[dict[tuple[str, str], list[str]], int]:
+        """
+        Recorre el índice completo (todos los namespaces) buscando documentos
+        que ningún proyecto conoce. Retorna ({(namespace, doc_id): ids}, cantidad
+        de IDs con formato ajeno al pipeline). Los IDs ajenos (p.ej. los del
+        upload FAISS) se informan pero nunca se borran.
+        """
+        unknown: dict[tuple[str, str], list[str]] = {}
+        foreign = 0
+        n = 0
+        for namespace in self._pinecone.namespaces(refresh=True) or [""]:
+            for vector_id in self._list_ids("", namespace=namespace):
+                n += 1
+                match = _PIPELINE_ID_RE.match(vector_id)
+                if not match:
+                    foreign += 1
+                elif match.group(1) not in known_doc_ids:
+                    unknown.setdefault((namespace, match.group(1)), []).append(vector_id)
+                if n % 10_000 == 0:
+                    logger.info(f"  {n} IDs revisados...")
+        return unknown, foreign
+
+    # ── Apply ───────────────────────────────────────────────────────────
+
+    def delete(self, ids: list[str], project_id: Optional[str] = None, label: str = "") -> int:
+        """Borra IDs en lotes de settings.pinecone_delete_batch, con limitador y progreso."""
+        deleted = 0
+        batch_size = settings.pinecone_delete_batch
+        for i in range(0, len(ids), batch_size):
+            self._throttle()
+            deleted += self._pinecone.delete_ids(ids[i: i + batch_size], project_id=project_id)
+            logger.info(f"  {label}: {deleted}/{len(ids)} eliminados")
+        return deleted
+
+    def apply(self, report: ReconcileReport) -> int:
+        """Borra los huérfanos del reporte y limpia manifiesto/state de los PDFs eliminados."""
+        ext_logger = ExtractionLogger(report.project_id)
+        for entry in report.docs:
+            deleted = (
+                self.delete(entry.orphans, project_id=report.project_id, label=entry.filename)
+                if entry.orphans else 0
+            )
+            report.deleted += deleted
+            if entry.status == "removed" and deleted == len(entry.orphans):
+                DocumentManifest(report.project_id, entry.doc_id).delete()
+                ext_logger.forget_file(entry.filename)
+        report.dry_run = False
+        return report.deleted
+
+    def run(self, project_dir: Path, doc: Optional[str] = None, dry_run: bool = True) -> ReconcileReport:
+        """Scan + (si no es dry-run) borrado. Guarda el reporte del proyecto."""
+        report = self.scan_project(project_dir, doc=doc)
+        if not dry_run and report.orphan_count:
+            self.apply(report)
+        _save_report(report)
+        return report
+
+
+def _pdf_names_on_disk(project_dir: Path) -> set[str]:
+    """
+    Nombres de todos los PDFs de la carpeta, sin filtro de tamaño, incluidos
+    los que iCloud dejó solo como placeholder (.{nombre}.icloud).
+    """
+    names: set[str] = set()
+    for p in project_dir.rglob("*"):
+        name = p.name
+        if name.startswith(".") and name.endswith(".icloud"):
+            name = name[1:-len(".icloud")]
+        if name.lower().endswith(".pdf"):
+            names.add(name)
+    return names
+
+
+def _save_report(report: ReconcileReport):
+    path = settings.processed_dir / report.project_id / "reconcile_report.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report.to_dict(), ensure_ascii=False, indent=2), encoding="utf-8")
@@ -0,0 +1,240 @@
+"""
+etl/page_dedup.py — Detección de páginas casi duplicadas entre PDFs de un proyecto.
+
+El mismo anexo suele venir como PDF suelto y otra vez dentro de una Adenda o ICE
+consolidado. Cada página limpia recibe una firma SimHash de 64 bits; si una
+página nueva está a ≤ `page_dedup_max_hamming` bits de una ya indexada, no se
+vuelve a embeber y queda registrada como alias de la original.
+
+Firmas por proyecto en: data/processed/{project_id}/page_signatures.json
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Optional
+
+from loguru import logger
+
+from pia_rag.config import settings
+
+_BANDS = 4          # 4 bandas de 16 bits: distancia ≤ 3 garantiza ≥ 1 banda idéntica
+_BAND_BITS = 64 // _BANDS
+_SHINGLE = 3        # palabras por shingle
+
+
+# ─── SimHash ────────────────────────────────────────────────────────────────
+
+def _tokens(text: str) -> list[str]:
+    """Minúsculas, sin tildes, solo palabras alfanuméricas."""
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    return re.findall(r"[a-z0-9]+", text)
+
+
+def simhash(text: str) -> int:
+    """Firma SimHash de 64 bits sobre shingles de 3 palabras."""
+    words = _tokens(text)
+    shingles = [
+        " ".join(words[i:i + _SHINGLE])
+        for i in range(max(1, len(words) - _SHINGLE + 1))
+    ]
+    weights = [0] * 64
+    for sh in shingles:
+        h = int.from_bytes(hashlib.blake2b(sh.encode(), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def _hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _bands(sig: int) -> list[tuple[int, int]]:
+    mask = (1 << _BAND_BITS) - 1
+    return [(band, sig >> (band * _BAND_BITS) & mask) for band in range(_BANDS)]
+
+
+class _SimHashBuckets:
+    """Índice LSH por bandas: candidatos = firmas que comparten alguna banda exacta."""
+
+    def __init__(self):
+        self._buckets: dict[tuple[int, int], list[tuple[str, int, int]]] = defaultdict(list)
+
+    def add(self, filename: str, page: int, sig: int):
+        for key in _bands(sig):
+            self._buckets[key].append((filename, page, sig))
+
+    def find(self, sig: int, exclude_filename: str = "") -> Optional[tuple[str, int]]:
+        best: Optional[tuple[int, str, int]] = None
+        for key in _bands(sig):
+            for filename, page, other in self._buckets.get(key, ()):
+                if filename == exclude_filename:
+                    continue
+                dist = _hamming(sig, other)
+                if dist <= settings.page_dedup_max_hamming and (best is None or dist < best[0]):
+                    best = (dist, filename, page)
+        return (best[1], best[2]) if best else None
+
+
+# ─── Sesión por documento ───────────────────────────────────────────────────
+
+class DocumentDedup:
+    """
+    Estado de deduplicación de un PDF en proceso. El chunker llama a
+    `is_duplicate()` por página; las firmas pasan al índice del proyecto con
+    `PageSignatureIndex.commit()`: en memoria apenas el PDF queda en cola de
+    embeddings (para que los siguientes PDFs lo vean) y en disco cuando quedó
+    indexado.
+    """
+
+    def __init__(self, index: "PageSignatureIndex", filename: str):
+        self.filename = filename
+        self.signatures: dict[int, int] = {}
+        self.aliases: dict[int, tuple[str, int]] = {}
+        self.pages_checked = 0
+        self._index = index
+        self._local = _SimHashBuckets()
+
+    @property
+    def pages_duplicate(self) -> int:
+        return len(self.aliases)
+
+    def is_duplicate(self, page_num: int, text: str) -> bool:
+        """True si la página es casi idéntica a una ya indexada (u otra de este PDF)."""
+        if len(text) < settings.page_dedup_min_chars:
+            return False
+
+        self.pages_checked += 1
+        sig = simhash(text)
+        original = (
+            self._index.find(sig, exclude_filename=self.filename)
+            or self._local.find(sig)
+        )
+        if original:
+            self.aliases[page_num] = original
+            return True
+
+        self.signatures[page_num] = sig
+        self._local.add(self.filename, page_num, sig)
+        return False
+
+
+# ─── Índice por proyecto ────────────────────────────────────────────────────
+
+class PageSignatureIndex:
+    """
+    Firmas SimHash de todas las páginas indexadas de un proyecto.
+
+    Uso:
+        index = PageSignatureIndex("hyc")
+        dedup = index.begin("Anexo 5.pdf")
+        chunks = chunker.chunk(structure, meta, dedup=dedup)
+        index.commit(dedup, save=False)        # visible para los PDFs siguientes
+        ...upsert OK...   → index.confirm("Anexo 5.pdf")
+        ...falla...       → index.rollback("Anexo 5.pdf")
+    """
+
+    def __init__(self, project_id: str):
+        self.project_id = project_id
+        self._file = settings.processed_dir / project_id / "page_signatures.json"
+        self._data = self._load()
+        self._buckets = self._build_buckets()
+        # filename → (pages, aliases) before a commit(save=False) not yet confirmed
+        self._provisional: dict[str, tuple[Optional[dict], Optional[dict]]] = {}
+
+    def _load(self) -> dict:
+        if self._file.exists():
+            try:
+                return json.loads(self._file.read_text(encoding="utf-8"))
+            except Exception:
+                pass
+        return {"project_id": self.project_id, "pages": {}, "aliases": {}}
+
+    def _build_buckets(self) -> _SimHashBuckets:
+        buckets = _SimHashBuckets()
+        for filename, pages in self._data["pages"].items():
+            for page, sig in pages.items():
+                buckets.add(filename, int(page), int(sig, 16))
+        return buckets
+
+    def find(self, sig: int, exclude_filename: str = "") -> Optional[tuple[str, int]]:
+        return self._buckets.find(sig, exclude_filename=exclude_filename)
+
+    def begin(self, filename: str) -> DocumentDedup:
+        return DocumentDedup(self, filename)
+
+    def commit(self, dedup: DocumentDedup, save: bool = True):
+        """
+        Registra las firmas y alias de un PDF ya indexado y persiste el índice.
+        Con save=False solo queda en memoria (p.ej. PDFs en cola de embeddings o
+        preparados para Batch API) hasta `confirm`; `rollback` lo deshace.
+        """
+        previous = (
+            self._data["pages"].pop(dedup.filename, None),
+            self._data["aliases"].pop(dedup.filename, None),
+        )
+        if not save:
+            self._provisional.setdefault(dedup.filename, previous)
+        if previous[0]:
+            # Reproceso: descartar las firmas antiguas del archivo
+            self._buckets = self._build_buckets()
+
+        self._data["pages"][dedup.filename] = {
+            str(page): f"{sig:016x}" for page, sig in dedup.signatures.items()
+        }
+        self._data["aliases"][dedup.filename] = {
+            str(page): f"{orig_file}#{orig_page}"
+            for page, (orig_file, orig_page) in dedup.aliases.items()
+        }
+        for page, sig in dedup.signatures.items():
+            self._buckets.add(dedup.filename, page, sig)
+        if save:
+            self._save()
+
+    def confirm(self, filename: str):
+        """El PDF de un commit(save=False) quedó indexado: persistir sus firmas."""
+        self._provisional.pop(filename, None)
+        self._save()
+
+    def rollback(self, filename: str):
+        """El PDF de un commit(save=False) no se indexó: volver a las firmas anteriores."""
+        if filename not in self._provisional:
+            return
+        pages, aliases = self._provisional.pop(filename)
+        self._data["pages"].pop(filename, None)
+        self._data["aliases"].pop(filename, None)
+        if pages is not None:
+            self._data["pages"][filename] = pages
+        if aliases is not None:
+            self._data["aliases"][filename] = aliases
+        self._buckets = self._build_buckets()
+
+        # Pages of later PDFs that were skipped as copies of this one are not indexed anywhere
+        dependents = sorted(
+            other for other, aliases in self._data["aliases"].items()
+            if any(target.startswith(f"{filename}#") for target in aliases.values())
+        )
+        if dependents:
+            logger.warning(
+                f"{filename} no se indexó y {', '.join(dependents)} tiene(n) páginas marcadas como "
+                f"duplicadas de él: reprocesar esos PDFs después de indexar {filename}"
+            )
+
+    def _save(self):
+        # Files still waiting to be indexed are written with their previous state
+        data = {**self._data, "pages": dict(self._data["pages"]), "aliases": dict(self._data["aliases"])}
+        for filename, (pages, aliases) in self._provisional.items():
+            for key, value in (("pages", pages), ("aliases", aliases)):
+                data[key].pop(filename, None)
+                if value is not None:
+                    data[key][filename] = value
+        self._file.parent.mkdir(parents=True, exist_ok=True)
+        self._file.write_text(
+            json.dumps(data, ensure_ascii=False, indent=2),
+            encoding="utf-8",
+        )
@@ -0,0 +1,158 @@
+"""
+rag/answer_cache.py — Cache de respuestas de /ask.
+
+Los equipos repiten las mismas preguntas por proyecto ("principales impactos",
+"medidas de mitigación para flora") y cada vez se pagaba una generación
+completa con GPT-4o. La clave es:
+
+  pregunta normalizada + filtros + IDs de los chunks recuperados (ordenados)
+  + modelo de chat
+
+así que si la evidencia cambia (re-ingesta, otros chunks en el top-k) la
+clave cambia sola. Además cada entrada guarda la versión de los proyectos
+involucrados: si un proyecto se re-procesa o se le actualiza la metadata
+(update-metadata conserva los IDs), sus respuestas se invalidan. La versión
+es el `last_updated` del marcador del proyecto en Pinecone
+(PineconeClient.project_versions), que ve también el host de la API, donde
+no existe el state.json de la ingesta; se relee cada
+settings.answer_cache_version_check_s segundos, así que una respuesta puede
+seguir sirviéndose ese tiempo tras la actualización. Donde sí existe el
+state.json su `last_updated` también cuenta. Expiran a los
+settings.answer_cache_ttl_s segundos. En memoria del proceso (LRU).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from loguru import logger
+
+from pia_rag.config import settings
+from pia_rag.storage.lexical_index import normalize
+
+
+def _normalize_question(question: str) -> str:
+    text = normalize(question)
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(question: str, filters: dict, chunk_ids: list[str]) -> str:
+    payload = json.dumps(
+        {
+            "q": _normalize_question(question),
+            "filters": {k: v for k, v in sorted(filters.items()) if v},
+            "chunks": sorted(chunk_ids),
+            "model": settings.openai_chat_model,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    LRU con TTL, invalidado por el `last_updated` de cada proyecto.
+
+    Uso:
+        cache = AnswerCache(versions=pinecone.project_versions)
+        key = cache_key(question, filters, [r["chunk_id"] for r in results])
+        hit = cache.get(key)
+        ...
+        cache.put(key, {"answer": ...}, project_ids)
+    """
+
+    def __init__(
+        self,
+        ttl_s: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        versions: Optional[Callable[[list[str]], dict[str, str]]] = None,
+    ):
+        self._ttl = ttl_s if ttl_s is not None else settings.answer_cache_ttl_s
+        self._max = max_entries or settings.answer_cache_max_entries
+        self._remote_versions = versions
+        self._check_s = settings.answer_cache_version_check_s
+        self._lock = threading.Lock()
+        # key → (stored_at, {project_id: version}, value)
+        self._entries: OrderedDict[str, tuple[float, dict[str, str], dict]] = OrderedDict()
+        # project_id → (state.json mtime, last_updated): state.json is read only when it changes
+        self._local: dict[str, tuple[float, str]] = {}
+        # project_id → (checked_at, last_updated del marcador en Pinecone)
+        self._remote: dict[str, tuple[float, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _local_version(self, project_id: str) -> str:
+        path = settings.processed_dir / project_id / "state.json"
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return ""
+        cached = self._local.get(project_id)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            version = json.loads(path.read_text(encoding="utf-8")).get("last_updated", "")
+        except Exception:
+            version = ""
+        self._local[project_id] = (mtime, version)
+        return version
+
+    def _versions(self, project_ids: list[str]) -> dict[str, str]:
+        """Versión actual de cada proyecto. Se llama sin el lock: puede ir a la red."""
+        now = time.time()
+        if self._remote_versions is not None:
+            stale = [pid for pid in project_ids
+                     if pid not in self._remote or now - self._remote[pid][0] >= self._check_s]
+            if stale:
+                try:
+                    fetched = self._remote_versions(stale)
+                    for pid in stale:
+                        self._remote[pid] = (now, fetched.get(pid, ""))
+                except Exception as e:
+                    # Keep the last known version; the next lookup retries
+                    logger.warning(f"No se pudo leer la versión de {stale}: {e}")
+        return {
+            pid: f"{self._remote.get(pid, (0.0, ''))[1]}|{self._local_version(pid)}"
+            for pid in project_ids
+        }
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, versions, value = entry
+            fresh = time.time() - stored_at < self._ttl
+            if fresh and self._versions(list(versions)) == versions:
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                return {**value, "cached_at": stored_at}
+        with self._lock:
+            if entry is not None and self._entries.get(key) is entry:
+                del self._entries[key]
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: dict, project_ids: set[str]):
+        versions = self._versions(sorted(pid for pid in project_ids if pid))
+        with self._lock:
+            self._entries[key] = (time.time(), versions, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,164 @@
+"""
+rag/context_packer.py — Arma el contexto de /ask dentro de un presupuesto de tokens.
+
+Antes se concatenaba el texto completo de cada resultado: con top_k=20 eran
+~25k tokens hacia GPT-4o. Ahora:
+
+  1. Agrupa los resultados por documento y fusiona los chunks de páginas
+     iguales o contiguas en un solo tramo, quitando el solapamiento del
+     splitter (chunk_overlap) entre uno y otro
+  2. Cuenta tokens con tiktoken (tokenizer del modelo de chat)
+  3. Llena settings.context_token_budget en orden de score; un tramo que no
+     cabe se recorta si queda espacio suficiente, si no se omite
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from pia_rag.config import settings
+
+_SEPARATOR = "\n\n---\n\n"
+_MIN_OVERLAP = 20      # chars; below this a suffix/prefix match is coincidence
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(settings.openai_chat_model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str) -> int:
+    """Tokens del texto según el tokenizer del modelo de chat."""
+    return len(_encoding().encode(text, disallowed_special=()))
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    tokens = _encoding().encode(text, disallowed_special=())
+    return text if len(tokens) <= max_tokens else _encoding().decode(tokens[:max_tokens]) + "…"
+
+
+def _overlap(a: str, b: str) -> int:
+    """Largo del sufijo de `a` que es prefijo de `b` (el solapamiento del splitter)."""
+    for n in range(min(len(a), len(b), settings.chunk_overlap * 2), _MIN_OVERLAP - 1, -1):
+        if a.endswith(b[:n]):
+            return n
+    return 0
+
+
+@dataclass
+class _Span:
+    """Tramo contiguo de un documento (uno o más chunks fusionados)."""
+    text: str
+    score: float
+    page_start: int
+    page_end: int
+    best: dict                       # resultado con mejor score (títulos para la cita)
+    chunks: int = 1
+
+    def merge(self, result: dict):
+        text = result.get("text", "")
+        if text in self.text:
+            pass
+        elif self.text in text:
+            self.text = text
+        else:
+            forward, backward = _overlap(self.text, text), _overlap(text, self.text)
+            if backward > forward:
+                self.text = text[: len(text) - backward] + self.text
+            else:
+                self.text = self.text + ("" if forward else "\n") + text[forward:]
+        self.page_start = min(self.page_start, result.get("page_start", 0))
+        self.page_end = max(self.page_end, result.get("page_end", 0))
+        if result.get("score", 0.0) > self.score:
+            self.score = result["score"]
+            self.best = result
+        self.chunks += 1
+
+    def render(self, text: str) -> str:
+        r = self.best
+        source = f"({r.get('project_name', '')} — {r.get('chapter_title', '')}"
+        if r.get("section_title"):
+            source += f", {r['section_title']}"
+        source += f", pág. {self.page_start}-{self.page_end})"
+        return f"{text}\n{source}"
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens: int
+    spans: int                       # tramos incluidos
+    chunks: int                      # chunks cubiertos por esos tramos
+    dropped: int                     # chunks que no cupieron
+    truncated: bool = False
+
+
+def _spans(results: list[dict]) -> list[_Span]:
+    """Fusiona resultados del mismo documento en páginas iguales o contiguas."""
+    by_doc: dict[tuple, list[dict]] = {}
+    for r in results:
+        by_doc.setdefault((r.get("project_id"), r.get("filename")), []).append(r)
+
+    spans: list[_Span] = []
+    for (_, filename), group in by_doc.items():
+        if not filename:
+            # Without a document there is nothing to be adjacent to
+            spans += [_Span(r.get("text", ""), r.get("score", 0.0), r.get("page_start", 0),
+                            r.get("page_end", 0), r) for r in group]
+            continue
+        group.sort(key=lambda r: (r.get("page_start", 0), r.get("page_end", 0)))
+        current = None
+        for r in group:
+            if current is not None and r.get("page_start", 0) <= current.page_end + 1:
+                current.merge(r)
+                continue
+            current = _Span(r.get("text", ""), r.get("score", 0.0), r.get("page_start", 0),
+                            r.get("page_end", 0), r)
+            spans.append(current)
+    spans.sort(key=lambda s: s.score, reverse=True)
+    return spans
+
+
+def pack_context(results: list[dict], budget: Optional[int] = None) -> PackedContext:
+    """Contexto para el prompt, en orden de score, sin pasar de `budget` tokens."""
+    budget = budget or settings.context_token_budget
+    separator_tokens = count_tokens(_SEPARATOR)
+    parts: list[str] = []
+    used = chunks = dropped = 0
+    truncated = False
+
+    for span in _spans(results):
+        cost = count_tokens(span.render(span.text)) + (separator_tokens if parts else 0)
+        remaining = budget - used
+        if cost <= remaining:
+            parts.append(span.render(span.text))
+        elif remaining >= settings.context_min_span_tokens:
+            source_tokens = count_tokens(span.render("…"))
+            room = remaining - source_tokens - (separator_tokens if parts else 0) - 2   # "…" may re-tokenize
+            if room < settings.context_min_span_tokens // 2:
+                dropped += span.chunks
+                continue
+            parts.append(span.render(_truncate(span.text, room)))
+            cost = count_tokens(parts[-1]) + (separator_tokens if len(parts) > 1 else 0)
+            truncated = True
+        else:
+            dropped += span.chunks
+            continue
+        used += cost
+        chunks += span.chunks
+
+    return PackedContext(
+        text=_SEPARATOR.join(parts),
+        tokens=used,
+        spans=len(parts),
+        chunks=chunks,
+        dropped=dropped,
+        truncated=truncated,
+    )
@@ -1,16 +1,33 @@
 """
 rag/enriched_engine.py — Motor RAG con filtros jerárquicos y generación con GPT-4o.
+
+El contexto se arma con rag/context_packer.py (tramos fusionados, dentro de
+settings.context_token_budget) y la respuesta informa los tokens usados.
+`stream` entrega lo mismo por eventos (fuentes primero, luego la respuesta
+token a token) para /ask/stream. Las respuestas se cachean por pregunta +
+filtros + chunks recuperados (rag/answer_cache.py); `cached` lo indica.
+Consultas idénticas simultáneas comparten una sola ejecución (single-flight).
+
+`compare` responde preguntas comparativas entre proyectos por map-reduce:
+búsqueda en todos los proyectos a la vez, un resumen por proyecto en paralelo
+(con su propio presupuesto de contexto) y una síntesis corta al final. El
+tiempo total lo marca el proyecto más lento, no la suma.
 """
 
 from __future__ import annotations
 
-from typing import Optional
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, Optional
 
 from openai import OpenAI
 from loguru import logger
 
 from pia_rag.config import settings
+from pia_rag.rag.answer_cache import AnswerCache, cache_key
+from pia_rag.rag.context_packer import pack_context
 from pia_rag.storage.pinecone_client import PineconeClient
+from pia_rag.storage.single_flight import SingleFlight
 
 
 SYSTEM_PROMPT = """Eres PIA, asistente experto en evaluación ambiental de proyectos chilenos.
@@ -25,6 +42,20 @@ REGLAS:
 - Cita siempre la fuente con formato: (Proyecto X — Cap. Y, Secc. Z, pág. N-M)
 """
 
+MAP_PROMPT = """Eres PIA, asistente experto en evaluación ambiental de proyectos chilenos.
+Recibirás fragmentos de los documentos de UN proyecto y una pregunta comparativa
+que involucra a varios proyectos. Resume solo lo que los fragmentos dicen de este
+proyecto respecto de la pregunta, en bullet points breves, con la cita
+(Proyecto X — Cap. Y, Secc. Z, pág. N-M). Si los fragmentos no tratan el tema,
+dilo en una línea — no inventes datos.
+"""
+
+REDUCE_PROMPT = SYSTEM_PROMPT + """- Recibirás un resumen por proyecto: compáralos punto por punto (similitudes,
+  diferencias, vacíos de información), conservando las citas de cada resumen
+"""
+
+NO_RESULTS = "Sin información en los documentos recuperados."
+
 
 class EnrichedRAGEngine:
     """Motor RAG que busca en Pinecone y genera respuestas con GPT-4o."""
@@ -32,6 +63,10 @@ class EnrichedRAGEngine:
     def __init__(self):
         self._pinecone = PineconeClient()
         self._openai = OpenAI(api_key=settings.openai_api_key)
+        self._cache = (
+            AnswerCache(versions=self._pinecone.project_versions) if settings.answer_cache_enabled else None
+        )
+        self.flight = SingleFlight()
 
     def query(
         self,
@@ -42,6 +77,7 @@ class EnrichedRAGEngine:
         doc_type: Optional[str] = None,
         top_k: int = 8,
         generate: bool = True,
+        diversify: Optional[bool] = None,
     ) -> dict:
         """
         Ejecuta una consulta RAG completa.
@@ -54,11 +90,272 @@ class EnrichedRAGEngine:
             doc_type: Filtrar por tipo de documento
             top_k: Número de resultados
             generate: Si True, genera respuesta con GPT-4o
+            diversify: Colapso por página + MMR (default settings.search_diversify)
 
         Returns:
-            dict con results, answer, filters_applied
+            dict con results, answer, filters_applied, context (tokens/tramos
+            del contexto), usage (prompt_tokens / completion_tokens; None si
+            vino del cache) y cached
+        """
+        args = (question, project_id, chunk_level, chapter_title, doc_type, top_k, generate, diversify)
+        if not settings.single_flight_enabled:
+            return self._query(*args)
+        return self.flight.do(args, lambda: self._query(*args))
+
+    def _query(
+        self,
+        question: str,
+        project_id: Optional[str],
+        chunk_level: Optional[str],
+        chapter_title: Optional[str],
+        doc_type: Optional[str],
+        top_k: int,
+        generate: bool,
+        diversify: Optional[bool],
+    ) -> dict:
+        response, context_text = self._retrieve(
+            question, project_id, chunk_level, chapter_title, doc_type, top_k, diversify, generate,
+        )
+        if context_text is None:
+            return response
+
+        key = self._cache_key(question, response)
+        hit = self._cache.get(key) if self._cache is not None else None
+        if hit is not None:
+            response.update(answer=hit["answer"], cached=True, cached_at=hit["cached_at"])
+            return response
+
+        # Generate answer
+        try:
+            completion = self._openai.chat.completions.create(
+                model=settings.openai_chat_model,
+                messages=_messages(question, context_text),
+                temperature=0.2,
+            )
+            response["answer"] = completion.choices[0].message.content
+            response["usage"] = _usage(getattr(completion, "usage", None))
+            self._cache_put(key, response["answer"], response["results"])
+        except Exception as e:
+            logger.error(f"Error generando respuesta: {e}")
+            response["answer"] = f"Error al generar respuesta: {e}"
+
+        return response
+
+    def stream(
+        self,
+        question: str,
+        project_id: Optional[str] = None,
+        chunk_level: Optional[str] = None,
+        chapter_title: Optional[str] = None,
+        doc_type: Optional[str] = None,
+        top_k: int = 8,
+        diversify: Optional[bool] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> Iterator[tuple[str, dict]]:
+        """
+        Igual que query, pero por eventos: ("sources", resultados + filtros +
+        contexto) apenas termina la búsqueda, luego ("token", {"text"}) por
+        cada fragmento de la respuesta y ("done", {"usage"}) al final
+        (("error", {"detail"}) si la generación falla).
+
+        Si `cancel` se activa (el cliente se desconectó) se cierra el stream
+        de OpenAI, que deja de generar (y de cobrar) tokens.
+        """
+        response, context_text = self._retrieve(
+            question, project_id, chunk_level, chapter_title, doc_type, top_k, diversify, True,
+        )
+        key = self._cache_key(question, response) if context_text is not None else None
+        hit = self._cache.get(key) if self._cache is not None and key else None
+        response["cached"] = hit is not None
+        yield "sources", {k: v for k, v in response.items() if k not in ("answer", "usage")}
+        if context_text is None:
+            yield "done", {"usage": None, "cached": False}
+            return
+        if hit is not None:
+            yield "token", {"text": hit["answer"]}
+            yield "done", {"usage": None, "cached": True}
+            return
+
+        completion = None
+        usage = None
+        parts: list[str] = []
+        try:
+            completion = self._openai.chat.completions.create(
+                model=settings.openai_chat_model,
+                messages=_messages(question, context_text),
+                temperature=0.2,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            for chunk in completion:
+                if cancel is not None and cancel.is_set():
+                    logger.info("Stream cancelado por el cliente")
+                    return
+                if getattr(chunk, "usage", None) is not None:
+                    usage = _usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield "token", {"text": chunk.choices[0].delta.content}
+        except Exception as e:
+            logger.error(f"Error generando respuesta (stream): {e}")
+            yield "error", {"detail": f"Error al generar respuesta: {e}"}
+            return
+        finally:
+            if completion is not None:
+                completion.close()
+        self._cache_put(key, "".join(parts), response["results"])
+        yield "done", {"usage": usage, "cached": False}
+
+    def compare(
+        self,
+        question: str,
+        project_ids: list[str],
+        chunk_level: Optional[str] = None,
+        chapter_title: Optional[str] = None,
+        doc_type: Optional[str] = None,
+        top_k: int = 8,
+        diversify: Optional[bool] = None,
+        cancel: Optional[threading.Event] = None,
+    ) -> Iterator[tuple[str, dict]]:
         """
-        # Search
+        Pregunta comparativa entre proyectos, por eventos:
+
+          ("sources", resultados y contexto por proyecto) tras la búsqueda
+          ("partial", {"project_id", "summary"}) a medida que termina cada resumen
+          ("token", {"text"}) por fragmento de la síntesis final
+          ("done", {"usage"}) con los tokens sumados de todas las llamadas
+          ("error", {"detail"}) si falla la síntesis
+
+        top_k es por proyecto. Cada resumen usa a lo sumo
+        compare_project_token_budget tokens de contexto y
+        compare_summary_max_tokens de salida.
+        """
+        grouped = self._pinecone.search_multi(
+            query=question,
+            project_ids=project_ids,
+            top_k=top_k,
+            chunk_level=chunk_level,
+            chapter_title=chapter_title,
+            doc_type=doc_type,
+            diversify=diversify,
+        )
+        packed = {pid: pack_context(results, settings.compare_project_token_budget)
+                  for pid, results in grouped.items() if results}
+        yield "sources", {
+            "projects": [
+                {
+                    "project_id": pid,
+                    "results": results,
+                    "total_found": len(results),
+                    "context": {"tokens": packed[pid].tokens, "chunks": packed[pid].chunks} if pid in packed else None,
+                }
+                for pid, results in grouped.items()
+            ],
+        }
+
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+        def _add_usage(u: Optional[dict]):
+            for k in usage:
+                usage[k] += (u or {}).get(k, 0)
+
+        def _map(pid: str) -> tuple[str, Optional[dict]]:
+            completion = self._openai.chat.completions.create(
+                model=settings.openai_chat_model,
+                messages=[
+                    {"role": "system", "content": MAP_PROMPT},
+                    {"role": "user", "content": f"CONTEXTO ({pid}):\n{packed[pid].text}\n\nPREGUNTA: {question}"},
+                ],
+                temperature=0.2,
+                max_tokens=settings.compare_summary_max_tokens,
+            )
+            return completion.choices[0].message.content, _usage(getattr(completion, "usage", None))
+
+        # Map: one summary per project, in parallel; each is reported as soon as it is ready
+        summaries = {pid: NO_RESULTS for pid in grouped if pid not in packed}
+        for pid in summaries:
+            yield "partial", {"project_id": pid, "summary": NO_RESULTS}
+        if packed:
+            pool = ThreadPoolExecutor(max_workers=min(len(packed), settings.compare_workers))
+            try:
+                pending = {pool.submit(_map, pid): pid for pid in packed}
+                while pending:
+                    done, _ = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                    if cancel is not None and cancel.is_set():
+                        logger.info("Comparación cancelada por el cliente")
+                        return
+                    for future in done:
+                        pid = pending.pop(future)
+                        try:
+                            summaries[pid], map_usage = future.result()
+                            _add_usage(map_usage)
+                        except Exception as e:
+                            logger.error(f"Error resumiendo {pid}: {e}")
+                            summaries[pid] = f"No se pudo resumir este proyecto: {e}"
+                        yield "partial", {"project_id": pid, "summary": summaries[pid]}
+            finally:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+        # Reduce: short synthesis over the summaries (request order)
+        digest = "\n\n".join(f"### {pid}\n{summaries[pid]}" for pid in grouped)
+        completion = None
+        try:
+            completion = self._openai.chat.completions.create(
+                model=settings.openai_chat_model,
+                messages=[
+                    {"role": "system", "content": REDUCE_PROMPT},
+                    {"role": "user", "content": f"RESÚMENES POR PROYECTO:\n{digest}\n\nPREGUNTA: {question}"},
+                ],
+                temperature=0.2,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            for chunk in completion:
+                if cancel is not None and cancel.is_set():
+                    logger.info("Comparación cancelada por el cliente")
+                    return
+                if getattr(chunk, "usage", None) is not None:
+                    _add_usage(_usage(chunk.usage))
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield "token", {"text": chunk.choices[0].delta.content}
+        except Exception as e:
+            logger.error(f"Error en la síntesis de la comparación: {e}")
+            yield "error", {"detail": f"Error al generar la comparación: {e}"}
+            return
+        finally:
+            if completion is not None:
+                completion.close()
+        yield "done", {"usage": usage}
+
+    def stats(self) -> dict:
+        """Contadores para /metrics: single-flight de /ask, los de su búsqueda y el cache."""
+        data = {
+            "single_flight": self.flight.stats(),
+            "search": self._pinecone.stats(),
+        }
+        if self._cache is not None:
+            data["answer_cache"] = {"hits": self._cache.hits, "misses": self._cache.misses, "entries": len(self._cache)}
+        return data
+
+    def _cache_key(self, question: str, response: dict) -> str:
+        return cache_key(question, response["filters_applied"], [r["chunk_id"] for r in response["results"]])
+
+    def _cache_put(self, key: str, answer: str, results: list[dict]):
+        if self._cache is not None and answer:
+            self._cache.put(key, {"answer": answer}, {r.get("project_id", "") for r in results})
+
+    def _retrieve(
+        self,
+        question: str,
+        project_id: Optional[str],
+        chunk_level: Optional[str],
+        chapter_title: Optional[str],
+        doc_type: Optional[str],
+        top_k: int,
+        diversify: Optional[bool],
+        generate: bool,
+    ) -> tuple[dict, Optional[str]]:
+        """Búsqueda + contexto empaquetado. El texto es None si no hay nada que generar."""
         results = self._pinecone.search(
             query=question,
             top_k=top_k,
@@ -66,6 +363,7 @@ class EnrichedRAGEngine:
             chunk_level=chunk_level,
             chapter_title=chapter_title,
             doc_type=doc_type,
+            diversify=diversify,
         )
 
         filters_applied = {}
@@ -83,41 +381,44 @@ class EnrichedRAGEngine:
             "total_found": len(results),
             "filters_applied": filters_applied,
             "answer": None,
+            "context": None,
+            "usage": None,
+            "cached": False,
         }
 
         if not generate or not results:
-            return response
+            return response, None
 
-        # Build context
-        context_parts = []
-        for r in results:
-            source = f"({r['project_name']} — {r['chapter_title']}"
-            if r.get("section_title"):
-                source += f", {r['section_title']}"
-            source += f", pág. {r['page_start']}-{r['page_end']})"
-            context_parts.append(f"{r['text']}\n{source}")
+        # Build context (merged spans, within the token budget)
+        packed = pack_context(results)
+        response["context"] = {
+            "tokens": packed.tokens,
+            "spans": packed.spans,
+            "chunks": packed.chunks,
+            "dropped": packed.dropped,
+            "truncated": packed.truncated,
+        }
+        return response, packed.text
 
-        context_text = "\n\n---\n\n".join(context_parts)
 
-        # Generate answer
-        try:
-            completion = self._openai.chat.completions.create(
-                model=settings.openai_chat_model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {
-                        "role": "user",
-                        "content": (
-                            f"CONTEXTO RECUPERADO:\n{context_text}\n\n"
-                            f"PREGUNTA: {question}"
-                        ),
-                    },
-                ],
-                temperature=0.2,
-            )
-            response["answer"] = completion.choices[0].message.content
-        except Exception as e:
-            logger.error(f"Error generando respuesta: {e}")
-            response["answer"] = f"Error al generar respuesta: {e}"
+def _messages(question: str, context_text: str) -> list[dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": (
+                f"CONTEXTO RECUPERADO:\n{context_text}\n\n"
+                f"PREGUNTA: {question}"
+            ),
+        },
+    ]
 
-        return response
+
+def _usage(usage) -> Optional[dict]:
+    if usage is None:
+        return None
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+    }
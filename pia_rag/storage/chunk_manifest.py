@@ -0,0 +1,165 @@
+"""
+storage/chunk_manifest.py — Manifiesto de chunk IDs por documento.
+
+Guarda, por PDF, qué vectores hay en el índice y con qué contenido:
+  data/processed/{project_id}/manifests/{doc_id}.json
+
+Al reprocesar un PDF se compara contra el manifiesto:
+  - ID nuevo o embed_text distinto → embed + upsert
+  - mismo embed_text, metadata distinta → update de metadata (sin embedding)
+  - ID que ya no existe → delete
+  - resto → no se toca
+
+Los registros completos de cada chunk quedan guardados, así la metadata se puede
+recalcular sin volver a parsear el PDF.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from pia_rag.config import settings
+from pia_rag.etl.enriched_chunker import EnrichedChunk
+
+# chunk_idx es solo el orden de lectura: si cambia no justifica un update
+_VOLATILE_FIELDS = {"chunk_idx"}
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def embed_hash(chunk: EnrichedChunk) -> str:
+    return _hash(chunk.embed_text)
+
+
+def metadata_hash(metadata: dict) -> str:
+    stable = {k: v for k, v in metadata.items() if k not in _VOLATILE_FIELDS}
+    return _hash(json.dumps(stable, sort_keys=True, ensure_ascii=False))
+
+
+@dataclass
+class ChunkDiff:
+    """Cambios necesarios para llevar el índice al nuevo set de chunks."""
+    to_embed: list[EnrichedChunk] = field(default_factory=list)
+    to_update: list[EnrichedChunk] = field(default_factory=list)
+    to_delete: list[str] = field(default_factory=list)
+    unchanged: int = 0
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.to_embed)} nuevos/cambiados, {len(self.to_update)} solo metadata, "
+            f"{len(self.to_delete)} eliminados, {self.unchanged} sin cambios"
+        )
+
+
+class DocumentManifest:
+    """
+    Manifiesto de un documento.
+
+    Uso:
+        manifest = DocumentManifest("hyc", structure.doc_id)
+        diff = manifest.diff(chunks)
+        ...embed/upsert diff.to_embed, update diff.to_update, delete diff.to_delete...
+        manifest.replace(chunks, filename)
+    """
+
+    def __init__(self, project_id: str, doc_id: str):
+        self.project_id = project_id
+        self.doc_id = doc_id
+        self._file = manifest_dir(project_id) / f"{doc_id}.json"
+        self._data = self._load()
+
+    @property
+    def exists(self) -> bool:
+        return self._file.exists()
+
+    @property
+    def filename(self) -> str:
+        return self._data.get("filename", "")
+
+    @property
+    def chunk_ids(self) -> set[str]:
+        return set(self._data["chunks"])
+
+    def _load(self) -> dict:
+        if self._file.exists():
+            try:
+                return json.loads(self._file.read_text(encoding="utf-8"))
+            except Exception:
+                pass
+        return {"doc_id": self.doc_id, "filename": "", "updated_at": "", "chunks": {}}
+
+    def records(self) -> list[EnrichedChunk]:
+        """Chunks tal como quedaron indexados la última vez."""
+        return [EnrichedChunk(**entry["record"]) for entry in self._data["chunks"].values()]
+
+    def entry(self, chunk_id: str) -> Optional[dict]:
+        return self._data["chunks"].get(chunk_id)
+
+    def diff(self, chunks: list[EnrichedChunk]) -> ChunkDiff:
+        """Compara los chunks nuevos contra lo indexado."""
+        result = ChunkDiff()
+        old = self._data["chunks"]
+        for chunk in chunks:
+            prev = old.get(chunk.chunk_id)
+            if prev is None or prev["embed_hash"] != embed_hash(chunk):
+                result.to_embed.append(chunk)
+            elif prev["meta_hash"] != metadata_hash(chunk.to_pinecone_metadata()):
+                result.to_update.append(chunk)
+            else:
+                result.unchanged += 1
+        new_ids = {c.chunk_id for c in chunks}
+        result.to_delete = sorted(cid for cid in old if cid not in new_ids)
+        return result
+
+    def replace(
+        self,
+        chunks: list[EnrichedChunk],
+        filename: str,
+        stale_ids: Optional[set[str]] = None,
+    ):
+        """
+        Reemplaza el manifiesto por el nuevo set de chunks y lo guarda.
+        `stale_ids`: chunks cuyo update de metadata falló; quedan marcados para
+        que el próximo diff los vuelva a actualizar.
+        """
+        stale_ids = stale_ids or set()
+        self._data = {
+            "doc_id": self.doc_id,
+            "filename": filename,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "chunks": {
+                c.chunk_id: {
+                    "embed_hash": embed_hash(c),
+                    "meta_hash": "" if c.chunk_id in stale_ids else metadata_hash(c.to_pinecone_metadata()),
+                    "record": asdict(c),
+                }
+                for c in chunks
+            },
+        }
+        self._file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self._file.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._data, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self._file)
+
+    def delete(self):
+        """Elimina el manifiesto (documento retirado del índice)."""
+        self._file.unlink(missing_ok=True)
+
+
+def manifest_dir(project_id: str) -> Path:
+    return settings.processed_dir / project_id / "manifests"
+
+
+def iter_manifests(project_id: str) -> list[DocumentManifest]:
+    """Todos los manifiestos de un proyecto."""
+    directory = manifest_dir(project_id)
+    if not directory.exists():
+        return []
+    return [DocumentManifest(project_id, p.stem) for p in sorted(directory.glob("*.json"))]
@@ -0,0 +1,134 @@
+"""
+storage/chunk_store.py — Store local (SQLite) con el texto y los campos de display.
+
+Con ~35 campos + 3800 chars de texto por vector, un /search con top_k=20 traía
+~80 KB de metadata desde Pinecone. Ahora Pinecone guarda solo los campos
+filtrables (ver EnrichedChunk.to_filter_metadata) y el resto vive aquí,
+indexado por chunk_id:
+  data/chunk_store.sqlite
+
+`search` hidrata los resultados con un único SELECT ... WHERE chunk_id IN (...).
+Vectores antiguos con metadata completa siguen funcionando: si un ID no está
+en el store se usa la metadata que venga de Pinecone.
+
+Es opt-in (settings.chunk_store_enabled): el archivo SQLite tiene que estar
+también en el host de la API, que no corre la ingesta. Sin él, los vectores
+ingestados con el store activo vuelven de /search sin texto.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from pia_rag.config import settings
+from pia_rag.etl.enriched_chunker import EnrichedChunk
+
+# SQLite limita los parámetros por statement (999 en builds antiguos)
+_MAX_PARAMS = 900
+
+
+class ChunkStore:
+    """
+    Texto y metadata de display de cada chunk, por chunk_id.
+
+    Uso:
+        store = ChunkStore()
+        store.put_many(chunks)
+        records = store.get_many(["abc__p0001_...", ...])
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self._path = path or settings.chunk_store_path
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        # One connection shared by the API worker threads, serialized by the lock
+        self._conn = sqlite3.connect(str(self._path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " chunk_id TEXT PRIMARY KEY,"
+                " project_id TEXT NOT NULL,"
+                " doc_id TEXT NOT NULL,"
+                " data TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks (project_id, doc_id)")
+
+    def put_many(self, chunks: Iterable[EnrichedChunk]):
+        """Inserta o reemplaza chunks (texto completo, sin truncar)."""
+        rows = [
+            (
+                c.chunk_id,
+                c.project_id,
+                c.doc_id,
+                json.dumps({**c.to_pinecone_metadata(), "text": c.text}, ensure_ascii=False),
+            )
+            for c in chunks
+        ]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, project_id, doc_id, data) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def put_records(self, records: dict[str, dict]):
+        """Inserta records ya serializados (los de get_many), p.ej. al restaurar un snapshot."""
+        rows = [
+            (cid, data.get("project_id", ""), data.get("doc_id", ""), json.dumps(data, ensure_ascii=False))
+            for cid, data in records.items()
+        ]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (chunk_id, project_id, doc_id, data) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+
+    def get_many(self, chunk_ids: list[str]) -> dict[str, dict]:
+        """Records por chunk_id (los que no están se omiten)."""
+        found: dict[str, dict] = {}
+        with self._lock:
+            for i in range(0, len(chunk_ids), _MAX_PARAMS):
+                batch = chunk_ids[i: i + _MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                cursor = self._conn.execute(
+                    f"SELECT chunk_id, data FROM chunks WHERE chunk_id IN ({placeholders})", batch,
+                )
+                found.update((cid, json.loads(data)) for cid, data in cursor)
+        return found
+
+    def iter_records(self, batch_size: int = 1000) -> Iterator[dict[str, dict]]:
+        """Todos los records, en lotes {chunk_id: data} (para reconstruir índices derivados)."""
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT chunk_id, data FROM chunks WHERE chunk_id > ? ORDER BY chunk_id LIMIT ?",
+                    (last, batch_size),
+                ).fetchall()
+            if not rows:
+                return
+            yield {cid: json.loads(data) for cid, data in rows}
+            last = rows[-1][0]
+
+    def delete_many(self, chunk_ids: list[str]):
+        with self._lock, self._conn:
+            for i in range(0, len(chunk_ids), _MAX_PARAMS):
+                batch = chunk_ids[i: i + _MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                self._conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+
+    def count(self, project_id: Optional[str] = None) -> int:
+        with self._lock:
+            if project_id:
+                row = self._conn.execute("SELECT COUNT(*) FROM chunks WHERE project_id = ?", (project_id,)).fetchone()
+            else:
+                row = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()
+        return row[0]
@@ -0,0 +1,169 @@
+"""
+storage/dimension_migration.py — Migración a embeddings de menor dimensión.
+
+text-embedding-3-* son modelos "Matryoshka": pedir `dimensions=512` equivale a
+quedarse con las primeras 512 componentes del vector de 1536 y re-normalizar.
+Por eso el índice reducido se construye desde los vectores ya guardados
+(fetch del índice actual o de un backend local como caché), sin re-embeber:
+
+  1. migrate — recorre cada namespace del origen (list → fetch), reproyecta
+               y hace upsert al destino con la misma metadata
+  2. compare — para un set fijo de preguntas, consulta origen y destino y
+               reporta recall@k (solapamiento de IDs) y latencias p50/p95
+
+Al terminar: OPENAI_EMBEDDING_DIMENSIONS=512 y apuntar PINECONE_INDEX_NAME /
+PINECONE_HOST (o el backend local) al índice nuevo.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import statistics
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+from openai import OpenAI
+
+from pia_rag.config import settings
+from pia_rag.storage.vector_store import VectorStore
+
+
+def reproject(values: list[float], dimensions: int) -> list[float]:
+    """Trunca a `dimensions` componentes y re-normaliza (L2)."""
+    head = list(values[:dimensions])
+    norm = math.sqrt(sum(v * v for v in head)) or 1.0
+    return [v / norm for v in head]
+
+
+def _namespaces(store: VectorStore) -> list[str]:
+    stats = store.describe_index_stats()
+    ns = stats.namespaces if hasattr(stats, "namespaces") else stats.get("namespaces", {})
+    return sorted(ns or {}) or [""]
+
+
+def _dimension(store: VectorStore) -> int:
+    stats = store.describe_index_stats()
+    return stats.dimension if hasattr(stats, "dimension") else stats.get("dimension", 0)
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct * (len(ordered) - 1))))]
+
+
+class DimensionMigration:
+    """
+    Copia un índice a otro de menor dimensión y compara calidad/latencia.
+
+    Uso:
+        migration = DimensionMigration(source, target, dimensions=512)
+        migration.migrate()
+        report = migration.compare(["¿Qué especies hay en la línea base?", ...])
+    """
+
+    def __init__(self, source: VectorStore, target: VectorStore, dimensions: int):
+        self._source = source
+        self._target = target
+        self.dimensions = dimensions
+
+    def migrate(self, namespaces: Optional[list[str]] = None) -> dict:
+        """Reproyecta todos los vectores del origen al destino. Idempotente."""
+        stats = {"namespaces": 0, "vectors": 0}
+        for namespace in namespaces or _namespaces(self._source):
+            copied = 0
+            for page in self._source.list(namespace=namespace):
+                fetched = self._source.fetch(ids=page, namespace=namespace)
+                vectors = fetched.vectors if hasattr(fetched, "vectors") else fetched.get("vectors", {})
+                batch = []
+                for vid, vec in vectors.items():
+                    values = vec.values if hasattr(vec, "values") else vec.get("values")
+                    meta = (vec.metadata if hasattr(vec, "metadata") else vec.get("metadata")) or {}
+                    batch.append({"id": vid, "values": reproject(values, self.dimensions), "metadata": meta})
+                for i in range(0, len(batch), settings.pinecone_upsert_batch):
+                    self._target.upsert(vectors=batch[i: i + settings.pinecone_upsert_batch], namespace=namespace)
+                copied += len(batch)
+            logger.info(f"Reproyección [{namespace or 'default'}]: {copied} vectors → {self.dimensions}d")
+            stats["namespaces"] += 1
+            stats["vectors"] += copied
+        return stats
+
+    def compare(
+        self,
+        queries: list[str],
+        top_k: int = 10,
+        namespace: Optional[str] = None,
+        client: Optional[OpenAI] = None,
+    ) -> dict:
+        """
+        recall@k del destino contra el origen (el origen es la referencia) y
+        latencia de query de ambos. Cada pregunta se embebe una sola vez en la
+        dimensión nativa y se reproyecta para cada índice.
+        """
+        client = client or OpenAI(api_key=settings.openai_api_key)
+        source_dim = _dimension(self._source)
+        namespaces = [namespace] if namespace is not None else _namespaces(self._source)
+
+        response = client.embeddings.create(
+            input=[q.replace("\n", " ") for q in queries],
+            model=settings.openai_embedding_model,
+        )
+        native = [d.embedding for d in response.data]
+
+        per_query = []
+        source_ms: list[float] = []
+        target_ms: list[float] = []
+        for question, vector in zip(queries, native):
+            q_source = reproject(vector, source_dim or len(vector))
+            q_target = reproject(vector, self.dimensions)
+            ids_source, ids_target = [], []
+            for ns in namespaces:
+                t0 = time.perf_counter()
+                res = self._source.query(vector=q_source, top_k=top_k, namespace=ns)
+                source_ms.append((time.perf_counter() - t0) * 1000)
+                ids_source += [(m.score, m.id) for m in res.matches]
+
+                t0 = time.perf_counter()
+                res = self._target.query(vector=q_target, top_k=top_k, namespace=ns)
+                target_ms.append((time.perf_counter() - t0) * 1000)
+                ids_target += [(m.score, m.id) for m in res.matches]
+
+            expected = {i for _, i in sorted(ids_source, reverse=True)[:top_k]}
+            got = {i for _, i in sorted(ids_target, reverse=True)[:top_k]}
+            recall = len(expected & got) / len(expected) if expected else 1.0
+            per_query.append({"query": question, "recall": round(recall, 4)})
+
+        recalls = [q["recall"] for q in per_query]
+        return {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "source_dimension": source_dim,
+            "target_dimension": self.dimensions,
+            "top_k": top_k,
+            "queries": len(queries),
+            "recall_mean": round(statistics.mean(recalls), 4) if recalls else 0.0,
+            "recall_min": min(recalls) if recalls else 0.0,
+            "source_latency_ms": {"p50": round(_percentile(source_ms, 0.5), 2), "p95": round(_percentile(source_ms, 0.95), 2)},
+            "target_latency_ms": {"p50": round(_percentile(target_ms, 0.5), 2), "p95": round(_percentile(target_ms, 0.95), 2)},
+            "per_query": per_query,
+        }
+
+
+def load_queries(path: Path) -> list[str]:
+    """Set fijo de preguntas: .json (lista) o texto, una por línea."""
+    text = path.read_text(encoding="utf-8")
+    if path.suffix == ".json":
+        return [q for q in json.loads(text) if q]
+    return [line.strip() for line in text.splitlines() if line.strip() and not line.startswith("#")]
+
+
+def save_report(report: dict) -> Path:
+    """Guarda el reporte en data/eval/dimension_report_{dims}.json."""
+    path = settings.data_dir / "eval" / f"dimension_report_{report['target_dimension']}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
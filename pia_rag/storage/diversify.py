@@ -0,0 +1,86 @@
+"""
+storage/diversify.py — Diversificación de resultados de búsqueda (MMR + colapso por página).
+
+Con chunking por página y chunk_overlap=200, el top-k suele traer varios
+chunks casi idénticos de la misma página o de páginas vecinas: gastan cupos de
+top_k y tokens de contexto en /ask. Con search_diversify, PineconeClient.search
+trae más candidatos (con sus vectores) y:
+
+  1. collapse_same_page — deja el mejor chunk de cada documento entre páginas
+                          iguales, solapadas o contiguas
+  2. mmr_select         — maximal marginal relevance vectorizado con NumPy:
+                          λ·relevancia − (1−λ)·máx. similitud con lo ya elegido
+
+mmr_select requiere `numpy` (en requirements.txt); sin él search aplica solo
+el colapso por página.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+
+def collapse_same_page(ranked: list[tuple[str, float]], records: dict[str, dict]) -> list[tuple[str, float]]:
+    """
+    Mantiene el primer (mejor) resultado de cada documento entre páginas
+    iguales, solapadas o contiguas: un chunk de las págs. 12-13 descarta a los
+    peores de las págs. 11 a 14 del mismo documento. El documento se identifica
+por (project_id, doc_id): el doc_id sale solo del filename, y dos proyectos
+pueden tener un PDF con el mismo nombre.
+    """
+    kept_ranges: dict[tuple[Optional[str], str], list[tuple[int, int]]] = {}
+    kept = []
+    for match_id, score in ranked:
+        meta = records.get(match_id, {})
+        doc = meta.get("doc_id") or meta.get("filename")
+        start = meta.get("page_start")
+        if doc is None or start is None:
+            kept.append((match_id, score))
+            continue
+        start = int(start)
+        end = int(meta.get("page_end") or start)
+        ranges = kept_ranges.setdefault((meta.get("project_id"), doc), [])
+        if any(start <= other_end + 1 and end >= other_start - 1 for other_start, other_end in ranges):
+            continue
+        ranges.append((start, end))
+        kept.append((match_id, score))
+    return kept
+
+
+def mmr_select(
+    vectors: list[Optional[list[float]]],
+    relevance: list[float],
+    k: int,
+    lambda_mult: float,
+) -> list[int]:
+    """
+    Índices de los k candidatos elegidos por MMR, en orden de selección.
+    Un candidato sin vector (p.ej. un hit solo léxico) se trata como no
+    similar a ninguno.
+    """
+    import numpy as np
+
+    n = len(relevance)
+    if n == 0 or k <= 0:
+        return []
+    dim = next((len(v) for v in vectors if v), 0)
+    matrix = np.zeros((n, dim), dtype=np.float32)
+    for i, values in enumerate(vectors):
+        if values:
+            matrix[i] = values
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+    similarity = matrix @ matrix.T                       # n×n coseno, una sola multiplicación
+
+    rel = np.asarray(relevance, dtype=np.float32)
+    max_sim = np.zeros(n, dtype=np.float32)              # máx. similitud con lo ya elegido
+    available = np.ones(n, dtype=bool)
+    selected: list[int] = []
+    for _ in range(min(k, n)):
+        scores = lambda_mult * rel - (1.0 - lambda_mult) * max_sim
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_sim, similarity[best], out=max_sim)
+    return selected
@@ -0,0 +1,169 @@
+"""
+storage/embedding_batcher.py — Empaquetado de embeddings por presupuesto de tokens.
+
+Antes cada PDF hacía sus propios requests de 50 textos fijos: un PDF de 3 chunks
+era un round-trip completo y 50 chunks largos podían pasar el límite de tokens
+por request. Aquí:
+
+  - `pack_by_tokens` arma requests contando tokens reales (tiktoken) hasta
+    `embedding_batch_max_tokens` / `embedding_batch_size` inputs.
+  - `CrossDocumentBatcher` acumula chunks de varios PDFs y solo llama a OpenAI
+    cuando el acumulado llena un request; devuelve cada PDF cuando todos sus
+    chunks tienen embedding.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable, Optional
+
+from loguru import logger
+
+from pia_rag.config import settings
+
+
+# ─── Token counting ─────────────────────────────────────────────────────────
+
+@lru_cache(maxsize=1)
+def _encoding():
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(settings.openai_embedding_model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """Tokens exactos del texto según el tokenizer del modelo de embeddings."""
+    return len(_encoding().encode(text, disallowed_special=()))
+
+
+def embedding_params() -> dict:
+    """model (+ dimensions si está configurado) para embeddings.create y la Batch API."""
+    params = {"model": settings.openai_embedding_model}
+    if settings.openai_embedding_dimensions:
+        params["dimensions"] = settings.openai_embedding_dimensions
+    return params
+
+
+def clean_for_embedding(text: str) -> str:
+    """Los saltos de línea empeoran la calidad del embedding."""
+    return text.replace("\n", " ")
+
+
+def pack_by_tokens(
+    token_counts: list[int],
+    max_tokens: Optional[int] = None,
+    max_inputs: Optional[int] = None,
+) -> list[tuple[int, int]]:
+    """
+    Agrupa inputs consecutivos en requests sin pasar el presupuesto.
+    Retorna rangos [start, end) sobre la lista original.
+    """
+    max_tokens = max_tokens or settings.embedding_batch_max_tokens
+    max_inputs = max_inputs or settings.embedding_batch_size
+
+    ranges: list[tuple[int, int]] = []
+    start, used = 0, 0
+    for i, n in enumerate(token_counts):
+        if i > start and (used + n > max_tokens or i - start >= max_inputs):
+            ranges.append((start, i))
+            start, used = i, 0
+        used += n
+    if start < len(token_counts):
+        ranges.append((start, len(token_counts)))
+    return ranges
+
+
+# ─── Cross-document batcher ─────────────────────────────────────────────────
+
+@dataclass
+class EmbeddedGroup:
+    """Chunks de un PDF con sus embeddings (o el error que impidió generarlos)."""
+    key: str
+    chunks: list
+    embeddings: list[list[float]] = field(default_factory=list)
+    payload: Any = None
+    error: Optional[str] = None
+
+
+@dataclass
+class _PendingGroup:
+    key: str
+    chunks: list
+    texts: list[str]
+    tokens: list[int]
+    payload: Any
+
+
+class CrossDocumentBatcher:
+    """
+    Acumula chunks de varios PDFs y los embebe en requests llenos.
+
+    Uso:
+        batcher = CrossDocumentBatcher(pinecone.embed_requests)
+        for pdf in pdfs:
+            for group in batcher.add(pdf.name, chunks, payload=...):
+                ...upsert group.chunks con group.embeddings...
+        for group in batcher.flush():
+            ...
+    """
+
+    def __init__(self, embed_requests: Callable[[list[list[str]]], list[list[list[float]]]]):
+        # embed_requests recibe una lista de requests (listas de textos) y
+        # retorna los embeddings de cada uno, en el mismo orden.
+        self._embed_requests = embed_requests
+        self._pending: list[_PendingGroup] = []
+        self._pending_tokens = 0
+        self.requests_sent = 0
+
+    @property
+    def pending_tokens(self) -> int:
+        return self._pending_tokens
+
+    def add(self, key: str, chunks: list, payload: Any = None) -> list[EmbeddedGroup]:
+        """Encola los chunks de un PDF. Retorna los grupos listos si se llenó un request."""
+        texts = [clean_for_embedding(c.embed_text) for c in chunks]
+        tokens = [count_tokens(t) for t in texts]
+        self._pending.append(_PendingGroup(key, chunks, texts, tokens, payload))
+        self._pending_tokens += sum(tokens)
+
+        if self._pending_tokens >= settings.embedding_batch_max_tokens:
+            return self.flush()
+        return []
+
+    def flush(self) -> list[EmbeddedGroup]:
+        """Embebe todo lo pendiente y retorna un EmbeddedGroup por PDF."""
+        pending, self._pending, self._pending_tokens = self._pending, [], 0
+        if not pending:
+            return []
+
+        texts = [t for g in pending for t in g.texts]
+        tokens = [n for g in pending for n in g.tokens]
+        ranges = pack_by_tokens(tokens)
+
+        try:
+            results = self._embed_requests([texts[a:b] for a, b in ranges])
+        except Exception as e:
+            logger.error(f"Embedding de {len(pending)} PDFs falló: {e}")
+            return [
+                EmbeddedGroup(g.key, g.chunks, payload=g.payload, error=str(e))
+                for g in pending
+            ]
+
+        self.requests_sent += len(ranges)
+        embeddings = [emb for batch in results for emb in batch]
+        groups: list[EmbeddedGroup] = []
+        offset = 0
+        for g in pending:
+            n = len(g.chunks)
+            groups.append(EmbeddedGroup(g.key, g.chunks, embeddings[offset:offset + n], g.payload))
+            offset += n
+
+        logger.info(
+            f"Embeddings: {len(texts)} chunks de {len(pending)} PDFs "
+            f"en {len(ranges)} request{'s' if len(ranges) != 1 else ''} ({sum(tokens)} tokens)"
+        )
+        return groups
@@ -0,0 +1,118 @@
+"""
+storage/embedding_executor.py — Ejecutor concurrente de requests de embeddings.
+
+Reemplaza el loop serial con `sleep(retry_delay * (attempt + 1))`:
+  - Varios requests en vuelo (ThreadPool), acotados por AdaptiveConcurrency
+  - Cada request pasa por el RateLimiter RPM/TPM antes de salir
+  - Los headers x-ratelimit-* de cada respuesta re-sincronizan el limitador
+  - 429 / errores de red → backoff exponencial con jitter (respeta Retry-After)
+  - Request rechazado por tamaño → se bisecta
+"""
+
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from loguru import logger
+from openai import (
+    APIConnectionError,
+    APITimeoutError,
+    BadRequestError,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+
+from pia_rag.config import settings
+from pia_rag.storage.embedding_batcher import count_tokens, embedding_params
+from pia_rag.storage.rate_limiter import (
+    AdaptiveConcurrency,
+    RateLimiter,
+    backoff_delay,
+    parse_reset,
+    parse_retry_after,
+)
+
+
+def _is_oversized(error: BadRequestError) -> bool:
+    """True si OpenAI rechazó el request por exceso de tokens o de inputs."""
+    msg = str(error).lower()
+    return "token" in msg or "too many inputs" in msg or "maximum" in msg
+
+
+class EmbeddingExecutor:
+    """
+    Ejecuta requests de embeddings en paralelo respetando el rate limit de OpenAI.
+
+    Uso:
+        executor = EmbeddingExecutor()
+        results = executor.embed_requests([["texto 1", "texto 2"], ["texto 3"]])
+    """
+
+    def __init__(self, client: Optional[OpenAI] = None):
+        # max_retries=0: los reintentos los maneja este ejecutor (con el limitador)
+        self._client = client or OpenAI(api_key=settings.openai_api_key, max_retries=0)
+        self.limiter = RateLimiter()
+        self.concurrency = AdaptiveConcurrency()
+
+    def embed_requests(self, requests: list[list[str]]) -> list[list[list[float]]]:
+        """Ejecuta los requests concurrentemente. Retorna los embeddings en el mismo orden."""
+        if len(requests) <= 1:
+            return [self._embed_request(batch) for batch in requests]
+
+        with ThreadPoolExecutor(max_workers=self.concurrency.max_limit) as pool:
+            return list(pool.map(self._embed_request, requests))
+
+    def _embed_request(self, batch: list[str]) -> list[list[float]]:
+        """Un request con limitador, reintentos y bisección por tamaño."""
+        tokens = sum(count_tokens(t) for t in batch)
+
+        for attempt in range(settings.embedding_max_retries):
+            self.limiter.acquire(tokens)
+            try:
+                with self.concurrency:
+                    raw = self._client.embeddings.with_raw_response.create(
+                        input=batch,
+                        **embedding_params(),
+                    )
+                self.limiter.update_from_headers(raw.headers)
+                self.concurrency.on_success()
+                return [d.embedding for d in raw.parse().data]
+
+            except BadRequestError as e:
+                if len(batch) > 1 and _is_oversized(e):
+                    mid = len(batch) // 2
+                    logger.warning(f"Request de {len(batch)} inputs rechazado por tamaño — bisectando")
+                    return self._embed_request(batch[:mid]) + self._embed_request(batch[mid:])
+                logger.error(f"Error fatal en embedding ({len(batch)} inputs): {e}")
+                raise
+
+            except RateLimitError as e:
+                headers = e.response.headers if e.response is not None else None
+                retry_after = parse_retry_after(headers)
+                if retry_after is None and headers:
+                    retry_after = parse_reset(headers.get("x-ratelimit-reset-tokens"))
+                self.concurrency.on_throttle()
+                delay = backoff_delay(attempt, retry_after)
+                self.limiter.block_for(retry_after or delay)
+                logger.warning(
+                    f"429 en embedding ({len(batch)} inputs, intento {attempt + 1}) — "
+                    f"espera {delay:.1f}s, concurrencia → {self.concurrency.limit}"
+                )
+                if attempt == settings.embedding_max_retries - 1:
+                    raise
+                time.sleep(delay)
+
+            except (APIConnectionError, APITimeoutError, InternalServerError) as e:
+                delay = backoff_delay(attempt)
+                logger.warning(
+                    f"Embedding ({len(batch)} inputs) intento {attempt + 1} falló: {e} — "
+                    f"reintento en {delay:.1f}s"
+                )
+                if attempt == settings.embedding_max_retries - 1:
+                    raise
+                time.sleep(delay)
+
+        return []
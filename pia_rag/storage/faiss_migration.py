@@ -0,0 +1,297 @@
+"""
+storage/faiss_migration.py — Migración en streaming de un índice FAISS a Pinecone.
+
+Reemplaza a subir_a_pinecone.py, que cargaba todo metadata.pkl en memoria,
+subía en serie y ante un error esperaba 2 s y seguía (el batch se perdía).
+Ahora, sin cargar el índice ni la metadata completos:
+
+  1. El índice FAISS se abre con mmap (si el tipo lo permite) y se lee con
+     reconstruct_n por ventanas de settings.migrate_window vectores
+  2. La metadata se lee en streaming a la par de los vectores:
+       - .jsonl: un record por línea, en el orden de FAISS (memoria acotada;
+                 el formato recomendado para índices grandes)
+       - .pkl:   lista (o dict posición → record) deserializada de a un
+                 elemento; el Unpickler entrega cada record a una cola acotada
+                 en vez de construir la lista completa, y poda del memo de
+                 pickle los records y textos ya entregados. Los strings cortos
+                 (claves, nombres de archivo) se conservan porque records
+                 posteriores pueden referenciarlos, así que la memoria crece
+                 con la cantidad de strings cortos distintos
+  3. Cada ventana se parte en batches que se suben en paralelo con reintentos;
+     si un batch sigue fallando la migración se detiene sin perderlo
+  4. Al confirmar una ventana se guarda el checkpoint
+     (data/migrations/{índice}_{destino}.json); re-ejecutar retoma desde ahí
+
+Credenciales e índice destino salen de Settings (PINECONE_API_KEY, ...).
+Requiere `faiss-cpu` y `numpy` (opcionales).
+"""
+
+from __future__ import annotations
+
+import json
+import pickle
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+from loguru import logger
+
+from pia_rag.config import settings
+from pia_rag.storage.vector_store import VectorStore, upsert_with_retry
+
+_END = object()
+_MEMO_KEEP_CHARS = 256      # shorter strings stay memoized: later records may reference them
+
+
+# ── Metadata en streaming ───────────────────────────────────────────────
+
+class _EvictingMemo(dict):
+    """
+    Memo de pickle que olvida lo ya entregado. MEMOIZE usa len(memo) como
+    índice del siguiente objeto, así que len cuenta todas las entradas
+    creadas aunque se hayan borrado.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._count = 0
+        self._recent: list[int] = []
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._count = max(self._count, key + 1)
+        self._recent.append(key)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def release(self):
+        """Borra las entradas creadas desde el último release salvo los strings cortos."""
+        for key in self._recent:
+            value = self.get(key)
+            if not (isinstance(value, str) and len(value) <= _MEMO_KEEP_CHARS):
+                self.pop(key, None)
+        self._recent.clear()
+
+
+class _StreamingUnpickler(pickle._Unpickler):
+    """
+    Unpickler (implementación Python) cuyo contenedor raíz no acumula: cada
+    elemento agregado a la lista/dict de primer nivel se pasa a `emit`.
+    pickle agrupa los append de a 1000, así que en memoria hay a lo sumo un
+    grupo más lo que la cola deje pendiente, más los strings cortos que
+    conserva el memo (ver _EvictingMemo).
+
+    Si un record referencia un objeto de un record anterior ya podado (p.ej.
+    una lista compartida), la carga falla: convertir la metadata a .jsonl.
+    """
+
+    def __init__(self, file, emit):
+        super().__init__(file)
+        self.memo = _EvictingMemo()
+        memo = self.memo
+
+        def _emit(item):
+            emit(item)
+            memo.release()
+
+        self._emit = _emit
+        self._root_seen = False
+        self.dispatch = dict(self.dispatch)
+        self.dispatch[pickle.EMPTY_LIST[0]] = _StreamingUnpickler._load_empty_list
+        self.dispatch[pickle.EMPTY_DICT[0]] = _StreamingUnpickler._load_empty_dict
+
+    def _root(self, factory):
+        if self._root_seen:
+            return factory()
+        self._root_seen = True
+        emit = self._emit
+
+        if factory is list:
+            class _Sink(list):
+                def append(self, item):
+                    emit(item)
+
+                def extend(self, items):
+                    for item in items:
+                        emit(item)
+        else:
+            class _Sink(dict):
+                def __setitem__(self, key, item):
+                    emit(item)
+        return _Sink()
+
+    def _load_empty_list(self):
+        self.append(self._root(list))
+
+    def _load_empty_dict(self):
+        self.append(self._root(dict))
+
+
+def _iter_pickle(path: Path) -> Iterator[dict]:
+    """Records de un metadata.pkl (lista o dict ordenado por posición), de a uno."""
+    q: queue.Queue = queue.Queue(maxsize=settings.migrate_window)
+    errors: list[BaseException] = []
+
+    def _produce():
+        try:
+            with open(path, "rb") as f:
+                _StreamingUnpickler(f, q.put).load()
+        except pickle.UnpicklingError as e:
+            errors.append(pickle.UnpicklingError(
+                f"{path.name}: un record referencia datos de otro ya liberado ({e}); "
+                "convierte la metadata a .jsonl (un record por línea) y usa ese archivo"
+            ))
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            q.put(_END)
+
+    threading.Thread(target=_produce, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is _END:
+            break
+        yield item
+    if errors:
+        raise errors[0]
+
+
+def _iter_jsonl(path: Path) -> Iterator[dict]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def iter_metadata(path: Path) -> Iterator[dict]:
+    """Records de metadata en el orden del índice FAISS (.jsonl o .pkl)."""
+    if path.suffix == ".jsonl":
+        return _iter_jsonl(path)
+    return _iter_pickle(path)
+
+
+def _to_metadata(record) -> dict:
+    """Campos del record aceptados por Pinecone (escalares y listas de strings)."""
+    if not isinstance(record, dict):
+        record = {"text": str(record)}
+    meta = {}
+    for key, value in record.items():
+        if isinstance(value, (str, int, float, bool)):
+            meta[key] = value
+        elif isinstance(value, (list, tuple)) and all(isinstance(v, str) for v in value):
+            meta[key] = list(value)
+    if isinstance(meta.get("text"), str):
+        meta["text"] = meta["text"][: settings.migrate_max_text_chars]
+    return meta
+
+
+# ── FAISS ───────────────────────────────────────────────────────────────
+
+def _open_faiss(path: Path):
+    import faiss
+
+    try:
+        index = faiss.read_index(str(path), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        # Index types without mmap support are read normally
+        index = faiss.read_index(str(path))
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()    # IVF needs it for reconstruct_n
+    except RuntimeError:
+        pass
+    return index
+
+
+def _safe_name(value: str) -> str:
+    return re.sub(r"[^\w.-]", "_", value)
+
+
+def _checkpoint_path(faiss_path: Path, target: str) -> Path:
+    return settings.data_dir / "migrations" / f"{_safe_name(faiss_path.stem)}_{_safe_name(target)}.json"
+
+
+def migrate_faiss(
+    faiss_path: Path,
+    metadata_path: Path,
+    store: VectorStore,
+    target: str,
+    namespace: str = "",
+    id_prefix: str = "",
+    workers: Optional[int] = None,
+    restart: bool = False,
+) -> dict:
+    """
+    Sube el índice FAISS + metadata a `store`. IDs = f"{id_prefix}{posición}"
+    (los mismos que usaba subir_a_pinecone.py). `target` identifica el destino
+    en el checkpoint. Retorna {"total", "done", "uploaded"}.
+    """
+    index = _open_faiss(faiss_path)
+    total = index.ntotal
+    checkpoint_path = _checkpoint_path(faiss_path, target)
+    checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+
+    done = 0
+    if checkpoint_path.exists() and not restart:
+        state = json.loads(checkpoint_path.read_text(encoding="utf-8"))
+        if state.get("total") == total:
+            done = state.get("done", 0)
+        else:
+            logger.warning(f"Checkpoint de otro índice ({state.get('total')} ≠ {total} vectors): se ignora")
+    if done:
+        logger.info(f"Retomando migración en {done}/{total}")
+
+    def _save(position: int):
+        tmp = checkpoint_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({
+            "faiss": str(faiss_path),
+            "target": target,
+            "total": total,
+            "done": position,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }, indent=2), encoding="utf-8")
+        tmp.replace(checkpoint_path)
+
+    records = iter_metadata(metadata_path)
+    for _ in range(done):
+        next(records)
+
+    batch_size = settings.pinecone_upsert_batch
+    window = settings.migrate_window
+    uploaded = 0
+    started = time.time()
+
+    with ThreadPoolExecutor(max_workers=workers or settings.pinecone_upsert_workers) as pool:
+        for start in range(done, total, window):
+            n = min(window, total - start)
+            values = index.reconstruct_n(start, n)
+            vectors = []
+            for k in range(n):
+                record = next(records, None)
+                if record is None:
+                    raise ValueError(f"La metadata termina antes que el índice ({start + k}/{total})")
+                vectors.append({
+                    "id": f"{id_prefix}{start + k}",
+                    "values": values[k].tolist(),
+                    "metadata": _to_metadata(record),
+                })
+            del values
+
+            futures = [
+                pool.submit(upsert_with_retry, store, vectors[i: i + batch_size], namespace)
+                for i in range(0, n, batch_size)
+            ]
+            for future in futures:
+                future.result()     # a batch that keeps failing stops here; the checkpoint stays at `start`
+
+            _save(start + n)
+            uploaded += n
+            rate = uploaded / max(time.time() - started, 1e-6)
+            logger.info(f"Migración: {start + n}/{total} ({(start + n) / total:.1%}, {rate:.0f} vectors/s)")
+
+    return {"total": total, "done": total, "uploaded": uploaded}
@@ -0,0 +1,333 @@
+"""
+storage/faiss_store.py — Backend FAISS en proceso con sidecar de metadata.
+
+Para despliegues de una sola máquina (o todo offline): búsqueda en memoria con
+FAISS en vez del índice hospedado. Un índice por namespace:
+
+  data/faiss/{namespace}.faiss       vectores (HNSW, IVF o Flat; producto interno
+                                     sobre vectores normalizados = coseno)
+  data/faiss/{namespace}.meta.json   sidecar: posición FAISS → id + metadata
+
+FAISS no borra bien de HNSW, así que delete y re-upsert dejan "tombstones"
+(posiciones sin sidecar que query ignora) y el namespace se reconstruye
+cuando superan settings.faiss_rebuild_ratio. IVF arranca como Flat y se
+entrena al reconstruir, cuando ya hay vectores suficientes.
+
+Requiere `faiss-cpu` y `numpy` (opcionales; solo con VECTOR_STORE_BACKEND=faiss).
+"""
+
+from __future__ import annotations
+
+import atexit
+import json
+import math
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Iterator, Optional
+
+from loguru import logger
+
+from pia_rag.config import settings
+from pia_rag.storage.vector_store import VectorStore, matches_filter, vector_field
+
+_DEFAULT_NS_FILE = "__default__"
+
+
+class _Namespace:
+    """Índice FAISS + sidecar de un namespace."""
+
+    def __init__(self, index, records: Optional[dict[int, dict]] = None, built_size: int = 0):
+        self.index = index
+        self.records: dict[int, dict] = records or {}   # posición → {"id", "metadata"}
+        self.positions: dict[str, int] = {r["id"]: pos for pos, r in self.records.items()}
+        self.built_size = built_size                    # vectores al último (re)build
+        self.dirty = False
+
+    @property
+    def tombstones(self) -> int:
+        return self.index.ntotal - len(self.records)
+
+
+class FaissVectorStore(VectorStore):
+    """
+    VectorStore sobre FAISS, con la misma forma que `pinecone.Index`.
+
+    Uso:
+        store = FaissVectorStore(Path("data/faiss"))
+        store.upsert([{"id": "a", "values": [...], "metadata": {...}}], namespace="hyc")
+        store.query(vector=[...], top_k=8, filter={"doc_type": {"$eq": "EIA"}}, include_metadata=True)
+    """
+
+    def __init__(self, directory: Path):
+        try:
+            import faiss
+            import numpy as np
+        except ImportError as e:
+            raise ImportError(
+                "VECTOR_STORE_BACKEND=faiss requiere `pip install faiss-cpu numpy`"
+            ) from e
+        self._faiss = faiss
+        self._np = np
+        self._dir = Path(directory)
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._namespaces: dict[str, _Namespace] = {}
+        self._dim: int = 0
+        self._last_save = time.monotonic()
+        self._load()
+        atexit.register(self.save)
+
+    # ── Persistence ─────────────────────────────────────────────────────
+
+    def _files(self, namespace: str) -> tuple[Path, Path]:
+        name = namespace or _DEFAULT_NS_FILE
+        return self._dir / f"{name}.faiss", self._dir / f"{name}.meta.json"
+
+    def _load(self):
+        for meta_file in sorted(self._dir.glob("*.meta.json")):
+            name = meta_file.name[: -len(".meta.json")]
+            index_file = self._dir / f"{name}.faiss"
+            if not index_file.exists():
+                continue
+            sidecar = json.loads(meta_file.read_text(encoding="utf-8"))
+            index = self._faiss.read_index(str(index_file))
+            records = {int(pos): r for pos, r in sidecar["records"].items()}
+            namespace = "" if name == _DEFAULT_NS_FILE else name
+            self._namespaces[namespace] = _Namespace(index, records, sidecar.get("built_size", 0))
+            self._dim = self._dim or index.d
+        if self._namespaces:
+            total = sum(len(ns.records) for ns in self._namespaces.values())
+            logger.info(f"FAISS: {len(self._namespaces)} namespaces, {total} vectors desde {self._dir}")
+
+    def save(self):
+        """Escribe a disco los namespaces modificados."""
+        with self._lock:
+            for namespace, ns in self._namespaces.items():
+                if not ns.dirty:
+                    continue
+                index_file, meta_file = self._files(namespace)
+                tmp_index = index_file.with_suffix(".faiss.tmp")
+                self._faiss.write_index(ns.index, str(tmp_index))
+                tmp_index.replace(index_file)
+                tmp_meta = meta_file.with_suffix(".tmp")
+                tmp_meta.write_text(json.dumps({
+                    "built_size": ns.built_size,
+                    "records": {str(pos): r for pos, r in ns.records.items()},
+                }, ensure_ascii=False), encoding="utf-8")
+                tmp_meta.replace(meta_file)
+                ns.dirty = False
+            self._last_save = time.monotonic()
+
+    def _autosave(self):
+        if time.monotonic() - self._last_save > settings.faiss_autosave_s:
+            self.save()
+
+    # ── Index building ──────────────────────────────────────────────────
+
+    def _new_index(self, train=None):
+        """Índice vacío del tipo configurado (IVF se entrena con `train`)."""
+        faiss = self._faiss
+        kind = settings.faiss_index_type.lower()
+        if kind == "hnsw":
+            index = faiss.IndexHNSWFlat(self._dim, settings.faiss_hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = settings.faiss_hnsw_ef_construction
+            return index
+        if kind == "ivf" and train is not None and len(train) >= settings.faiss_ivf_min_train:
+            # ~4·sqrt(n) lists, with at least 39 training points per centroid
+            nlist = min(settings.faiss_ivf_nlist, int(4 * math.sqrt(len(train))), len(train) // 39)
+            nlist = max(1, nlist)
+            quantizer = faiss.IndexFlatIP(self._dim)
+            index = faiss.IndexIVFFlat(quantizer, self._dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            index.train(train)
+            index.make_direct_map()  # reconstruct() for fetch/rebuild
+            return index
+        return faiss.IndexFlatIP(self._dim)
+
+    def _namespace(self, namespace: str, create: bool = False) -> Optional[_Namespace]:
+        ns = self._namespaces.get(namespace)
+        if ns is None and create:
+            ns = self._namespaces[namespace] = _Namespace(self._new_index())
+        return ns
+
+    def _as_matrix(self, values: list[list[float]]):
+        x = self._np.asarray(values, dtype="float32").reshape(len(values), -1)
+        self._faiss.normalize_L2(x)
+        return x
+
+    def _rebuild(self, namespace: str, ns: _Namespace):
+        """Reconstruye el namespace sin tombstones (y entrena IVF si corresponde)."""
+        live = sorted(ns.records)
+        if live:
+            vectors = self._np.vstack([ns.index.reconstruct(pos) for pos in live]).astype("float32")
+        else:
+            vectors = self._np.zeros((0, self._dim), dtype="float32")
+        index = self._new_index(train=vectors)
+        if len(vectors):
+            index.add(vectors)
+        records = {new: ns.records[old] for new, old in enumerate(live)}
+        rebuilt = _Namespace(index, records, built_size=len(live))
+        rebuilt.dirty = True
+        self._namespaces[namespace] = rebuilt
+        logger.info(f"FAISS[{namespace or 'default'}]: reconstruido con {len(live)} vectors ({type(index).__name__})")
+
+    def _maybe_rebuild(self, namespace: str, ns: _Namespace):
+        live = len(ns.records)
+        too_many_tombstones = ns.tombstones > max(1000, settings.faiss_rebuild_ratio * ns.index.ntotal)
+        ivf_pending = (
+            settings.faiss_index_type.lower() == "ivf"
+            and live >= settings.faiss_ivf_min_train
+            and live >= 4 * max(ns.built_size, 1)
+        )
+        if too_many_tombstones or ivf_pending:
+            self._rebuild(namespace, ns)
+
+    # ── Write ───────────────────────────────────────────────────────────
+
+    def upsert(self, vectors: list, namespace: str = "", **_):
+        if not vectors:
+            return SimpleNamespace(upserted_count=0)
+        with self._lock:
+            values = [list(vector_field(v, "values")) for v in vectors]
+            self._dim = self._dim or len(values[0])
+            ns = self._namespace(namespace, create=True)
+
+            for v in vectors:
+                old = ns.positions.pop(vector_field(v, "id"), None)
+                if old is not None:
+                    ns.records.pop(old, None)
+
+            start = ns.index.ntotal
+            ns.index.add(self._as_matrix(values))
+            for offset, v in enumerate(vectors):
+                vid = vector_field(v, "id")
+                ns.records[start + offset] = {"id": vid, "metadata": dict(vector_field(v, "metadata") or {})}
+                ns.positions[vid] = start + offset
+            ns.dirty = True
+            self._maybe_rebuild(namespace, ns)
+            self._autosave()
+        return SimpleNamespace(upserted_count=len(vectors))
+
+    def update(self, id: str, values: Optional[list[float]] = None,
+               set_metadata: Optional[dict] = None, namespace: str = "", **_):
+        with self._lock:
+            ns = self._namespace(namespace)
+            pos = ns.positions.get(id) if ns else None
+            if pos is None:
+                return {}
+            record = ns.records[pos]
+            if set_metadata:
+                record["metadata"].update(set_metadata)
+                ns.dirty = True
+            if values is not None:
+                self.upsert([{"id": id, "values": values, "metadata": record["metadata"]}], namespace=namespace)
+            self._autosave()
+        return {}
+
+    def delete(self, ids: Optional[list[str]] = None, delete_all: bool = False,
+               namespace: str = "", filter: Optional[dict] = None, **_):
+        with self._lock:
+            ns = self._namespace(namespace)
+            if ns is None:
+                return {}
+            if delete_all:
+                targets = list(ns.positions)
+            elif filter:
+                targets = [r["id"] for r in ns.records.values() if matches_filter(r["metadata"], filter)]
+            else:
+                targets = ids or []
+            for vid in targets:
+                pos = ns.positions.pop(vid, None)
+                if pos is not None:
+                    ns.records.pop(pos, None)
+            ns.dirty = True
+
+            if not ns.records:
+                del self._namespaces[namespace]
+                for path in self._files(namespace):
+                    path.unlink(missing_ok=True)
+            else:
+                self._maybe_rebuild(namespace, ns)
+                self._autosave()
+        return {}
+
+    # ── Read ────────────────────────────────────────────────────────────
+
+    def query(self, vector: list[float], top_k: int = 10, namespace: str = "",
+              filter: Optional[dict] = None, include_metadata: bool = False,
+              include_values: bool = False, **_):
+        # Reads hold the lock too: FAISS does not support add() concurrent with search(),
+        # and an upsert can drop a position between the search and building the matches
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            matches = []
+            if ns is not None and ns.records:
+                q = self._as_matrix([vector])
+                total = ns.index.ntotal
+                # Over-fetch to make room for tombstones and filtered-out results
+                k = top_k if not filter and not ns.tombstones else min(total, max(top_k * 4, top_k + ns.tombstones))
+                while True:
+                    k = min(k, total)
+                    self._tune(ns.index, k)
+                    scores, positions = ns.index.search(q, k)
+                    matches = [
+                        (float(score), int(pos)) for score, pos in zip(scores[0], positions[0])
+                        if pos >= 0 and pos in ns.records and matches_filter(ns.records[pos]["metadata"], filter)
+                    ]
+                    if len(matches) >= top_k or k >= total:
+                        break
+                    k *= 4
+                matches = matches[:top_k]
+
+            return SimpleNamespace(
+                namespace=namespace,
+                matches=[
+                    SimpleNamespace(
+                        id=ns.records[pos]["id"],
+                        score=score,
+                        metadata=dict(ns.records[pos]["metadata"]) if include_metadata else None,
+                        values=ns.index.reconstruct(pos).tolist() if include_values else [],
+                    )
+                    for score, pos in matches
+                ],
+            )
+
+    def _tune(self, index, k: int):
+        """Parámetros de búsqueda: efSearch (HNSW) / nprobe (IVF)."""
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = max(settings.faiss_hnsw_ef_search, k)
+        elif hasattr(index, "nprobe"):
+            index.nprobe = settings.faiss_ivf_nprobe
+
+    def fetch(self, ids: list[str], namespace: str = "", **_):
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            vectors = {}
+            if ns is not None:
+                for vid in ids:
+                    pos = ns.positions.get(vid)
+                    if pos is not None:
+                        vectors[vid] = SimpleNamespace(
+                            id=vid,
+                            values=ns.index.reconstruct(pos).tolist(),
+                            metadata=dict(ns.records[pos]["metadata"]),
+                        )
+        return SimpleNamespace(namespace=namespace, vectors=vectors)
+
+    def list(self, prefix: Optional[str] = None, namespace: str = "", limit: int = 100, **_) -> Iterator[list[str]]:
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            ids = sorted(i for i in (ns.positions if ns else {}) if not prefix or i.startswith(prefix))
+        for i in range(0, len(ids), limit):
+            yield ids[i: i + limit]
+
+    def describe_index_stats(self, **_):
+        with self._lock:
+            namespaces = {name: SimpleNamespace(vector_count=len(ns.records)) for name, ns in self._namespaces.items()}
+        return SimpleNamespace(
+            namespaces=namespaces,
+            dimension=self._dim,
+            total_vector_count=sum(ns.vector_count for ns in namespaces.values()),
+            index_fullness=0.0,
+        )
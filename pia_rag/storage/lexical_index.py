@@ -0,0 +1,222 @@
+"""
+storage/lexical_index.py — Índice léxico local (BM25) sobre el texto de los chunks.
+
+Los embeddings encuentran mal los identificadores exactos ("RCA N° 123/2015",
+"Res. Ex. N° 45", "Art. 12", nombres de especies), y ChatGPT terminaba
+repitiendo la búsqueda. Este índice invertido (SQLite FTS5, ranking bm25())
+se alimenta en la ingesta junto con el ChunkStore:
+  data/lexical_index.sqlite
+
+Los términos se normalizan antes de indexar (minúsculas, sin tildes, sin
+stopwords, stemming liviano en español), igual para chunks y consultas.
+Los identificadores numéricos se indexan por partes y completos
+("123/2015" → "123", "2015", "1232015").
+
+search() combina estos resultados con los del vector query por
+reciprocal-rank fusion (rrf_fuse); una consulta que es solo un identificador
+no necesita embedding (is_identifier_query).
+"""
+
+from __future__ import annotations
+
+import re
+import sqlite3
+import threading
+import unicodedata
+from pathlib import Path
+from typing import Iterable, Optional
+
+from pia_rag.config import settings
+from pia_rag.etl.enriched_chunker import EnrichedChunk
+
+_MAX_PARAMS = 900
+
+_STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuales cuando de del desde
+donde dos durante e el ella ellas ellos en entre era es esa esas ese eso esos esta
+estan estas este esto estos fue fueron ha han hasta hay la las le les lo los mas me
+mi muy n nº no nos nro num numero o otra otras otro otros para pero por porque que
+se segun ser si sin sobre son su sus tambien tiene u un una unas uno unos y ya
+""".split())
+
+# Palabras que acompañan a un número en un identificador ("Res. Ex. N° 123")
+_ID_WORDS = frozenset("""
+rca res resol resolucion resoluciones ex exenta exento n nº no nro num numero art arts
+articulo articulos ds d s dto decreto ley ord oficio icsara adenda inciso letra
+""".split())
+
+_COMPOUND_NUM = re.compile(r"\d+(?:[./\-]\d+)+")
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Sufijos derivativos y de plural/género, del más largo al más corto
+_SUFFIXES = (
+    "amientos", "imientos", "aciones", "uciones", "amiento", "imiento", "idades",
+    "mente", "acion", "ucion", "idad", "ismos", "istas", "ables", "ibles",
+    "ismo", "ista", "able", "ible", "ivas", "ivos", "iva", "ivo",
+)
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sin tildes ni símbolos ("N°" → "n")."""
+    text = unicodedata.normalize("NFKD", text.lower().replace("°", "").replace("º", ""))
+    return text.encode("ascii", "ignore").decode("ascii")
+
+
+def stem(word: str) -> str:
+    """Stemming liviano en español: sufijos derivativos, plural y género."""
+    if word.isdigit() or len(word) < 5:
+        return word
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[: -len(suffix)]
+    if word.endswith("ces"):
+        return word[:-3] + "z"
+    if word.endswith("es") and word[-3] not in "aeiou":
+        word = word[:-2]
+    elif word.endswith("s"):
+        word = word[:-1]
+    if word[-1] in "aoe" and len(word) > 4:
+        word = word[:-1]
+    return word
+
+
+def terms(text: str) -> list[str]:
+    """Términos indexables de un texto (mismo tratamiento para chunks y consultas)."""
+    text = normalize(text)
+    out = [re.sub(r"\D", "", m.group()) for m in _COMPOUND_NUM.finditer(text)]
+    out += [stem(t) for t in _TOKEN.findall(text) if t not in _STOPWORDS]
+    return out
+
+
+def is_identifier_query(query: str) -> bool:
+    """True si la consulta es solo un identificador ("RCA 123/2015", "Art. 12")."""
+    tokens = [t for t in _TOKEN.findall(normalize(query)) if t in _ID_WORDS or t not in _STOPWORDS]
+    if not tokens or len(tokens) > 6:
+        return False
+    has_number = any(t.isdigit() for t in tokens)
+    return has_number and all(t.isdigit() or t in _ID_WORDS for t in tokens)
+
+
+def rrf_fuse(rankings: list[list[str]], k: Optional[int] = None) -> list[tuple[str, float]]:
+    """
+    Reciprocal-rank fusion: score(id) = Σ 1/(k + rank). El score se normaliza
+    a [0, 1] (1 = primero en todas las listas). Retorna [(id, score)] ordenado.
+    """
+    k = k or settings.rrf_k
+    fused: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, 1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    best = len([r for r in rankings if r]) / (k + 1) or 1.0
+    return sorted(((i, s / best) for i, s in fused.items()), key=lambda t: t[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    BM25 sobre los términos normalizados de cada chunk, con los mismos filtros
+    que el vector query.
+
+    Uso:
+        lexical = LexicalIndex()
+        lexical.put_many(chunks)
+        hits = lexical.search("RCA N° 123/2015", top_k=20, project_id="hyc")
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        self._path = path or settings.lexical_index_path
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self._path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                " rowid INTEGER PRIMARY KEY,"
+                " chunk_id TEXT UNIQUE NOT NULL,"
+                " project_id TEXT, doc_type TEXT, chunk_level TEXT, chapter_title TEXT)"
+            )
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunk_terms USING fts5(terms)")
+
+    def put_many(self, chunks: Iterable[EnrichedChunk]):
+        """Indexa (o re-indexa) chunks."""
+        self.put_records({
+            c.chunk_id: {
+                "text": c.text,
+                "project_id": c.project_id,
+                "doc_type": c.doc_type,
+                "chunk_level": c.chunk_level,
+                "chapter_title": c.chapter_title,
+                "section_title": c.section_title,
+                "subsection_title": c.subsection_title,
+            }
+            for c in chunks
+        })
+
+    def put_records(self, records: dict[str, dict]):
+        """Indexa records del ChunkStore (texto + campos de filtro)."""
+        if not records:
+            return
+        with self._lock, self._conn:
+            self._delete(list(records))
+            for chunk_id, data in records.items():
+                titled = " ".join(
+                    data.get(k) or "" for k in ("chapter_title", "section_title", "subsection_title")
+                )
+                cursor = self._conn.execute(
+                    "INSERT INTO docs (chunk_id, project_id, doc_type, chunk_level, chapter_title)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    (chunk_id, data.get("project_id", ""), data.get("doc_type", ""),
+                     data.get("chunk_level", ""), data.get("chapter_title", "")),
+                )
+                self._conn.execute(
+                    "INSERT INTO chunk_terms (rowid, terms) VALUES (?, ?)",
+                    (cursor.lastrowid, " ".join(terms(f"{titled} {data.get('text', '')}"))),
+                )
+
+    def delete_many(self, chunk_ids: list[str]):
+        with self._lock, self._conn:
+            self._delete(chunk_ids)
+
+    def _delete(self, chunk_ids: list[str]):
+        for i in range(0, len(chunk_ids), _MAX_PARAMS):
+            batch = chunk_ids[i: i + _MAX_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            rowids = [r[0] for r in self._conn.execute(
+                f"SELECT rowid FROM docs WHERE chunk_id IN ({placeholders})", batch,
+            )]
+            if rowids:
+                marks = ",".join("?" * len(rowids))
+                self._conn.execute(f"DELETE FROM chunk_terms WHERE rowid IN ({marks})", rowids)
+                self._conn.execute(f"DELETE FROM docs WHERE rowid IN ({marks})", rowids)
+
+    def search(
+        self,
+        query: str,
+        top_k: int = 20,
+        project_id: Optional[str] = None,
+        chunk_level: Optional[str] = None,
+        chapter_title: Optional[str] = None,
+        doc_type: Optional[str] = None,
+    ) -> list[str]:
+        """chunk_ids ordenados por BM25 (mejor primero)."""
+        query_terms = list(dict.fromkeys(terms(query)))
+        if not query_terms:
+            return []
+        where, params = ["chunk_terms MATCH ?"], [" OR ".join(f'"{t}"' for t in query_terms)]
+        for column, value in (
+            ("project_id", project_id), ("chunk_level", chunk_level),
+            ("chapter_title", chapter_title), ("doc_type", doc_type),
+        ):
+            if value:
+                where.append(f"d.{column} = ?")
+                params.append(value)
+        sql = (
+            "SELECT d.chunk_id FROM chunk_terms JOIN docs d ON d.rowid = chunk_terms.rowid"
+            f" WHERE {' AND '.join(where)} ORDER BY bm25(chunk_terms) LIMIT ?"
+        )
+        with self._lock:
+            return [row[0] for row in self._conn.execute(sql, (*params, top_k))]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
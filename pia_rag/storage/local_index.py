@@ -0,0 +1,147 @@
+"""
+storage/local_index.py — Sustituto local del `Index` de Pinecone (tests / offline).
+
+Implementa la interfaz VectorStore (la forma de `pinecone.Index`) con
+namespaces, similitud coseno en Python puro y los filtros de metadata de
+Pinecone. Si se le da un archivo, persiste el contenido en JSON para que
+distintos comandos del CLI vean el mismo índice.
+
+Se activa con VECTOR_STORE_BACKEND=local.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Iterator, Optional
+
+from pia_rag.storage.vector_store import VectorStore, matches_filter, vector_field
+
+
+def _cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+class LocalPineconeIndex(VectorStore):
+    """
+    Índice en memoria con la forma de `pinecone.Index`.
+
+    Uso:
+        index = LocalPineconeIndex(Path("data/local_pinecone.json"))
+        index.upsert(vectors=[{"id": "a", "values": [...], "metadata": {...}}], namespace="hyc")
+        index.query(vector=[...], top_k=5, namespace="hyc", include_metadata=True)
+    """
+
+    def __init__(self, path: Optional[Path] = None, page_size: int = 100):
+        self._path = path
+        self._page_size = page_size
+        self._lock = threading.Lock()
+        # namespace → id → {"values": [...], "metadata": {...}}
+        self._data: dict[str, dict[str, dict]] = {}
+        if path and path.exists():
+            self._data = json.loads(path.read_text(encoding="utf-8"))
+
+    def _save(self):
+        if self._path:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self._path.with_suffix(".tmp")
+            tmp.write_text(json.dumps(self._data), encoding="utf-8")
+            tmp.replace(self._path)
+
+    # ── Write ───────────────────────────────────────────────────────────
+
+    def upsert(self, vectors: list, namespace: str = "", **_):
+        with self._lock:
+            ns = self._data.setdefault(namespace, {})
+            for v in vectors:
+                ns[vector_field(v, "id")] = {
+                    "values": list(vector_field(v, "values", [])),
+                    "metadata": dict(vector_field(v, "metadata") or {}),
+                }
+            self._save()
+        return SimpleNamespace(upserted_count=len(vectors))
+
+    def update(self, id: str, values: Optional[list[float]] = None,
+               set_metadata: Optional[dict] = None, namespace: str = "", **_):
+        with self._lock:
+            record = self._data.get(namespace, {}).get(id)
+            if record is None:
+                return {}
+            if values is not None:
+                record["values"] = list(values)
+            if set_metadata:
+                record["metadata"].update(set_metadata)
+            self._save()
+        return {}
+
+    def delete(self, ids: Optional[list[str]] = None, delete_all: bool = False,
+               namespace: str = "", filter: Optional[dict] = None, **_):
+        with self._lock:
+            ns = self._data.get(namespace, {})
+            if delete_all:
+                ns.clear()
+            elif filter:
+                for vid in [i for i, r in ns.items() if matches_filter(r["metadata"], filter)]:
+                    del ns[vid]
+            for vid in ids or []:
+                ns.pop(vid, None)
+            if namespace in self._data and not ns:
+                del self._data[namespace]
+            self._save()
+        return {}
+
+    # ── Read ────────────────────────────────────────────────────────────
+
+    def fetch(self, ids: list[str], namespace: str = "", **_):
+        ns = self._data.get(namespace, {})
+        return SimpleNamespace(
+            namespace=namespace,
+            vectors={
+                vid: SimpleNamespace(id=vid, values=ns[vid]["values"], metadata=ns[vid]["metadata"])
+                for vid in ids if vid in ns
+            },
+        )
+
+    def query(self, vector: list[float], top_k: int = 10, namespace: str = "",
+              filter: Optional[dict] = None, include_metadata: bool = False,
+              include_values: bool = False, **_):
+        ns = self._data.get(namespace, {})
+        scored = [
+            (_cosine(vector, r["values"]), vid, r)
+            for vid, r in ns.items()
+            if matches_filter(r["metadata"], filter)
+        ]
+        scored.sort(key=lambda t: t[0], reverse=True)
+        return SimpleNamespace(
+            namespace=namespace,
+            matches=[
+                SimpleNamespace(
+                    id=vid,
+                    score=score,
+                    metadata=dict(r["metadata"]) if include_metadata else None,
+                    values=list(r["values"]) if include_values else [],
+                )
+                for score, vid, r in scored[:top_k]
+            ],
+        )
+
+    def list(self, prefix: Optional[str] = None, namespace: str = "", **_) -> Iterator[list[str]]:
+        ids = sorted(i for i in self._data.get(namespace, {}) if not prefix or i.startswith(prefix))
+        for i in range(0, len(ids), self._page_size):
+            yield ids[i: i + self._page_size]
+
+    def describe_index_stats(self, **_):
+        namespaces = {ns: SimpleNamespace(vector_count=len(v)) for ns, v in self._data.items()}
+        dimension = next((len(r["values"]) for v in self._data.values() for r in v.values()), 0)
+        return SimpleNamespace(
+            namespaces=namespaces,
+            dimension=dimension,
+            total_vector_count=sum(len(v) for v in self._data.values()),
+            index_fullness=0.0,
+        )
@@ -2,114 +2,412 @@
 storage/pinecone_client.py — Cliente Pinecone para el índice api-rag-mvp.
 
 Siempre conecta por host directo (más rápido que resolver por nombre).
-Maneja upsert con batching y retry, y query con filtros metadata.
+Maneja embeddings empaquetados por tokens, upsert paralelo con retry y outbox
+en disco para batches fallidos, y query con filtros metadata. Con
+chunk_store_enabled la metadata en Pinecone se reduce a los campos filtrables y
+el texto se hidrata desde el ChunkStore local.
+
+Con pinecone_project_namespaces cada proyecto vive en su propio namespace
+(= project_id): las búsquedas de un proyecto van directo a su namespace y las
+globales se reparten entre todos los namespaces en paralelo.
+
+Con lexical_search_enabled (y chunk_store_enabled), search combina el vector query con un índice BM25
+local (storage/lexical_index.py) por reciprocal-rank fusion; las consultas que
+son solo un identificador ("RCA N° 123/2015") no se embeben. Con
+search_diversify, el top-k se diversifica (colapso por página + MMR, ver
+storage/diversify.py). Búsquedas idénticas simultáneas comparten una sola
+llamada (storage/single_flight.py, single_flight_enabled), y con
+query_embed_window_ms > 0 los embeddings de consultas concurrentes se
+agrupan en un solo request (storage/query_batcher.py).
+
+Cada escritura (upsert, update de metadata, delete, drain del outbox) marca
+al proyecto como actualizado con un vector marcador en el namespace
+settings.pinecone_state_namespace; el host de la API, que no tiene los
+state.json de la ingesta, lo lee para invalidar el cache de respuestas.
+
+El almacenamiento de vectores es un VectorStore (storage/vector_store.py):
+Pinecone por defecto, o FAISS en proceso / stand-in local según
+settings.vector_store_backend.
 """
 
 from __future__ import annotations
 
 import time
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Iterator, Optional
 
 from loguru import logger
-from openai import OpenAI, RateLimitError, APIConnectionError
+from openai import OpenAI
 
 from pia_rag.config import settings
 from pia_rag.etl.enriched_chunker import EnrichedChunk
+from pia_rag.storage.chunk_store import ChunkStore
+from pia_rag.storage.diversify import collapse_same_page, mmr_select
+from pia_rag.storage.embedding_batcher import (
+    clean_for_embedding,
+    count_tokens,
+    embedding_params,
+    pack_by_tokens,
+)
+from pia_rag.storage.embedding_executor import EmbeddingExecutor
+from pia_rag.storage.lexical_index import LexicalIndex, is_identifier_query, rrf_fuse
+from pia_rag.storage.query_batcher import QueryEmbeddingBatcher
+from pia_rag.storage.single_flight import SingleFlight
+from pia_rag.storage.upsert_outbox import UpsertOutbox
+from pia_rag.storage.vector_store import create_vector_store, upsert_with_retry
+
+_STATE_PREFIX = "project_state__"
 
 
 class PineconeClient:
-    """Cliente para operaciones sobre el índice api-rag-mvp en Pinecone."""
+    """Cliente para operaciones sobre el índice api-rag-mvp (Pinecone o backend local)."""
 
     def __init__(self):
-        from pinecone import Pinecone
+        self._index = create_vector_store()
+        self._namespace_cache: tuple[float, list[str]] = (0.0, [])
+        self._openai = OpenAI(api_key=settings.openai_api_key)
+        self._embedder = EmbeddingExecutor()
+        self._outbox = UpsertOutbox()
+        self._store = ChunkStore() if settings.chunk_store_enabled else None
+        # Lexical hits are hydrated from the chunk store, so it needs one
+        self._lexical = LexicalIndex() if settings.lexical_search_enabled and self._store is not None else None
+        if settings.lexical_search_enabled and self._store is None:
+            logger.warning(
+                "lexical_search_enabled=True sin chunk_store_enabled: la búsqueda híbrida queda "
+                "desactivada y search usa solo vectores"
+            )
+        self.flight = SingleFlight()
+        self._query_batcher = (
+            QueryEmbeddingBatcher(self._openai) if settings.query_embed_window_ms > 0 else None
+        )
+        if settings.vector_store_backend == "pinecone":
+            logger.info(f"Pinecone conectado: {settings.pinecone_index_name} @ {settings.pinecone_host}")
+        else:
+            logger.info(f"Vector store local: {settings.vector_store_backend}")
+
+    # ── Namespaces ──────────────────────────────────────────────────────
 
-        self._pc = Pinecone(api_key=settings.pinecone_api_key)
-        self._index = self._pc.Index(
-            name=settings.pinecone_index_name,
-            host=settings.pinecone_host,
+    def namespace_for(self, project_id: Optional[str]) -> str:
+        """Namespace donde vive un proyecto ("" = namespace por defecto)."""
+        return (project_id or "") if settings.pinecone_project_namespaces else ""
+
+    def namespaces(self, refresh: bool = False) -> list[str]:
+        """Namespaces con vectores (cacheado settings.pinecone_namespace_cache_s)."""
+        cached_at, names = self._namespace_cache
+        if refresh or time.time() - cached_at > settings.pinecone_namespace_cache_s:
+            stats = self._index.describe_index_stats()
+            ns = stats.namespaces if hasattr(stats, "namespaces") else stats.get("namespaces", {})
+            names = sorted(n for n in (ns or {}) if n != settings.pinecone_state_namespace)
+            self._namespace_cache = (time.time(), names)
+        return names
+
+    # ── Versión por proyecto ────────────────────────────────────────────
+
+    def mark_updated(self, project_ids: set[str]):
+        """
+        Registra que el contenido de estos proyectos cambió: un vector marcador
+        por proyecto en settings.pinecone_state_namespace con last_updated.
+        Un fallo se loguea y no interrumpe la ingesta.
+        """
+        project_ids = {pid for pid in project_ids if pid}
+        if not project_ids:
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        try:
+            # Pinecone rejects all-zero dense vectors; the value itself is never queried
+            marker = [1.0] + [0.0] * (self._dimension() - 1)
+            self._index.upsert(
+                [
+                    {"id": f"{_STATE_PREFIX}{pid}", "values": marker,
+                     "metadata": {"project_id": pid, "last_updated": now}}
+                    for pid in sorted(project_ids)
+                ],
+                namespace=settings.pinecone_state_namespace,
+            )
+        except Exception as e:
+            logger.warning(f"No se pudo registrar la versión de {sorted(project_ids)}: {e}")
+
+    def project_versions(self, project_ids: list[str]) -> dict[str, str]:
+        """last_updated de cada proyecto según su marcador ("" si no tiene)."""
+        fetched = self._index.fetch(
+            ids=[f"{_STATE_PREFIX}{pid}" for pid in project_ids],
+            namespace=settings.pinecone_state_namespace,
         )
-        self._openai = OpenAI(api_key=settings.openai_api_key)
-        logger.info(f"Pinecone conectado: {settings.pinecone_index_name} @ {settings.pinecone_host}")
+        vectors = fetched.vectors if hasattr(fetched, "vectors") else fetched.get("vectors", {})
+        versions = {}
+        for pid in project_ids:
+            vec = vectors.get(f"{_STATE_PREFIX}{pid}")
+            meta = (vec.metadata if hasattr(vec, "metadata") else vec.get("metadata")) if vec is not None else None
+            versions[pid] = (meta or {}).get("last_updated", "")
+        return versions
+
+    def _dimension(self) -> int:
+        if not getattr(self, "_index_dimension", 0):
+            stats = self._index.describe_index_stats()
+            dim = stats.dimension if hasattr(stats, "dimension") else stats.get("dimension", 0)
+            self._index_dimension = dim or settings.openai_embedding_dimensions or 1536
+        return self._index_dimension
 
     # ── Embedding ───────────────────────────────────────────────────────
 
     def embed_texts(self, texts: list[str]) -> list[list[float]]:
-        """Genera embeddings con OpenAI en batches."""
-        all_embeddings: list[list[float]] = []
-        batch_size = settings.embedding_batch_size
-
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i: i + batch_size]
-            # Clean newlines for better embedding quality
-            batch_clean = [t.replace("\n", " ") for t in batch]
-
-            for attempt in range(settings.embedding_max_retries):
-                try:
-                    response = self._openai.embeddings.create(
-                        input=batch_clean,
-                        model=settings.openai_embedding_model,
-                    )
-                    batch_emb = [d.embedding for d in response.data]
-                    all_embeddings.extend(batch_emb)
-                    break
-                except (RateLimitError, APIConnectionError) as e:
-                    logger.warning(f"Embedding batch {i} intento {attempt + 1} falló: {e}")
-                    if attempt < settings.embedding_max_retries - 1:
-                        time.sleep(settings.embedding_retry_delay * (attempt + 1))
-                    else:
-                        raise
-                except Exception as e:
-                    logger.error(f"Error fatal en embedding batch {i}: {e}")
-                    raise
-
-        return all_embeddings
+        """Genera embeddings con OpenAI en requests empaquetados por tokens."""
+        texts = [clean_for_embedding(t) for t in texts]
+        ranges = pack_by_tokens([count_tokens(t) for t in texts])
+        results = self.embed_requests([texts[a:b] for a, b in ranges])
+        return [emb for batch in results for emb in batch]
+
+    def embed_query(self, query: str) -> list[float]:
+        """Embedding de una consulta (micro-batch con otras concurrentes si está activo)."""
+        if self._query_batcher is not None:
+            return self._query_batcher.embed(query)
+        response = self._openai.embeddings.create(
+            input=clean_for_embedding(query),
+            **embedding_params(),
+        )
+        return response.data[0].embedding
+
+    def embed_requests(self, requests: list[list[str]]) -> list[list[list[float]]]:
+        """Ejecuta varios requests de embeddings ya empaquetados (concurrentes, con rate limit)."""
+        return self._embedder.embed_requests(requests)
 
     # ── Upsert ──────────────────────────────────────────────────────────
 
-    def upsert_chunks(self, chunks: list[EnrichedChunk]) -> int:
+    def _metadata(self, chunk: EnrichedChunk) -> dict:
+        """Metadata que se envía a Pinecone (mínima si el texto vive en el store)."""
+        if self._store is not None:
+            return chunk.to_filter_metadata()
+        return chunk.to_pinecone_metadata()
+
+    def upsert_chunks(
+        self,
+        chunks: list[EnrichedChunk],
+        embeddings: Optional[list[list[float]]] = None,
+    ) -> int:
         """
-        Genera embeddings y hace upsert a Pinecone.
-        Retorna el número de vectores indexados.
+        Genera embeddings (si no vienen ya calculados) y hace upsert a Pinecone.
+        Retorna el número de vectores confirmados; los batches que fallan quedan
+        en el outbox (ver drain_outbox).
         """
         if not chunks:
             return 0
 
         # Generate embeddings
-        embed_texts = [c.embed_text for c in chunks]
-        logger.info(f"Generando embeddings para {len(chunks)} chunks...")
-        embeddings = self.embed_texts(embed_texts)
+        if embeddings is None:
+            logger.info(f"Generando embeddings para {len(chunks)} chunks...")
+            embeddings = self.embed_texts([c.embed_text for c in chunks])
 
         if len(embeddings) != len(chunks):
             logger.error(f"Mismatch: {len(embeddings)} embeddings para {len(chunks)} chunks")
             return 0
 
-        # Upsert in batches
+        # Text and display fields go to the local store first
+        if self._store is not None:
+            self._store.put_many(chunks)
+        if self._lexical is not None:
+            self._lexical.put_many(chunks)
+
+        # Upsert batches concurrently (one namespace per batch); failed batches go to the on-disk outbox
+        by_namespace: dict[str, list[int]] = {}
+        for i, chunk in enumerate(chunks):
+            by_namespace.setdefault(self.namespace_for(chunk.project_id), []).append(i)
         batch_size = settings.pinecone_upsert_batch
-        total_upserted = 0
+        batches = [
+            (
+                [chunks[i] for i in idx[j: j + batch_size]],
+                [embeddings[i] for i in idx[j: j + batch_size]],
+                namespace,
+            )
+            for namespace, idx in by_namespace.items()
+            for j in range(0, len(idx), batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=settings.pinecone_upsert_workers) as pool:
+            results = list(pool.map(lambda b: self._upsert_or_spool(*b), batches))
+        total_upserted = sum(results)
 
-        for i in range(0, len(chunks), batch_size):
-            batch_chunks = chunks[i: i + batch_size]
-            batch_embs = embeddings[i: i + batch_size]
+        if total_upserted < len(chunks):
+            logger.warning(
+                f"Pinecone {settings.pinecone_index_name}: {total_upserted}/{len(chunks)} vectors "
+                f"confirmados — el resto quedó en el outbox"
+            )
+        else:
+            logger.info(f"Pinecone {settings.pinecone_index_name}: {total_upserted} vectors upserted")
+        if total_upserted:
+            self.mark_updated({c.project_id for c in chunks})
+        return total_upserted
 
-            vectors = []
-            for chunk, emb in zip(batch_chunks, batch_embs):
-                vectors.append({
-                    "id": chunk.chunk_id,
-                    "values": emb,
-                    "metadata": chunk.to_pinecone_metadata(),
-                })
+    def _upsert_or_spool(
+        self,
+        batch_chunks: list[EnrichedChunk],
+        batch_embs: list[list[float]],
+        namespace: str = "",
+    ) -> int:
+        """Upsert de un batch con reintentos; si sigue fallando lo guarda en el outbox."""
+        vectors = [
+            {"id": chunk.chunk_id, "values": emb, "metadata": self._metadata(chunk)}
+            for chunk, emb in zip(batch_chunks, batch_embs)
+        ]
+        try:
+            self._upsert_vectors(vectors, namespace=namespace)
+            logger.debug(f"Upsert batch: {len(vectors)} vectors OK")
+            return len(vectors)
+        except Exception as e:
+            logger.error(f"Error en upsert batch ({len(vectors)} vectors): {e}")
+            files = {(c.project_id, c.filename) for c in batch_chunks}
+            self._outbox.spool(vectors, files=sorted(files), error=str(e), namespace=namespace)
+            return 0
+
+    def _upsert_vectors(self, vectors: list[dict], namespace: str = ""):
+        """index.upsert con reintentos y backoff exponencial."""
+        upsert_with_retry(self._index, vectors, namespace=namespace)
+
+    def update_metadata(self, chunks: list[EnrichedChunk]) -> list[str]:
+        """
+        Actualiza la metadata de vectores existentes sin re-embeber. Retorna los
+        IDs que fallaron.
 
+        index.update(set_metadata=...) hace merge, no reemplazo: las claves que
+        ya no vienen en la metadata nueva (campos numéricos opcionales que
+        pasaron a None, o los de display al activar el chunk store) conservan
+        su valor anterior. Para quitarlas hay que re-ingestar (upsert).
+        """
+        def _update(chunk: EnrichedChunk) -> bool:
             try:
-                self._index.upsert(vectors=vectors)
-                total_upserted += len(vectors)
-                logger.debug(f"Upsert batch {i // batch_size + 1}: {len(vectors)} vectors OK")
+                self._index.update(
+                    id=chunk.chunk_id,
+                    set_metadata=self._metadata(chunk),
+                    namespace=self.namespace_for(chunk.project_id),
+                )
+                return True
             except Exception as e:
-                logger.error(f"Error en upsert batch {i}: {e}")
-                # Continue with next batch
-                continue
+                logger.error(f"Error actualizando metadata de {chunk.chunk_id}: {e}")
+                return False
 
-        logger.info(f"Pinecone {settings.pinecone_index_name}: {total_upserted} vectors upserted")
-        return total_upserted
+        if not chunks:
+            return []
+        if self._store is not None:
+            self._store.put_many(chunks)
+        if self._lexical is not None:
+            self._lexical.put_many(chunks)
+        with ThreadPoolExecutor(max_workers=settings.pinecone_update_workers) as pool:
+            ok = list(pool.map(_update, chunks))
+        self.mark_updated({c.project_id for c, success in zip(chunks, ok) if success})
+        return [c.chunk_id for c, success in zip(chunks, ok) if not success]
+
+    def delete_ids(self, ids: list[str], project_id: Optional[str] = None) -> int:
+        """Elimina vectores por ID en lotes. Retorna cuántos se eliminaron."""
+        deleted = 0
+        namespace = self.namespace_for(project_id)
+        batch_size = settings.pinecone_delete_batch
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i: i + batch_size]
+            try:
+                self._index.delete(ids=batch, namespace=namespace)
+                deleted += len(batch)
+                if self._store is not None:
+                    self._store.delete_many(batch)
+                if self._lexical is not None:
+                    self._lexical.delete_many(batch)
+            except Exception as e:
+                logger.error(f"Error eliminando {len(batch)} vectors: {e}")
+        if deleted and project_id:
+            self.mark_updated({project_id})
+        return deleted
+
+    def iter_id_pages(
+        self,
+        prefix: str = "",
+        project_id: Optional[str] = None,
+        namespace: Optional[str] = None,
+    ) -> Iterator[list[str]]:
+        """
+        Páginas de IDs que empiezan con `prefix` (solo índices serverless).
+
+        Con `project_id` en el namespace compartido, cada página se filtra por
+        la metadata project_id: el doc_id es un hash del filename, así que
+        "Resumen Ejecutivo.pdf" de dos proyectos comparte prefijo y sin este
+        filtro los vectores del otro proyecto se tomarían como propios (y se
+        borrarían como huérfanos). Los IDs sin project_id quedan fuera.
+        """
+        scoped = bool(project_id) and namespace is None and not settings.pinecone_project_namespaces
+        if namespace is None:
+            namespace = self.namespace_for(project_id)
+        for page in self._index.list(prefix=prefix or None, namespace=namespace):
+            yield self._owned_by(page, project_id, namespace) if scoped else page
+
+    def _owned_by(self, ids: list[str], project_id: str, namespace: str) -> list[str]:
+        """Los IDs de `ids` cuya metadata dice que pertenecen a `project_id`."""
+        if not ids:
+            return []
+        fetched = self._index.fetch(ids=ids, namespace=namespace)
+        vectors = fetched.vectors if hasattr(fetched, "vectors") else fetched.get("vectors", {})
+        owned = []
+        for vid in ids:
+            vec = vectors.get(vid)
+            meta = (vec.metadata if hasattr(vec, "metadata") else vec.get("metadata")) if vec is not None else None
+            if (meta or {}).get("project_id") == project_id:
+                owned.append(vid)
+        return owned
+
+    def list_ids(self, prefix: str = "", project_id: Optional[str] = None) -> list[str]:
+        """IDs del proyecto (o del namespace por defecto) que empiezan con `prefix`."""
+        ids: list[str] = []
+        for page in self.iter_id_pages(prefix, project_id=project_id):
+            ids.extend(page)
+        return ids
+
+    def drain_outbox(self, project_id: Optional[str] = None) -> set[tuple[str, str]]:
+        """Reintenta los batches del outbox. Retorna los (project_id, filename) ya completos."""
+        confirmed = self._outbox.drain(self._upsert_vectors, project_id=project_id)
+        self.mark_updated({pid for pid, _ in confirmed})
+        return confirmed
+
+    def outbox_pending(self, project_id: Optional[str] = None) -> set[tuple[str, str]]:
+        """(project_id, filename) que todavía tienen batches en el outbox."""
+        return self._outbox.pending_files(project_id)
+
+    def migrate_namespaces(
+        self,
+        project_id: Optional[str] = None,
+        delete_source: bool = False,
+        source_namespace: str = "",
+    ) -> dict:
+        """
+        Copia los vectores del namespace plano a un namespace por proyecto
+        (fetch de values + metadata, sin re-embeber). Idempotente: se puede
+        re-ejecutar si se corta. Con `delete_source` borra el original una vez
+        copiado.
+        """
+        stats = {"scanned": 0, "copied": 0, "skipped": 0, "deleted": 0}
+        for page in self._index.list(namespace=source_namespace):
+            fetched = self._index.fetch(ids=page, namespace=source_namespace)
+            vectors = fetched.vectors if hasattr(fetched, "vectors") else fetched.get("vectors", {})
+
+            groups: dict[str, list[dict]] = {}
+            for vid, vec in vectors.items():
+                meta = (vec.metadata if hasattr(vec, "metadata") else vec.get("metadata")) or {}
+                values = vec.values if hasattr(vec, "values") else vec.get("values")
+                pid = meta.get("project_id")
+                if not pid or pid == source_namespace or (project_id and pid != project_id):
+                    stats["skipped"] += 1
+                    continue
+                groups.setdefault(pid, []).append({"id": vid, "values": list(values), "metadata": meta})
+            stats["scanned"] += len(page)
+
+            for pid, group in groups.items():
+                self._upsert_vectors(group, namespace=pid)
+                stats["copied"] += len(group)
+                if delete_source:
+                    self._index.delete(ids=[v["id"] for v in group], namespace=source_namespace)
+                    stats["deleted"] += len(group)
+            logger.info(
+                f"Migración: {stats['scanned']} revisados, {stats['copied']} copiados, "
+                f"{stats['skipped']} omitidos"
+            )
+
+        self.namespaces(refresh=True)
+        return stats
 
     # ── Query ───────────────────────────────────────────────────────────
 
@@ -121,21 +419,65 @@ class PineconeClient:
         chunk_level: Optional[str] = None,
         chapter_title: Optional[str] = None,
         doc_type: Optional[str] = None,
+        diversify: Optional[bool] = None,
     ) -> list[dict]:
         """
         Busca en Pinecone con filtros opcionales.
         Retorna lista de resultados con score, text y metadata.
+
+        Con el índice léxico, los resultados son la fusión (RRF) del vector
+        query y BM25, y `score` pasa a ser el score RRF normalizado a [0, 1].
+        `diversify` (default settings.search_diversify) trae
+        top_k × mmr_fetch_factor candidatos y elige top_k con colapso por
+        página + MMR.
+
+        Con single_flight_enabled, búsquedas idénticas en vuelo (misma
+        consulta y filtros) comparten un solo embedding + query.
         """
-        # Embed query
-        response = self._openai.embeddings.create(
-            input=query.replace("\n", " "),
-            model=settings.openai_embedding_model,
-        )
-        query_vector = response.data[0].embedding
+        if diversify is None:
+            diversify = settings.search_diversify
+        args = (query, top_k, project_id, chunk_level, chapter_title, doc_type, diversify)
+        if not settings.single_flight_enabled:
+            return self._search(*args)
+        return self.flight.do(args, lambda: self._search(*args))
 
-        # Build filter
+    def _search(
+        self,
+        query: str,
+        top_k: int,
+        project_id: Optional[str],
+        chunk_level: Optional[str],
+        chapter_title: Optional[str],
+        doc_type: Optional[str],
+        diversify: bool,
+        query_vector: Optional[list[float]] = None,
+    ) -> list[dict]:
+        candidates = top_k * settings.mmr_fetch_factor if diversify else top_k
+
+        # Lexical candidates (same filters); a bare identifier needs nothing else
+        lexical_ids: list[str] = []
+        if self._lexical is not None:
+            lexical_ids = self._lexical.search(
+                query,
+                top_k=max(candidates, settings.hybrid_candidates),
+                project_id=project_id,
+                chunk_level=chunk_level,
+                chapter_title=chapter_title,
+                doc_type=doc_type,
+            )
+        if lexical_ids and is_identifier_query(query):
+            logger.debug(f"Consulta de identificador, sin embedding: {query!r}")
+            ranked = rrf_fuse([lexical_ids])
+            if diversify:
+                return self._diversify(ranked, {}, {}, top_k)
+            return self._format(ranked[:top_k], {})
+
+        if query_vector is None:
+            query_vector = self.embed_query(query)
+
+        # Build filter (with namespaces the project is the namespace, not a filter)
         filter_dict: dict = {}
-        if project_id:
+        if project_id and not settings.pinecone_project_namespaces:
             filter_dict["project_id"] = {"$eq": project_id}
         if chunk_level:
             filter_dict["chunk_level"] = {"$eq": chunk_level}
@@ -145,22 +487,153 @@ class PineconeClient:
             filter_dict["doc_type"] = {"$eq": doc_type}
 
         # Query
-        results = self._index.query(
-            vector=query_vector,
-            top_k=top_k,
-            include_metadata=True,
-            filter=filter_dict if filter_dict else None,
-        )
+        fetch_k = max(candidates, settings.hybrid_candidates) if lexical_ids else candidates
+        matches = self._query(query_vector, fetch_k, filter_dict or None, project_id, include_values=diversify)
 
-        # Format results
-        formatted = []
-        matches = results.matches if hasattr(results, "matches") else results.get("matches", [])
+        by_id: dict[str, tuple[float, dict]] = {}
+        values: dict[str, list[float]] = {}
         for match in matches:
-            meta = match.metadata if hasattr(match, "metadata") else match.get("metadata", {})
             score = match.score if hasattr(match, "score") else match.get("score", 0.0)
             if score < settings.min_score:
                 continue
+            match_id = match.id if hasattr(match, "id") else match.get("id", "")
+            meta = match.metadata if hasattr(match, "metadata") else match.get("metadata", {})
+            by_id[match_id] = (score, meta or {})
+            if diversify:
+                values[match_id] = match.values if hasattr(match, "values") else match.get("values", [])
+
+        if lexical_ids:
+            ranked = rrf_fuse([list(by_id), lexical_ids])
+        else:
+            ranked = [(match_id, score) for match_id, (score, _) in by_id.items()]
+        metadata = {match_id: meta for match_id, (_, meta) in by_id.items()}
+        if diversify:
+            return self._diversify(ranked, metadata, values, top_k)
+        return self._format(ranked[:top_k], metadata)
+
+    def search_multi(
+        self,
+        query: str,
+        project_ids: list[str],
+        top_k: int = 8,
+        chunk_level: Optional[str] = None,
+        chapter_title: Optional[str] = None,
+        doc_type: Optional[str] = None,
+        diversify: Optional[bool] = None,
+    ) -> dict[str, list[dict]]:
+        """
+        La misma consulta en varios proyectos: un solo embedding y las
+        búsquedas filtradas en paralelo. Retorna {project_id: resultados}
+        (top_k por proyecto) en el orden recibido.
+        """
+        if diversify is None:
+            diversify = settings.search_diversify
+        project_ids = list(dict.fromkeys(project_ids))
+        # A bare identifier is usually answered lexically; each project embeds only if it must
+        lexical_only = self._lexical is not None and is_identifier_query(query)
+        query_vector = None if lexical_only else self.embed_query(query)
+
+        def _one(project_id: str) -> list[dict]:
+            return self._search(
+                query, top_k, project_id, chunk_level, chapter_title, doc_type, diversify, query_vector,
+            )
+
+        if not project_ids:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(len(project_ids), settings.pinecone_query_workers)) as pool:
+            return dict(zip(project_ids, pool.map(_one, project_ids)))
+
+    def search_batch(self, queries: list[dict]) -> dict:
+        """
+        Varias búsquedas independientes en una llamada. Cada elemento de
+        `queries` tiene los argumentos de search (query, top_k, project_id,
+        chunk_level, chapter_title, doc_type, diversify).
+
+        Todas las consultas se embeben en un solo request; las búsquedas corren
+        en paralelo (pinecone_query_workers). Retorna {"embed_ms", "items"} con
+        un item por consulta, en el mismo orden: {"results", "took_ms"} o
+        {"error", "took_ms"} si esa búsqueda falló.
+        """
+        if not queries:
+            return {"embed_ms": 0.0, "items": []}
+
+        # One embeddings request for every distinct query that needs a vector
+        texts = list(dict.fromkeys(
+            q["query"] for q in queries
+            if not (self._lexical is not None and is_identifier_query(q["query"]))
+        ))
+        start = time.perf_counter()
+        vectors: dict[str, list[float]] = {}
+        if texts:
+            response = self._openai.embeddings.create(
+                input=[clean_for_embedding(t) for t in texts],
+                **embedding_params(),
+            )
+            vectors = {text: item.embedding for text, item in zip(texts, response.data)}
+        embed_ms = (time.perf_counter() - start) * 1000
+
+        def _one(q: dict) -> dict:
+            diversify = q.get("diversify")
+            start = time.perf_counter()
+            try:
+                results = self._search(
+                    q["query"],
+                    q.get("top_k", 8),
+                    q.get("project_id"),
+                    q.get("chunk_level"),
+                    q.get("chapter_title"),
+                    q.get("doc_type"),
+                    settings.search_diversify if diversify is None else diversify,
+                    vectors.get(q["query"]),
+                )
+                item = {"results": results}
+            except Exception as e:
+                logger.warning(f"Búsqueda en batch falló ({q['query']!r}): {e}")
+                item = {"error": str(e)}
+            item["took_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            return item
+
+        with ThreadPoolExecutor(max_workers=min(len(queries), settings.pinecone_query_workers)) as pool:
+            items = list(pool.map(_one, queries))
+        return {"embed_ms": round(embed_ms, 1), "items": items}
+
+    def _diversify(
+        self,
+        ranked: list[tuple[str, float]],
+        metadata: dict[str, dict],
+        values: dict[str, list[float]],
+        top_k: int,
+    ) -> list[dict]:
+        """Colapso por página + MMR sobre los candidatos; formatea los top_k elegidos."""
+        stored = self._store.get_many([match_id for match_id, _ in ranked]) if self._store is not None else {}
+        records = {match_id: {**metadata.get(match_id, {}), **stored.get(match_id, {})} for match_id, _ in ranked}
+        ranked = collapse_same_page(ranked, records)
+        try:
+            picked = mmr_select(
+                [values.get(match_id) for match_id, _ in ranked],
+                [score for _, score in ranked],
+                top_k,
+                settings.mmr_lambda,
+            )
+        except ImportError:
+            logger.warning("numpy no está instalado: diversify aplica solo el colapso por página (sin MMR)")
+            picked = range(min(top_k, len(ranked)))
+        return self._format([ranked[i] for i in picked], metadata, stored)
+
+    def _format(
+        self,
+        ranked: list[tuple[str, float]],
+        metadata: dict[str, dict],
+        stored: Optional[dict[str, dict]] = None,
+    ) -> list[dict]:
+        """Resultados de search: metadata del índice + texto/campos del chunk store."""
+        if stored is None:
+            stored = self._store.get_many([match_id for match_id, _ in ranked]) if self._store is not None else {}
+        formatted = []
+        for match_id, score in ranked:
+            meta = {**metadata.get(match_id, {}), **stored.get(match_id, {})}
             formatted.append({
+                "chunk_id": match_id,
                 "text": meta.get("text", ""),
                 "score": round(score, 4),
                 "project_id": meta.get("project_id", ""),
@@ -176,11 +649,63 @@ class PineconeClient:
                 "filename": meta.get("filename", ""),
                 "url": meta.get("url", ""),
             })
-
         return formatted
 
+    def _query(
+        self,
+        vector: list[float],
+        top_k: int,
+        filter_dict: Optional[dict],
+        project_id: Optional[str],
+        include_values: bool = False,
+    ) -> list:
+        """Query al namespace del proyecto, o en paralelo a todos si no hay proyecto."""
+        if not settings.pinecone_project_namespaces or project_id:
+            namespaces = [self.namespace_for(project_id)]
+        else:
+            namespaces = self.namespaces() or [""]
+
+        def _one(namespace: str) -> list:
+            results = self._index.query(
+                vector=vector,
+                top_k=top_k,
+                include_metadata=True,
+                include_values=include_values,
+                filter=filter_dict,
+                namespace=namespace,
+            )
+            return results.matches if hasattr(results, "matches") else results.get("matches", [])
+
+        if len(namespaces) == 1:
+            return _one(namespaces[0])
+
+        with ThreadPoolExecutor(max_workers=min(len(namespaces), settings.pinecone_query_workers)) as pool:
+            per_namespace = list(pool.map(_one, namespaces))
+
+        # Merge by score; a vector present in two namespaces (mid-migration) counts once
+        best: dict[str, object] = {}
+        for match in (m for matches in per_namespace for m in matches):
+            match_id = match.id if hasattr(match, "id") else match.get("id", "")
+            score = match.score if hasattr(match, "score") else match.get("score", 0.0)
+            prev = best.get(match_id)
+            if prev is None or score > (prev.score if hasattr(prev, "score") else prev.get("score", 0.0)):
+                best[match_id] = match
+        merged = sorted(
+            best.values(),
+            key=lambda m: m.score if hasattr(m, "score") else m.get("score", 0.0),
+            reverse=True,
+        )
+        return merged[:top_k]
+
     # ── Stats ───────────────────────────────────────────────────────────
 
+    def stats(self) -> dict:
+        """Contadores en proceso de la ruta de búsqueda (para /metrics)."""
+        data = {"single_flight": self.flight.stats()}
+        if self._query_batcher is not None:
+            data["query_embeddings"] = self._query_batcher.stats()
+        return data
+
     def get_index_stats(self) -> dict:
         """Retorna estadísticas del índice."""
         try:
@@ -188,11 +713,16 @@ class PineconeClient:
             total = stats.total_vector_count if hasattr(stats, "total_vector_count") else stats.get("total_vector_count", 0)
             dim = stats.dimension if hasattr(stats, "dimension") else stats.get("dimension", 0)
             fullness = stats.index_fullness if hasattr(stats, "index_fullness") else stats.get("index_fullness", 0)
+            namespaces = stats.namespaces if hasattr(stats, "namespaces") else stats.get("namespaces", {})
             return {
                 "total_vectors": total,
                 "dimension": dim,
                 "index_fullness": fullness,
+                "namespaces": {
+                    ns: (info.vector_count if hasattr(info, "vector_count") else info.get("vector_count", 0))
+                    for ns, info in (namespaces or {}).items()
+                },
             }
         except Exception as e:
             logger.error(f"Error obteniendo stats: {e}")
-            return {"total_vectors": 0, "dimension": 0, "index_fullness": 0}
+            return {"total_vectors": 0, "dimension": 0, "index_fullness": 0, "namespaces": {}}
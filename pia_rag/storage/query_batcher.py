@@ -0,0 +1,87 @@
+"""
+storage/query_batcher.py — Micro-batching de embeddings de consultas.
+
+Cada /search hacía su propio embeddings.create de un solo input, aunque la API
+acepta arrays. Con query_embed_window_ms > 0, `QueryEmbeddingBatcher.embed`
+deja la consulta en una cola; un hilo colector junta lo que llegue dentro de
+la ventana (o hasta query_embed_batch_max consultas), lo embebe en un solo
+request y devuelve cada vector a quien lo espera. Bajo carga son menos
+round-trips a OpenAI; con poco tráfico conviene dejarlo apagado (default), ya
+que cada consulta pagaría la ventana completa.
+"""
+
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from loguru import logger
+from openai import OpenAI
+
+from pia_rag.config import settings
+from pia_rag.storage.embedding_batcher import clean_for_embedding, embedding_params
+
+
+class QueryEmbeddingBatcher:
+    """
+    Uso:
+        batcher = QueryEmbeddingBatcher(openai_client)
+        vector = batcher.embed("medidas de mitigación flora")   # bloquea ≤ ventana + request
+    """
+
+    def __init__(
+        self,
+        client: OpenAI,
+        window_ms: Optional[float] = None,
+        max_batch: Optional[int] = None,
+        workers: Optional[int] = None,
+    ):
+        self._client = client
+        self._window = (window_ms if window_ms is not None else settings.query_embed_window_ms) / 1000
+        self._max = max_batch or settings.query_embed_batch_max
+        self._queue: queue.Queue[tuple[str, Future]] = queue.Queue()
+        # Batches go out on a pool so the collector keeps gathering while a request is in flight
+        self._pool = ThreadPoolExecutor(max_workers=workers or settings.query_embed_workers)
+        self.requests = 0
+        self.queries = 0
+        threading.Thread(target=self._collect, name="query-embed-batcher", daemon=True).start()
+
+    def embed(self, text: str) -> list[float]:
+        future: Future = Future()
+        self._queue.put((clean_for_embedding(text), future))
+        return future.result()
+
+    def _collect(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self._window
+            while len(batch) < self._max:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._pool.submit(self._send, batch)
+
+    def _send(self, batch: list[tuple[str, Future]]):
+        texts = list(dict.fromkeys(text for text, _ in batch))     # identical queries embed once
+        try:
+            response = self._client.embeddings.create(input=texts, **embedding_params())
+            vectors = {text: item.embedding for text, item in zip(texts, response.data)}
+        except Exception as e:
+            logger.warning(f"Embedding de {len(texts)} consultas falló: {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.requests += 1
+        self.queries += len(batch)
+        for text, future in batch:
+            future.set_result(vectors[text])
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "queries": self.queries, "pending": self._queue.qsize()}
@@ -0,0 +1,192 @@
+"""
+storage/rate_limiter.py — Limitador adaptativo RPM/TPM para la API de OpenAI.
+
+  - `TokenBucket`: cubeta que se rellena continuamente (capacidad = límite/min).
+  - `RateLimiter`: dos cubetas (requests/min y tokens/min). Se re-sincroniza con
+    los headers `x-ratelimit-*` de cada respuesta y se bloquea ante `Retry-After`.
+  - `AdaptiveConcurrency`: AIMD sobre el número de requests en vuelo — sube de
+    a uno con respuestas OK, se reduce a la mitad con cada 429.
+"""
+
+from __future__ import annotations
+
+import random
+import re
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+from pia_rag.config import settings
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+# ─── Header parsing ─────────────────────────────────────────────────────────
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Convierte "1s", "6m0s", "120ms" (formato x-ratelimit-reset-*) a segundos."""
+    if not value:
+        return None
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNITS[unit] for n, unit in parts)
+
+
+def parse_retry_after(headers: Optional[Mapping[str, str]]) -> Optional[float]:
+    """Segundos a esperar según `retry-after-ms` / `Retry-After` (segundos o fecha HTTP)."""
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    value = headers.get(name)
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Backoff exponencial con full jitter; nunca menos que Retry-After."""
+    ceiling = min(settings.embedding_backoff_max, settings.embedding_retry_delay * 2 ** attempt)
+    delay = random.uniform(0, ceiling)
+    return max(delay, retry_after or 0.0)
+
+
+# ─── Token buckets ──────────────────────────────────────────────────────────
+
+class TokenBucket:
+    """Cubeta con relleno continuo. No es thread-safe: la protege RateLimiter."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.available = float(per_minute)
+        self._rate = per_minute / 60.0
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Segundos hasta que haya `amount` disponible (0 si ya hay)."""
+        self._refill()
+        amount = min(amount, self.capacity)  # un request mayor que el límite igual debe pasar
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self._rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.available -= min(amount, self.capacity)
+
+    def sync(self, limit: Optional[int], remaining: Optional[int]):
+        """Ajusta la cubeta al estado que reporta el servidor."""
+        self._refill()
+        if limit:
+            self.capacity = float(limit)
+            self._rate = limit / 60.0
+        if remaining is not None:
+            self.available = min(self.available, float(remaining))
+
+
+class RateLimiter:
+    """Limitador combinado requests/min + tokens/min, thread-safe."""
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None):
+        self._requests = TokenBucket(rpm or settings.embedding_rpm_limit)
+        self._tokens = TokenBucket(tpm or settings.embedding_tpm_limit)
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        """Bloquea hasta poder enviar un request de `tokens` tokens."""
+        while True:
+            with self._lock:
+                wait = max(
+                    self._blocked_until - time.monotonic(),
+                    self._requests.wait_time(1),
+                    self._tokens.wait_time(tokens),
+                )
+                if wait <= 0:
+                    self._requests.consume(1)
+                    self._tokens.consume(tokens)
+                    return
+            time.sleep(min(wait, 5.0))
+
+    def update_from_headers(self, headers: Optional[Mapping[str, str]]):
+        """Sincroniza con x-ratelimit-limit/remaining-requests/tokens."""
+        if not headers:
+            return
+        with self._lock:
+            self._requests.sync(
+                _header_int(headers, "x-ratelimit-limit-requests"),
+                _header_int(headers, "x-ratelimit-remaining-requests"),
+            )
+            self._tokens.sync(
+                _header_int(headers, "x-ratelimit-limit-tokens"),
+                _header_int(headers, "x-ratelimit-remaining-tokens"),
+            )
+
+    def block_for(self, seconds: float):
+        """Pausa todos los requests (429 con Retry-After o reset)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+# ─── Adaptive concurrency ───────────────────────────────────────────────────
+
+class AdaptiveConcurrency:
+    """Semáforo AIMD: el número de requests en vuelo se adapta a los 429."""
+
+    def __init__(self, max_limit: Optional[int] = None):
+        self.max_limit = max_limit or settings.embedding_max_concurrency
+        self.limit = self.max_limit
+        self._in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self._in_flight >= self.limit:
+                self._cond.wait()
+            self._in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            if self.limit < self.max_limit and self._successes >= self.limit:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_throttle(self):
+        with self._cond:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
@@ -0,0 +1,72 @@
+"""
+storage/single_flight.py — Coalescencia de llamadas idénticas en vuelo.
+
+Cuando ChatGPT (o varios usuarios) disparan la misma consulta al mismo tiempo,
+cada request embebía y consultaba Pinecone por su cuenta. `SingleFlight.do`
+ejecuta la función una sola vez por clave mientras esté en vuelo: el primero
+en llegar (líder) hace la llamada y los demás esperan su resultado (o su
+excepción). No es un cache: apenas termina la llamada, la clave se libera.
+"""
+
+from __future__ import annotations
+
+import copy
+import threading
+from typing import Callable, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """
+    Uso:
+        flight = SingleFlight()
+        results = flight.do(("consulta", filtros...), lambda: buscar(...))
+
+    Los seguidores reciben una copia profunda del resultado del líder, así que
+    pueden modificarlo sin afectar a los demás.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, _Call] = {}
+        self.calls = 0          # ejecuciones reales (líderes)
+        self.coalesced = 0      # requests que esperaron a un líder
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._calls)}
@@ -0,0 +1,270 @@
+"""
+storage/snapshot.py — Export/import del índice en formato columnar.
+
+Respaldo y restauración masiva sin re-correr el ETL ni gastar en OpenAI.
+Un snapshot es un directorio con un archivo por proyecto:
+
+  data/snapshots/{nombre}/manifest.json          índice, dimensión, archivos y filas
+  data/snapshots/{nombre}/{project_id}.parquet   (o .arrow, IPC)
+
+Cada fila: id, namespace, project_id, vector (float16 little-endian en un
+fixed_size_binary, la mitad de espacio que float32), metadata (JSON) y el
+record del ChunkStore (JSON, si existe), así el snapshot restaura también
+el texto que ya no vive en Pinecone.
+
+  - export: recorre los namespaces (list → fetch) en streaming; memoria acotada
+            a un row group por proyecto
+  - import: lee row group por row group, upserts en paralelo con reintentos y
+            checkpoint por archivo (data/snapshots/{nombre}/import_{destino}.json)
+            para retomar donde quedó
+
+Requiere `pyarrow` (opcional; solo para snapshots).
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+from pia_rag.config import settings
+from pia_rag.storage.chunk_store import ChunkStore
+from pia_rag.storage.vector_store import VectorStore, upsert_with_retry
+
+_NO_PROJECT = "_sin_proyecto"
+
+
+def _arrow():
+    try:
+        import numpy as np
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("Los snapshots requieren pyarrow: pip install pyarrow") from e
+    return np, pa, pq
+
+
+def _safe_name(value: str) -> str:
+    return re.sub(r"[^\w.-]", "_", value) or _NO_PROJECT
+
+
+def _schema(pa, dimension: int):
+    return pa.schema([
+        ("id", pa.string()),
+        ("namespace", pa.string()),
+        ("project_id", pa.string()),
+        ("vector", pa.binary(dimension * 2)),     # float16 LE
+        ("metadata", pa.string()),
+        ("chunk", pa.string()),
+    ])
+
+
+class _Writer:
+    """Escritor de un archivo del snapshot (Parquet o Arrow IPC), por row groups."""
+
+    def __init__(self, path: Path, schema, fmt: str):
+        _, pa, pq = _arrow()
+        self._pa = pa
+        self._schema = schema
+        self._rows: list[dict] = []
+        self.count = 0
+        if fmt == "parquet":
+            self._writer = pq.ParquetWriter(str(path), schema, compression="zstd")
+            self._write = self._writer.write_table
+        else:
+            self._sink = pa.OSFile(str(path), "wb")
+            self._writer = pa.ipc.new_file(self._sink, schema)
+            self._write = self._writer.write_table
+
+    def add(self, row: dict):
+        self._rows.append(row)
+        if len(self._rows) >= settings.snapshot_row_group:
+            self.flush()
+
+    def flush(self):
+        if self._rows:
+            self._write(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self.count += len(self._rows)
+            self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+        if hasattr(self, "_sink"):
+            self._sink.close()
+
+
+def _open_groups(path: Path):
+    """(cantidad de row groups, función que lee el i-ésimo como pa.Table)."""
+    _, pa, pq = _arrow()
+    if path.suffix == ".parquet":
+        pf = pq.ParquetFile(str(path))
+        return pf.num_row_groups, pf.read_row_group
+    reader = pa.ipc.open_file(pa.memory_map(str(path), "r"))
+    return reader.num_record_batches, lambda i: pa.Table.from_batches([reader.get_batch(i)])
+
+
+def _atomic_write(path: Path, data: dict):
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+    tmp.replace(path)
+
+
+# ── Export ──────────────────────────────────────────────────────────────
+
+def export_snapshot(
+    store: VectorStore,
+    name: str,
+    project_id: Optional[str] = None,
+    fmt: str = "parquet",
+    chunk_store: Optional[ChunkStore] = None,
+) -> dict:
+    """Exporta el índice (o un proyecto) a data/snapshots/{name}/. Retorna el manifiesto."""
+    np, pa, _ = _arrow()
+    if fmt not in ("parquet", "arrow"):
+        raise ValueError(f"Formato de snapshot desconocido: {fmt!r}")
+
+    stats = store.describe_index_stats()
+    dimension = stats.dimension if hasattr(stats, "dimension") else stats.get("dimension", 0)
+    ns_stats = stats.namespaces if hasattr(stats, "namespaces") else stats.get("namespaces", {})
+    namespaces = sorted(ns_stats or {}) or [""]
+    if project_id and project_id in namespaces:
+        namespaces = [project_id]
+
+    out_dir = settings.snapshots_dir / name
+    out_dir.mkdir(parents=True, exist_ok=True)
+    schema = _schema(pa, dimension)
+    writers: dict[str, _Writer] = {}
+    total = logged = 0
+    started = time.time()
+
+    try:
+        for namespace in namespaces:
+            for page in store.list(namespace=namespace):
+                fetched = store.fetch(ids=page, namespace=namespace)
+                vectors = fetched.vectors if hasattr(fetched, "vectors") else fetched.get("vectors", {})
+                records = chunk_store.get_many(list(vectors)) if chunk_store is not None else {}
+                for vid, vec in vectors.items():
+                    meta = (vec.metadata if hasattr(vec, "metadata") else vec.get("metadata")) or {}
+                    values = vec.values if hasattr(vec, "values") else vec.get("values")
+                    pid = meta.get("project_id") or namespace or _NO_PROJECT
+                    if project_id and pid != project_id:
+                        continue
+                    writer = writers.get(pid)
+                    if writer is None:
+                        writer = writers[pid] = _Writer(out_dir / f"{_safe_name(pid)}.{fmt}", schema, fmt)
+                    chunk = records.get(vid)
+                    writer.add({
+                        "id": vid,
+                        "namespace": namespace,
+                        "project_id": pid,
+                        "vector": np.asarray(values, dtype="<f2").tobytes(),
+                        "metadata": json.dumps(meta, ensure_ascii=False),
+                        "chunk": json.dumps(chunk, ensure_ascii=False) if chunk else None,
+                    })
+                    total += 1
+                if total // 10_000 > logged:
+                    logged = total // 10_000
+                    logger.info(f"Snapshot {name}: {total} vectors exportados...")
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    manifest = {
+        "name": name,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "backend": settings.vector_store_backend,
+        "index": settings.pinecone_index_name,
+        "dimension": dimension,
+        "format": fmt,
+        "vector_dtype": "float16",
+        "files": {
+            pid: {"file": f"{_safe_name(pid)}.{fmt}", "rows": w.count}
+            for pid, w in sorted(writers.items())
+        },
+        "total": total,
+    }
+    _atomic_write(out_dir / "manifest.json", manifest)
+    logger.info(f"Snapshot {name}: {total} vectors, {len(writers)} archivos en {time.time() - started:.0f}s")
+    return manifest
+
+
+# ── Import ──────────────────────────────────────────────────────────────
+
+def import_snapshot(
+    store: VectorStore,
+    name: str,
+    target: str,
+    project_id: Optional[str] = None,
+    chunk_store: Optional[ChunkStore] = None,
+    workers: Optional[int] = None,
+) -> dict:
+    """
+    Carga un snapshot en `store`. `target` identifica el destino en el
+    checkpoint (p.ej. "pinecone-api-rag-mvp"); re-ejecutar con el mismo
+    destino retoma desde el último row group confirmado.
+    """
+    np, _, _ = _arrow()
+    snap_dir = settings.snapshots_dir / name
+    manifest_path = snap_dir / "manifest.json"
+    if not manifest_path.exists():
+        raise FileNotFoundError(f"Snapshot incompleto o inexistente: {snap_dir}")
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+
+    stats = store.describe_index_stats()
+    target_dim = stats.dimension if hasattr(stats, "dimension") else stats.get("dimension", 0)
+    if target_dim and target_dim != manifest["dimension"]:
+        raise ValueError(f"Dimensión del destino ({target_dim}) ≠ snapshot ({manifest['dimension']})")
+
+    checkpoint_path = snap_dir / f"import_{_safe_name(target)}.json"
+    checkpoint: dict[str, int] = (
+        json.loads(checkpoint_path.read_text(encoding="utf-8")) if checkpoint_path.exists() else {}
+    )
+    batch_size = settings.pinecone_upsert_batch
+    result = {"imported": 0, "skipped_groups": 0, "files": 0}
+
+    with ThreadPoolExecutor(max_workers=workers or settings.pinecone_upsert_workers) as pool:
+        for pid, info in manifest["files"].items():
+            if project_id and pid != project_id:
+                continue
+            n_groups, read_group = _open_groups(snap_dir / info["file"])
+            done = checkpoint.get(info["file"], 0)
+            result["skipped_groups"] += min(done, n_groups)
+
+            for g in range(done, n_groups):
+                rows = read_group(g).to_pylist()
+                by_namespace: dict[str, list[dict]] = {}
+                records: dict[str, dict] = {}
+                for row in rows:
+                    by_namespace.setdefault(row["namespace"], []).append({
+                        "id": row["id"],
+                        "values": np.frombuffer(row["vector"], dtype="<f2").astype("float32").tolist(),
+                        "metadata": json.loads(row["metadata"]),
+                    })
+                    if row["chunk"]:
+                        records[row["id"]] = json.loads(row["chunk"])
+
+                # Text first, like upsert_chunks: a restored vector is never un-hydratable
+                if chunk_store is not None and records:
+                    chunk_store.put_records(records)
+                futures = [
+                    pool.submit(upsert_with_retry, store, vectors[i: i + batch_size], namespace)
+                    for namespace, vectors in by_namespace.items()
+                    for i in range(0, len(vectors), batch_size)
+                ]
+                for future in futures:
+                    future.result()     # a failed group stops the import; the checkpoint stays before it
+
+                checkpoint[info["file"]] = g + 1
+                _atomic_write(checkpoint_path, checkpoint)
+                result["imported"] += len(rows)
+                logger.info(f"Import {name}/{info['file']}: row group {g + 1}/{n_groups} ({len(rows)} vectors)")
+            result["files"] += 1
+
+    return result
@@ -0,0 +1,104 @@
+"""
+storage/upsert_outbox.py — Outbox en disco para upserts a Pinecone que fallaron.
+
+Antes un batch que fallaba se logueaba y se perdía (con embeddings ya pagados),
+y el PDF igual quedaba "indexed". Ahora cada batch fallido se guarda con sus
+vectores en data/outbox/*.json y se reintenta con `python main.py drain-outbox`
+(o al inicio del siguiente ingest del proyecto). Un PDF solo pasa a "indexed"
+cuando no le quedan batches en el outbox.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Optional
+
+from loguru import logger
+
+from pia_rag.config import settings
+
+
+class UpsertOutbox:
+    """
+    Cola persistente de batches de vectores pendientes de upsert.
+
+    Uso:
+        outbox = UpsertOutbox()
+        outbox.spool(vectors, files=[("hyc", "Cap 3.pdf")])
+        confirmed = outbox.drain(index.upsert)
+    """
+
+    def __init__(self, directory: Optional[Path] = None):
+        self._dir = directory or settings.outbox_dir
+        self._dir.mkdir(parents=True, exist_ok=True)
+
+    def spool(
+        self,
+        vectors: list[dict],
+        files: list[tuple[str, str]],
+        error: str = "",
+        namespace: str = "",
+    ) -> Path:
+        """Guarda un batch fallido. `files` = [(project_id, filename)] de sus vectores."""
+        projects = sorted({p for p, _ in files})
+        tag = hashlib.sha1("|".join(f for _, f in sorted(files)).encode()).hexdigest()[:10]
+        ts = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        path = self._dir / f"{'+'.join(projects)}__{tag}__{ts}_{uuid.uuid4().hex[:8]}.json"
+        path.write_text(json.dumps({
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "files": [list(f) for f in sorted(set(files))],
+            "attempts": 1,
+            "last_error": error,
+            "namespace": namespace,
+            "vectors": vectors,
+        }, ensure_ascii=False), encoding="utf-8")
+        logger.warning(f"Outbox: {len(vectors)} vectors guardados en {path.name}")
+        return path
+
+    def entries(self, project_id: Optional[str] = None) -> list[Path]:
+        """Batches pendientes (opcionalmente solo los de un proyecto)."""
+        paths = sorted(self._dir.glob("*.json"))
+        if project_id is None:
+            return paths
+        return [p for p in paths if project_id in p.name.split("__", 1)[0].split("+")]
+
+    def pending_files(self, project_id: Optional[str] = None) -> set[tuple[str, str]]:
+        """(project_id, filename) con vectores todavía sin confirmar."""
+        pending: set[tuple[str, str]] = set()
+        for path in self.entries(project_id):
+            entry = json.loads(path.read_text(encoding="utf-8"))
+            pending.update((p, f) for p, f in entry["files"])
+        return pending
+
+    def drain(
+        self,
+        upsert: Callable[[list[dict], str], None],
+        project_id: Optional[str] = None,
+    ) -> set[tuple[str, str]]:
+        """
+        Reintenta todos los batches pendientes. Retorna los (project_id, filename)
+        que quedaron completamente confirmados.
+        """
+        touched: set[tuple[str, str]] = set()
+        ok, failed = 0, 0
+        for path in self.entries(project_id):
+            entry = json.loads(path.read_text(encoding="utf-8"))
+            touched.update((p, f) for p, f in entry["files"])
+            try:
+                upsert(entry["vectors"], entry.get("namespace", ""))
+                path.unlink()
+                ok += 1
+            except Exception as e:
+                entry["attempts"] += 1
+                entry["last_error"] = str(e)
+                path.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+                failed += 1
+                logger.warning(f"Outbox: {path.name} sigue fallando (intento {entry['attempts']}): {e}")
+
+        if ok or failed:
+            logger.info(f"Outbox: {ok} batches confirmados, {failed} siguen pendientes")
+        return touched - self.pending_files(project_id)
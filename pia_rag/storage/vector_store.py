@@ -0,0 +1,205 @@
+"""
+storage/vector_store.py — Interfaz común de los backends de vectores.
+
+PineconeClient habla con un `VectorStore`, que tiene la forma de `pinecone.Index`
+(upsert / query / fetch / update / delete / list / describe_index_stats, con
+namespaces y filtros de metadata estilo Pinecone). Backends:
+
+  - "pinecone": índice hospedado (PineconeVectorStore, delega en pinecone.Index)
+  - "faiss":    FAISS en proceso (HNSW/IVF) + sidecar de metadata (FaissVectorStore)
+  - "local":    stand-in en memoria para tests (LocalPineconeIndex)
+
+Se elige con settings.vector_store_backend.
+"""
+
+from __future__ import annotations
+
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from loguru import logger
+
+from pia_rag.config import settings
+
+
+def matches_filter(metadata: dict, flt: Optional[dict]) -> bool:
+    """Evalúa un filtro estilo Pinecone ($eq/$ne/$in/$nin/$gt/$gte/$lt/$lte/$and/$or)."""
+    if not flt:
+        return True
+    for key, cond in flt.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, c) for c in cond):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_filter(metadata, c) for c in cond):
+                return False
+            continue
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        value = metadata.get(key)
+        for op, target in cond.items():
+            if op == "$eq" and value != target:
+                return False
+            if op == "$ne" and value == target:
+                return False
+            if op == "$in" and value not in target:
+                return False
+            if op == "$nin" and value in target:
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if op == "$gt" and not value > target:
+                    return False
+                if op == "$gte" and not value >= target:
+                    return False
+                if op == "$lt" and not value < target:
+                    return False
+                if op == "$lte" and not value <= target:
+                    return False
+    return True
+
+
+def vector_field(vector: Any, name: str, default=None):
+    """Campo de un vector de upsert: dict, tupla (id, values, metadata) u objeto."""
+    if isinstance(vector, dict):
+        return vector.get(name, default)
+    if isinstance(vector, (tuple, list)):
+        return {"id": vector[0], "values": vector[1], "metadata": vector[2] if len(vector) > 2 else {}}.get(name, default)
+    return getattr(vector, name, default)
+
+
+class VectorStore(ABC):
+    """Operaciones sobre vectores que usa PineconeClient (misma firma que pinecone.Index)."""
+
+    @abstractmethod
+    def upsert(self, vectors: list, namespace: str = "", **kwargs):
+        ...
+
+    @abstractmethod
+    def query(self, vector: list[float], top_k: int = 10, namespace: str = "",
+              filter: Optional[dict] = None, include_metadata: bool = False,
+              include_values: bool = False, **kwargs):
+        """Retorna un objeto con `.matches` (id, score, metadata, values)."""
+
+    @abstractmethod
+    def fetch(self, ids: list[str], namespace: str = "", **kwargs):
+        """Retorna un objeto con `.vectors` = {id: (id, values, metadata)}."""
+
+    @abstractmethod
+    def update(self, id: str, values: Optional[list[float]] = None,
+               set_metadata: Optional[dict] = None, namespace: str = "", **kwargs):
+        ...
+
+    @abstractmethod
+    def delete(self, ids: Optional[list[str]] = None, delete_all: bool = False,
+               namespace: str = "", filter: Optional[dict] = None, **kwargs):
+        ...
+
+    @abstractmethod
+    def list(self, prefix: Optional[str] = None, namespace: str = "", **kwargs) -> Iterator[list[str]]:
+        """Páginas de IDs."""
+
+    @abstractmethod
+    def describe_index_stats(self, **kwargs):
+        """Objeto con total_vector_count, dimension, index_fullness y namespaces."""
+
+
+class PineconeVectorStore(VectorStore):
+    """Backend hospedado: delega en `pinecone.Index` (conexión por host directo)."""
+
+    def __init__(self, index_name: Optional[str] = None, host: Optional[str] = None):
+        from pinecone import Pinecone
+
+        self._pc = Pinecone(api_key=settings.pinecone_api_key)
+        if index_name and index_name != settings.pinecone_index_name:
+            # Another index: resolve its host by name unless one is given
+            self._index = self._pc.Index(name=index_name, host=host) if host else self._pc.Index(name=index_name)
+        else:
+            self._index = self._pc.Index(
+                name=settings.pinecone_index_name,
+                host=host or settings.pinecone_host,
+            )
+
+    def upsert(self, vectors, namespace="", **kwargs):
+        return self._index.upsert(vectors=vectors, namespace=namespace, **kwargs)
+
+    def query(self, vector, top_k=10, namespace="", filter=None,
+              include_metadata=False, include_values=False, **kwargs):
+        return self._index.query(
+            vector=vector, top_k=top_k, namespace=namespace, filter=filter,
+            include_metadata=include_metadata, include_values=include_values, **kwargs,
+        )
+
+    def fetch(self, ids, namespace="", **kwargs):
+        return self._index.fetch(ids=ids, namespace=namespace, **kwargs)
+
+    def update(self, id, values=None, set_metadata=None, namespace="", **kwargs):
+        return self._index.update(id=id, values=values, set_metadata=set_metadata, namespace=namespace, **kwargs)
+
+    def delete(self, ids=None, delete_all=False, namespace="", filter=None, **kwargs):
+        if delete_all:
+            return self._index.delete(delete_all=True, namespace=namespace, **kwargs)
+        if filter:
+            return self._index.delete(filter=filter, namespace=namespace, **kwargs)
+        return self._index.delete(ids=ids, namespace=namespace, **kwargs)
+
+    def list(self, prefix=None, namespace="", **kwargs):
+        return self._index.list(prefix=prefix, namespace=namespace, **kwargs)
+
+    def describe_index_stats(self, **kwargs):
+        return self._index.describe_index_stats(**kwargs)
+
+
+def upsert_with_retry(store: VectorStore, vectors: list, namespace: str = ""):
+    """store.upsert con reintentos y backoff exponencial (settings.pinecone_upsert_retries)."""
+    for attempt in range(settings.pinecone_upsert_retries):
+        try:
+            store.upsert(vectors=vectors, namespace=namespace)
+            return
+        except Exception as e:
+            if attempt == settings.pinecone_upsert_retries - 1:
+                raise
+            delay = 2 ** attempt
+            logger.warning(f"Upsert intento {attempt + 1} falló: {e} — reintento en {delay}s")
+            time.sleep(delay)
+
+
+def ensure_pinecone_index(name: str, dimension: int):
+    """Crea un índice serverless (cosine) si no existe, en la misma nube/región."""
+    from pinecone import Pinecone, ServerlessSpec
+
+    pc = Pinecone(api_key=settings.pinecone_api_key)
+    if name in pc.list_indexes().names():
+        return
+    pc.create_index(
+        name=name,
+        dimension=dimension,
+        metric="cosine",
+        spec=ServerlessSpec(cloud=settings.pinecone_cloud, region=settings.pinecone_region),
+    )
+
+
+def create_vector_store(
+    backend: Optional[str] = None,
+    index_name: Optional[str] = None,
+    host: Optional[str] = None,
+    directory: Optional[Path] = None,
+) -> VectorStore:
+    """
+    Instancia un backend. Por defecto el configurado en settings; los
+    argumentos permiten abrir otro (p.ej. el destino de una migración).
+    """
+    backend = (backend or settings.vector_store_backend).lower()
+    if backend == "pinecone":
+        return PineconeVectorStore(index_name=index_name, host=host)
+    if backend == "faiss":
+        from pia_rag.storage.faiss_store import FaissVectorStore
+        return FaissVectorStore(directory or settings.faiss_dir)
+    if backend == "local":
+        from pia_rag.storage.local_index import LocalPineconeIndex
+        return LocalPineconeIndex(directory or settings.data_dir / "local_pinecone.json")
+    raise ValueError(f"vector_store_backend desconocido: {backend!r}")